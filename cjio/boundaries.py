@@ -0,0 +1,288 @@
+
+"""Flattened boundaries of the geometries, like the rows of a CSR matrix.
+
+The "boundaries" of a geometry of depth d (eg 3 for a MultiSurface: surfaces,
+rings, indices) are stored as d-1 arrays of offsets and one array of indices:
+the i-th list of the first level goes from offsets[0][i] to offsets[0][i+1]
+in the next level, and so on until the indices. The order of the indices is
+the one of a depth-first walk of the nested lists, thus the nested lists are
+rebuilt exactly (unflatten). The same works for the "values" of the
+semantics/materials/textures, whose nulls become -1.
+
+The index remapping, offsetting and gathering are then NumPy operations on
+the arrays of indices instead of recursive walks over the nested lists.
+"""
+
+import itertools
+
+import numpy as np
+
+
+#-- depth of the arrays of boundaries
+DEPTHS = {
+    'MultiPoint': 1,
+    'GeometryInstance': 1,
+    'MultiLineString': 2,
+    'MultiSurface': 3,
+    'CompositeSurface': 3,
+    'Solid': 4,
+    'MultiSolid': 5,
+    'CompositeSolid': 5
+}
+
+
+def index_dtype(maximum):
+    if maximum > np.iinfo(np.int32).max:
+        return np.int64
+    return np.int32
+
+
+def _flatten(a, depth):
+    #-- (offsets as lists, the lists of the last level, their items)
+    items = a
+    offsets = []
+    leaves = [a]
+    for k in range(depth - 1):
+        offsets.append([0] + np.cumsum([len(each) for each in items], dtype=np.int64).tolist())
+        leaves = items
+        items = list(itertools.chain.from_iterable(items))
+    return (offsets, leaves, items)
+
+
+def _indices(items, nulls=False):
+    #-- the array of the indices, None if they are not all integers
+    if nulls and (None in items):
+        items = [-1 if y is None else y for y in items]
+    try:
+        indices = np.fromiter(items, dtype=np.int64, count=len(items))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if (len(indices) > 0) and (indices.min() < (-1 if nulls else 0)):
+        return None
+    return indices
+
+
+def flatten(a, depth, nulls=False):
+    """Flatten nested lists of indices
+
+    :param a: nested lists (eg the boundaries of a geometry)
+    :param depth: number of levels of lists
+    :param nulls: True if the indices can be null (they become -1)
+    :returns: (offsets, indices) -- a list of depth-1 int64 arrays of offsets
+        and the array of indices (int32, or int64 if needed), or None if the
+        lists are not regular
+    """
+    try:
+        offsets, leaves, items = _flatten(a, depth)
+    except TypeError:
+        return None
+    indices = _indices(items, nulls)
+    if indices is None:
+        return None
+    if len(indices) > 0:
+        indices = indices.astype(index_dtype(indices.max()))
+    return ([np.array(o, dtype=np.int64) for o in offsets], indices)
+
+
+def unflatten(offsets, indices, nulls=False):
+    """Nested lists from flattened ones (the inverse of flatten())"""
+    items = indices.tolist()
+    if nulls and (-1 in items):
+        items = [None if i == -1 else i for i in items]
+    for o in reversed(offsets):
+        if isinstance(o, np.ndarray):
+            o = o.tolist()
+        items = [items[b:e] for b, e in zip(o, o[1:])]
+    return items
+
+
+def _walk(a, vs):
+    for each in a:
+        if isinstance(each, list):
+            _walk(each, vs)
+        elif each is not None:
+            vs.append(each)
+
+
+def indices(g):
+    """All the vertex indices of a geometry (in the order of the boundaries)"""
+    if "boundaries" not in g:
+        return np.zeros(0, dtype=np.int64)
+    re = None
+    if g.get("type") in DEPTHS:
+        re = flatten(g["boundaries"], DEPTHS[g["type"]])
+    if re is None:
+        vs = []
+        _walk(g["boundaries"], vs)
+        return np.array(vs, dtype=np.int64)
+    return re[1]
+
+
+def first_occurrences(ids):
+    """The unique values of an array, in the order of their first occurrence"""
+    u, first = np.unique(ids, return_index=True)
+    return u[np.argsort(first)]
+
+
+def _rebuild(a, it):
+    #-- the same nested lists, with the (not null) indices taken from it
+    return [_rebuild(each, it) if isinstance(each, list) else (None if each is None else next(it)) for each in a]
+
+
+def map_array(a, depth, f, nulls=False):
+    """Apply f to the indices of nested lists (f takes and returns a NumPy
+    array of the indices, without the nulls); the new lists are returned"""
+    re = flatten(a, depth, nulls)
+    if re is None:
+        vs = []
+        _walk(a, vs)
+        return _rebuild(a, iter(f(np.array(vs, dtype=np.int64)).tolist()))
+    offsets, ids = re
+    ids = ids.astype(np.int64)
+    if nulls:
+        valid = ids != -1
+        ids[valid] = f(ids[valid])
+    else:
+        ids = f(ids)
+    return unflatten(offsets, ids, nulls)
+
+
+def _leaf_starts(offsets):
+    #-- the range of the indices of each list of the first level
+    pos = offsets[0]
+    for o in offsets[1:]:
+        pos = [o[p] for p in pos]
+    return pos
+
+
+class Geometries:
+    """The boundaries of several geometries flattened together.
+
+    The geometries of the same depth are flattened at once (with one more
+    level of offsets for the geometries). The indices of all the geometries
+    are concatenated in one array, in the order of the geometries: the i-th
+    geometry has the indices[starts[i]:starts[i+1]]. When they are updated,
+    the lists of the last level (eg the rings) are modified in place.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = list(geometries)
+        bydepth = {}
+        irregular = []
+        for i, g in enumerate(self.geometries):
+            if ("boundaries" in g) and (g.get("type") in DEPTHS):
+                bydepth.setdefault(DEPTHS[g["type"]], []).append(i)
+            elif "boundaries" in g:
+                irregular.append(i)
+        #-- groups: (positions of the geometries, offsets or None, lists of the last level, indices)
+        self.groups = []
+        for depth, positions in bydepth.items():
+            re = self._flatten_group(positions, depth)
+            if re is None:
+                #-- find the irregular ones
+                ok = []
+                for i in positions:
+                    if flatten(self.geometries[i]["boundaries"], depth) is None:
+                        irregular.append(i)
+                    else:
+                        ok.append(i)
+                positions = ok
+                re = self._flatten_group(positions, depth)
+            self.groups.append((positions, re[0], re[1], re[2]))
+        for i in irregular:
+            vs = []
+            _walk(self.geometries[i]["boundaries"], vs)
+            self.groups.append(([i], None, None, np.array(vs, dtype=np.int64)))
+        n = len(self.geometries)
+        if (len(self.groups) == 1) and (len(self.groups[0][0]) == n) and (self.groups[0][1] is not None):
+            #-- all the geometries have the same depth
+            self.order = None
+            self.starts = np.array(_leaf_starts(self.groups[0][1]), dtype=np.int64)
+            self.indices = self.groups[0][3]
+            return
+        #-- from the order of the groups to the order of the geometries
+        first = np.zeros(n, dtype=np.int64)
+        lengths = np.zeros(n, dtype=np.int64)
+        base = 0
+        for positions, offsets, leaves, ids in self.groups:
+            if offsets is None:
+                ls = np.array([0, len(ids)], dtype=np.int64)
+            else:
+                ls = np.array(_leaf_starts(offsets), dtype=np.int64)
+            first[positions] = base + ls[:-1]
+            lengths[positions] = np.diff(ls)
+            base += len(ids)
+        self.starts = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.starts[1:])
+        self.order = np.repeat(first - self.starts[:-1], lengths) + np.arange(self.starts[-1], dtype=np.int64)
+        if len(self.groups) > 0:
+            self.indices = np.concatenate([group[3] for group in self.groups])[self.order]
+        else:
+            self.indices = np.zeros(0, dtype=np.int64)
+
+    def _flatten_group(self, positions, depth):
+        try:
+            offsets, leaves, items = _flatten([self.geometries[i]["boundaries"] for i in positions], depth + 1)
+        except TypeError:
+            return None
+        indices = _indices(items)
+        if indices is None:
+            return None
+        return (offsets, leaves, indices)
+
+    @classmethod
+    def of_cityobjects(cls, j, ids=None):
+        """The geometries of the CityObjects (all of them, or the ids)"""
+        if ids is None:
+            ids = j["CityObjects"].keys()
+        return cls(g for theid in ids for g in j["CityObjects"][theid].get("geometry", []))
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def indices_of(self, i):
+        return self.indices[self.starts[i]:self.starts[i + 1]]
+
+    def update(self, newindices):
+        """Replace the indices of all the geometries (an array as long as
+        self.indices), the boundaries are rebuilt"""
+        newindices = np.asarray(newindices, dtype=np.int64)
+        if self.order is None:
+            grouped = newindices
+        else:
+            grouped = np.empty_like(newindices)
+            grouped[self.order] = newindices
+        base = 0
+        groups = []
+        for positions, offsets, leaves, ids in self.groups:
+            ids = grouped[base:base + len(ids)]
+            base += len(ids)
+            if offsets is None:
+                g = self.geometries[positions[0]]
+                g["boundaries"] = _rebuild(g["boundaries"], iter(ids.tolist()))
+            else:
+                items = ids.tolist()
+                o = offsets[-1]
+                for leaf, b, e in zip(leaves, o, o[1:]):
+                    leaf[:] = items[b:e]
+            groups.append((positions, offsets, leaves, ids))
+        self.groups = groups
+        self.indices = newindices
+
+    def remap(self, newids):
+        """Replace each index i by newids[i]"""
+        self.update(np.asarray(newids, dtype=np.int64)[self.indices])
+
+    def offset(self, offset):
+        self.update(self.indices + offset)
+
+    def compact(self, n=0):
+        """Renumber the indices 0, 1, 2... keeping only the used ones, in
+        their order
+
+        :param n: the number of vertices (the largest index + 1 if 0)
+        :returns: the array of the used (old) indices, sorted
+        """
+        used = np.bincount(self.indices, minlength=n) > 0
+        self.remap(np.cumsum(used) - 1)
+        return np.flatnonzero(used)
@@ -12,20 +12,28 @@ from pkg_resources import resource_filename
 from pkg_resources import resource_listdir
 import copy
 import random
+import gc
+import contextlib
+import warnings
+import concurrent.futures
+import functools
+import itertools
 from io import StringIO
 import numpy as np
 import pyproj
 from sys import platform
 
-MODULE_EARCUT_AVAILABLE = True
-try:
-    import mapbox_earcut
-except ImportError as e:
-    MODULE_EARCUT_AVAILABLE = False
-
 from cjio import validation
 from cjio import subset
-from cjio import geom_help
+from cjio import stream
+from cjio import jsonbackend
+from cjio import compression
+from cjio import index
+from cjio import boundaries
+from cjio import triangulation
+from cjio import spatialindex
+from cjio import query
+from cjio.triangulation import MODULE_EARCUT_AVAILABLE
 from cjio import errors
 from cjio.errors import InvalidOperation
 
@@ -47,95 +55,521 @@ TOPLEVEL = ('Building',
             'Tunnel',
             'WaterBody')
 
+#-- number of vertices written at once when streaming
+VERTICES_CHUNK = 100000
+#-- number of CityObjects whose geometries are processed at once when streaming
+CITYOBJECTS_BATCH = 100
+
+
+def reader(file, ignore_duplicate_keys=False, json_backend=None):
+    return CityJSON(file=file, ignore_duplicate_keys=ignore_duplicate_keys, json_backend=json_backend)
+
+
+def iter_cityobjects(file, ignore_duplicate_keys=False):
+    """Iterate over the CityObjects of a CityJSON file, one at a time
+
+    The file is never loaded completely in memory: the root properties are
+    parsed first, then the CityObjects are decoded one by one. The vertices
+    of a CityObject are obtained with CityJSONStream.get_vertices().
+
+    :param file: CityJSON file (must be seekable)
+    :returns: generator of (id, CityObject)
+    :raises: ValueError, IOError
+    """
+    return CityJSONStream(file, ignore_duplicate_keys).iter_cityobjects()
+
+@contextlib.contextmanager
+def no_gc():
+    """Pause the garbage collector while millions of lists are built (eg the
+    boundaries), it would otherwise go over all of them many times; none of
+    them is part of a cycle."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def vertices_array(vertices, transform=False):
+    """The vertices as a (N, 3) NumPy array: int64 with a transform or if all
+    the coordinates are integers (they are saved as integers), float64 otherwise"""
+    if transform:
+        return np.asarray(vertices, dtype=np.int64).reshape((-1, 3))
+    v = np.asarray(vertices)
+    if (v.size > 0) and (v.dtype.kind in 'iu'):
+        return v.astype(np.int64, copy=False).reshape((-1, 3))
+    return v.astype(np.float64, copy=False).reshape((-1, 3))
+
+
+#-- the 13 cells after a cell (the other 13 neighbours are before)
+NEIGHBOUR_CELLS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)]
+
+
+def _cell_pairs(ukeys, keys2, starts, counts):
+    #-- the pairs of positions (in the sorted vertices) of the vertices of the
+    #-- cells with the keys2 (one per cell) and of the cells ukeys
+    pos = np.searchsorted(ukeys, keys2)
+    pos[pos == len(ukeys)] = 0
+    a = np.flatnonzero(ukeys[pos] == keys2)
+    b = pos[a]
+    m = counts[a] * counts[b]
+    pairid = np.repeat(np.arange(len(a)), m)
+    k = np.arange(m.sum()) - np.repeat(np.cumsum(m) - m, m)
+    cb = counts[b][pairid]
+    return (starts[a][pairid] + k // cb, starts[b][pairid] + k % cb)
+
+
+def _neighbour_ranks(u):
+    #-- for each value of the sorted u, the positions of value-1 and value+1 in u, -1 if not there
+    re = {0: np.arange(len(u))}
+    for d in (-1, 1):
+        pos = np.searchsorted(u, u + d)
+        pos[pos == len(u)] = 0
+        pos[u[pos] != u + d] = -1
+        re[d] = pos
+    return re
+
+
+def weld_vertices(v, tolerance):
+    """Clusters of vertices closer than the tolerance to their first vertex
+
+    The vertices are hashed in a grid of cells of the size of the tolerance,
+    only the vertices in the same or in neighbouring cells are compared. The
+    clusters are made greedily in the order of the vertices: a vertex not in
+    a cluster yet starts one, with the vertices (not in a cluster yet) closer
+    than the tolerance to it. A vertex is thus never further than the
+    tolerance from the first vertex of its cluster.
+
+    :param v: (N, 3) array of the vertices
+    :param tolerance: the distance (> 0)
+    :returns: the label of each vertex, the index of the first vertex of its cluster
+    """
+    labels = np.arange(len(v))
+    if len(v) == 0:
+        return labels
+    cells = np.floor(v / tolerance).astype(np.int64)
+    #-- the key of a cell is made of the ranks of its x, y and z (fits in an int64 for any extent)
+    u = []
+    r = []
+    for k in range(3):
+        uk, rk = np.unique(cells[:, k], return_inverse=True)
+        u.append(uk)
+        r.append(rk.ravel())
+    if len(u[0]) * len(u[1]) * len(u[2]) < 2**62:
+        def key(x, y, z):
+            return (x * len(u[1]) + y) * len(u[2]) + z
+    else:
+        #-- a missing (x, y) gives the key of another cell, its vertices are too far anyway
+        uxy = np.unique(r[0] * len(u[1]) + r[1])
+        def key(x, y, z):
+            xy = np.searchsorted(uxy, x * len(u[1]) + y)
+            return xy * len(u[2]) + z
+    keys = key(r[0], r[1], r[2])
+    order = np.argsort(keys, kind='stable')
+    ukeys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    #-- the ranks of the x, y and z of each cell, and of their neighbours
+    rc = [each[order[starts]] for each in r]
+    nr = [_neighbour_ranks(each) for each in u]
+    pi = []
+    pj = []
+    #-- the pairs in the same cell
+    ia, ib = _cell_pairs(ukeys, ukeys, starts, counts)
+    pi.append(ia[ia < ib])
+    pj.append(ib[ia < ib])
+    for dx, dy, dz in NEIGHBOUR_CELLS:
+        nx = nr[0][dx][rc[0]]
+        ny = nr[1][dy][rc[1]]
+        nz = nr[2][dz][rc[2]]
+        ok = (nx >= 0) & (ny >= 0) & (nz >= 0)
+        keys2 = np.full(len(ukeys), -1, dtype=np.int64)
+        keys2[ok] = key(nx[ok], ny[ok], nz[ok])
+        ia, ib = _cell_pairs(ukeys, keys2, starts, counts)
+        pi.append(ia)
+        pj.append(ib)
+    i = order[np.concatenate(pi)]
+    j = order[np.concatenate(pj)]
+    close = ((v[i] - v[j]) ** 2).sum(axis=1) <= tolerance ** 2
+    i = i[close]
+    j = j[close]
+    #-- both directions
+    a = np.concatenate((i, j))
+    b = np.concatenate((j, i))
+    done = np.ones(len(v), dtype=bool)
+    done[a] = False
+    #-- in each round, the vertices without a smaller close vertex left start a
+    #-- cluster, and the vertices close to them join the first one
+    while not done.all():
+        live = ~done[a] & ~done[b]
+        a = a[live]
+        b = b[live]
+        blocked = np.zeros(len(v), dtype=bool)
+        blocked[a[b < a]] = True
+        first = ~done & ~blocked
+        joins = first[b] & ~first[a]
+        np.minimum.at(labels, a[joins], b[joins])
+        done |= first
+        done[a[joins]] = True
+    return labels
+
+
+#-- number of vertices transformed at once by each process (reproject)
+REPROJECT_CHUNK = 1000000
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(epsg_from, epsg_to):
+    """The pyproj Transformer between two EPSG (cached)"""
+    return pyproj.Transformer.from_crs('epsg:%d' % epsg_from, 'epsg:%d' % epsg_to, always_xy=True)
+
+
+def _reproject_chunk(v, epsg_from, epsg_to, transform=None):
+    #-- also in a worker process
+    if transform is not None:
+        v = (v * np.array(transform["scale"])) + np.array(transform["translate"])
+    x, y, z = get_transformer(epsg_from, epsg_to).transform(v[:, 0], v[:, 1], v[:, 2])
+    return np.column_stack((x, y, z)).astype(np.float64)
+
+
+def reproject_vertices(v, epsg_from, epsg_to, transform=None, processes=None):
+    """Reproject a (N, 3) array of vertices
+
+    :param v: the vertices (integers if there is a transform)
+    :param transform: the "transform" of the vertices, or None
+    :param processes: number of processes used when there are more than
+        REPROJECT_CHUNK vertices (all the CPUs by default)
+    :returns: the (N, 3) float64 array of the real-world coordinates in the
+        new EPSG
+    """
+    if (processes == 1) or (len(v) <= REPROJECT_CHUNK):
+        return _reproject_chunk(v, epsg_from, epsg_to, transform)
+    chunks = np.array_split(v, -(-len(v) // REPROJECT_CHUNK))
+    n = len(chunks)
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        re = pool.map(_reproject_chunk, chunks, [epsg_from] * n, [epsg_to] * n, [transform] * n)
+        return np.concatenate(list(re))
+
+
+def quantize_vertices(v, transform):
+    """The integers of the real-world vertices with a transform"""
+    return np.rint((v - np.array(transform["translate"])) / np.array(transform["scale"])).astype(np.int64)
+
+
+def quantization_error(v, q, translate, scale):
+    """(max, rms) of the difference between the vertices and their
+    quantized values (q * scale + translate), over all the coordinates"""
+    if len(v) == 0:
+        return (0.0, 0.0)
+    e = (q * scale + np.asarray(translate)) - v
+    return (float(np.abs(e).max()), float(np.sqrt((e ** 2).mean())))
+
+
+def _data_lines(file):
+    #-- the lines of a file without the comments and the empty ones
+    lines = list(filter(None, map(str.strip, file.read().splitlines())))
+    return [l for l in lines if l[0] != '#']
+
+
+def _parse_numbers(lines):
+    #-- all the numbers of the lines in a 1D array, None if one isn't a number
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            return np.fromstring(' '.join(lines), sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
 
-def reader(file, ignore_duplicate_keys=False):
-    return CityJSON(file=file, ignore_duplicate_keys=ignore_duplicate_keys)
 
-def off2cj(file):
-    l = file.readline()
-    # print(l)
-    while (len(l) <= 1) or (l[0] == '#') or (l[:3] == 'OFF'):
-        l = file.readline()
-        # print(l)
-        # print ('len', len(l))
-    numVertices = int(l.split()[0])
-    numFaces    = int(l.split()[1])
-    lstVertices = []
-    for i in range(numVertices):
-        lstVertices.append(list(map(float, file.readline().split())))
-    lstFaces = []
-    for i in range(numFaces):
-        lstFaces.append(list(map(int, file.readline().split()[1:])))
-    cm = {}
-    cm["type"] = "CityJSON"
-    cm["version"] = "0.6"
-    cm["CityObjects"] = {}
-    cm["vertices"] = []
-    for v in lstVertices:
-        cm["vertices"].append(v)
-    g = {'type': 'Solid'}
+def _parse_vertices(lines, first=0):
+    #-- (N, 3) array of the coordinates, the first columns are skipped
+    a = _parse_numbers(lines)
+    if (a is not None) and (len(lines) > 0) and (len(a) == len(lines) * (first + 3)):
+        return a.reshape((len(lines), first + 3))[:, first:]
+    v = np.array([l.split()[first:first + 3] for l in lines], dtype=float)
+    return v.reshape((len(lines), 3))
+
+
+def _parse_polygons(lines):
+    #-- the polygons "n i1 i2 ... in", in bulk when they all have the same size
+    a = _parse_numbers(lines)
+    if (a is not None) and (len(lines) > 0):
+        n = int(a[0])
+        if len(a) == len(lines) * (n + 1):
+            a = a.reshape((len(lines), n + 1))
+            if (a[:, 0] == n).all():
+                return a[:, 1:].astype(np.int64)
+    re = []
+    for l in lines:
+        l = l.split()
+        re.append(list(map(int, l[1:int(l[0]) + 1])))
+    return re
+
+
+def read_off(file, offset=0):
+    """Read the mesh of an OFF file
+
+    :param file: file (text mode)
+    :param offset: added to the indices of the vertices
+    :returns: (vertices, boundaries) -- the (N, 3) array of the vertices and
+        the boundaries of a Solid
+    """
+    lines = _data_lines(file)
+    header = lines[0].split()
+    if header[0].upper().endswith('OFF'):
+        header = header[1:]
+        if len(header) == 0:
+            lines = lines[1:]
+            header = lines[0].split()
+    numVertices = int(header[0])
+    numFaces = int(header[1])
+    vertices = _parse_vertices(lines[1:numVertices + 1])
+    faces = _parse_polygons(lines[numVertices + 1:numVertices + numFaces + 1])
+    if isinstance(faces, np.ndarray):
+        faces = (faces + offset).reshape((len(faces), 1, -1)).tolist()
+    else:
+        faces = [[[i + offset for i in f]] for f in faces]
+    return (vertices, [faces])
+
+
+def read_poly(file, offset=0):
+    """Read the mesh of a POLY file (only the facets with their holes are
+    kept, each hole is a ring of its facet)
+
+    :param file: file (text mode)
+    :param offset: added to the indices of the vertices
+    :returns: (vertices, boundaries) -- the (N, 3) array of the vertices and
+        the boundaries of a Solid
+    """
+    lines = _data_lines(file)
+    numVertices = int(lines[0].split()[0])
+    vlines = lines[1:numVertices + 1]
+    vertices = _parse_vertices(vlines, first=1)
+    #-- the vertices can be numbered from 0 or 1
+    if numVertices > 0:
+        offset -= int(vlines[0].split()[0])
+    i = numVertices + 1
+    numFaces = int(lines[i].split()[0])
+    i += 1
     shell = []
-    for f in lstFaces:
-        shell.append([f])
-    g['boundaries'] = [shell]
+    for f in range(numFaces):
+        irings = int(lines[i].split()[0]) - 1
+        i += 1
+        face = [lines[i]]
+        i += 1
+        for r in range(irings):
+            face.append(lines[i])
+            #-- skip the point in the hole
+            i += 2
+        rings = _parse_polygons(face)
+        if isinstance(rings, np.ndarray):
+            rings = rings.tolist()
+        shell.append([[j + offset for j in ring] for ring in rings])
+    return (vertices, [shell])
+
+
+def mesh2co(boundaries):
+    """A CityObject with a mesh as its only geometry (Solid, LoD1)"""
+    g = {'type': 'Solid'}
+    g['boundaries'] = boundaries
     g['lod'] = 1
     o = {'type': 'GenericCityObject'}
     o['geometry'] = [g]
-    cm["CityObjects"]["id-1"] = o
-    return CityJSON(j=cm)
+    return o
 
 
-def poly2cj(file):
-    l = file.readline()
-    numVertices = int(l.split()[0])
-    lstVertices = []
-    for i in range(numVertices):
-        lstVertices.append(list(map(float, file.readline().split()))[1:])
-    numFaces = int(file.readline().split()[0])
-    lstFaces = []
-    holes = []
-    for i in range(numFaces):
-        l = file.readline()
-        irings = int(l.split()[0]) - 1
-        face = []
-        face.append(list(map(int, file.readline().split()[1:])))
-        for r in range(irings):
-            face.append(list(map(int, file.readline().split()[1:])))
-            file.readline()
-        lstFaces.append(face)
+def meshes2cj(meshes):
     cm = {}
     cm["type"] = "CityJSON"
     cm["version"] = "0.6"
     cm["CityObjects"] = {}
-    cm["vertices"] = []
-    for v in lstVertices:
-        cm["vertices"].append(v)
-    g = {'type': 'Solid'}
-    shell = []
-    for f in lstFaces:
-        shell.append(f)
-    g['boundaries'] = [shell]
-    g['lod'] = 1
-    o = {'type': 'GenericCityObject'}
-    o['geometry'] = [g]
-    cm["CityObjects"]["id-1"] = o
+    vertices = []
+    for theid, (v, boundaries) in meshes:
+        cm["CityObjects"][theid] = mesh2co(boundaries)
+        vertices.append(v)
+    if len(vertices) > 0:
+        cm["vertices"] = np.concatenate(vertices)
+    else:
+        cm["vertices"] = []
     return CityJSON(j=cm)
 
 
+def off2cj(file):
+    with no_gc():
+        return meshes2cj([("id-1", read_off(file))])
+
+
+def poly2cj(file):
+    with no_gc():
+        return meshes2cj([("id-1", read_poly(file))])
+
+
+MESH_READERS = {'.off': read_off, '.poly': read_poly}
+
+
+def mesh_vertex_count(path):
+    """Number of vertices of an OFF/POLY file, read in its header"""
+    with compression.open_file(path, mode='r') as f:
+        for l in f:
+            l = l.split()
+            if (len(l) == 0) or l[0].startswith('#'):
+                continue
+            if l[0].upper().endswith('OFF'):
+                if len(l) == 1:
+                    continue
+                l = l[1:]
+            return int(l[0])
+    raise ValueError("Empty file")
+
+
+def _read_mesh(path, offset):
+    #-- in a worker process
+    with no_gc(), compression.open_file(path, mode='r') as f:
+        return MESH_READERS[compression.splitext(path)[0]](f, offset)
+
+
+def dir2cj(folder, processes=None):
+    """Convert all the OFF and POLY files of a folder to one CityJSON, each
+    file is a CityObject (its ID is the name of the file)
+
+    :param folder: path of the folder
+    :param processes: number of processes reading the files (all the CPUs by default)
+    :returns: CityJSON
+    :raises: ValueError if there are no files
+    """
+    paths = []
+    for f in sorted(os.listdir(folder)):
+        p = os.path.join(folder, f)
+        if os.path.isfile(p) and (compression.splitext(p)[0] in MESH_READERS):
+            paths.append(p)
+    if len(paths) == 0:
+        raise ValueError("No OFF or POLY files in the folder")
+    ids = []
+    for p in paths:
+        theid = os.path.basename(p).split('.')[0]
+        if theid in ids:
+            theid = os.path.basename(p)
+        ids.append(theid)
+    #-- the offsets of the indices are known before reading the files
+    offsets = [0]
+    for p in paths[:-1]:
+        offsets.append(offsets[-1] + mesh_vertex_count(p))
+    if (processes == 1) or (len(paths) == 1):
+        meshes = map(_read_mesh, paths, offsets)
+        return meshes2cj(zip(ids, meshes))
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool, no_gc():
+        meshes = pool.map(_read_mesh, paths, offsets)
+        return meshes2cj(zip(ids, meshes))
+
+
+#-- number of CityObjects triangulated at once by each process (OBJ export)
+OBJ_CHUNK = 1000
+
+#-- number of chunks of the OBJ export submitted to each process at a time
+OBJ_WINDOW = 2
+
+
+def _obj_faces(cityobjects, vertices, cache=None):
+    #-- the "o" and "f" lines of some (id, geometries), and the changes of the cache; also in a worker process
+    if cache is not None:
+        cache.begin()
+    geoms = []
+    names = []
+    for theid, geometries in cityobjects:
+        for g in geometries:
+            geoms.append(g)
+            names.append(theid)
+    triangles, starts = triangulation.triangulate_geometries(geoms, vertices, cache)
+    triangles = (triangles + 1).ravel().tolist()
+    starts = (starts * 3).tolist()
+    out = []
+    for i, theid in enumerate(names):
+        out.append('o ' + str(theid) + '\n')
+        b = starts[i]
+        e = starts[i + 1]
+        out.append(('f %d %d %d\n' * ((e - b) // 3)) % tuple(triangles[b:e]))
+    return (''.join(out), None if cache is None else cache.changes())
+
+
+def _write_obj_vertices(fo, v, chunk_size=VERTICES_CHUNK):
+    for b in range(0, len(v), chunk_size):
+        c = v[b:b + chunk_size]
+        fo.write(('v %s %s %s\n' * len(c)) % tuple(c.ravel().tolist()))
+
+
+#-- the name of the index of the tiles, in their directory
+TILES_INDEX = 'tiles.json'
+
+#-- number of tiles submitted to each process at a time
+TILES_WINDOW = 2
+
+
+def _write_tile(path, part, indent=0):
+    #-- write the tile (a subset of the model); also in a worker process
+    with open(path, 'w') as fo:
+        part.write(fo, indent)
+    return part.j["metadata"]["geographicalExtent"]
+
+
+def iter_features(file):
+    """Iterate over a CityJSON feature sequence (CityJSONL), one line at a time
+
+    The first line is a CityJSON object with the root properties (transform,
+    metadata, templates, ...) but no CityObjects, each other line is a
+    CityJSONFeature: one CityObject with its children and its own vertices.
+
+    :param file: file (text mode)
+    :returns: generator of the header, and then of each CityJSONFeature
+    :raises: ValueError
+    """
+    first = True
+    for l in file:
+        if len(l.strip()) == 0:
+            continue
+        j = json.loads(l)
+        if first == True:
+            if ("type" not in j) or (j["type"] != "CityJSON"):
+                raise ValueError("Not a CityJSON feature sequence")
+            first = False
+        elif ("type" not in j) or (j["type"] != "CityJSONFeature"):
+            raise ValueError("Not a CityJSONFeature: %s" % l[:50])
+        yield j
+
+
+def cjseq2cj(file):
+    """Read a CityJSON feature sequence (CityJSONL) into one CityJSON"""
+    features = iter_features(file)
+    header = next(features, None)
+    if header is None:
+        raise ValueError("Empty CityJSON feature sequence")
+    header.setdefault("CityObjects", {})
+    header.setdefault("vertices", [])
+    cm = CityJSON(j=header)
+    cm.path = os.path.abspath(file.name)
+    cm.add_features(features)
+    return cm
+
+
 class CityJSON:
 
-    def __init__(self, file=None, j=None, ignore_duplicate_keys=False):
+    def __init__(self, file=None, j=None, ignore_duplicate_keys=False, json_backend=None):
         if file is not None:
-            self.read(file, ignore_duplicate_keys)
+            self.read(file, ignore_duplicate_keys, json_backend)
             self.path = os.path.abspath(file.name)
         elif j is not None:
-            self.j = j
+            #-- a copy, the "vertices" of the caller are not replaced
+            self.j = dict(j)
+            if "vertices" in self.j:
+                self.j["vertices"] = vertices_array(self.j["vertices"], "transform" in self.j)
         else: #-- create an empty one
             self.j = {}
             self.j["type"] = "CityJSON"
             self.j["version"] = CITYJSON_VERSIONS_SUPPORTED[-1]
             self.j["CityObjects"] = {}
-            self.j["vertices"] = []
+            self.j["vertices"] = vertices_array([])
+        self._spatial_index = None
+        self._hierarchy_index = None
+        self._attribute_index = None
 
 
     def __repr__(self):
@@ -164,20 +598,23 @@ class CityJSON:
         else:
             return False
 
-    def read(self, file, ignore_duplicate_keys=False):
-        if ignore_duplicate_keys == True:
-            self.j = json.loads(file.read())
-        else:
-            try:
-                self.j = json.loads(file.read(), object_pairs_hook=validation.dict_raise_on_duplicates)
-            except ValueError as err:
-                raise ValueError(err)
+    def read(self, file, ignore_duplicate_keys=False, json_backend=None):
+        s = file.read()
+        self.j = jsonbackend.loads(s, json_backend)
+        if ignore_duplicate_keys == False:
+            dups = validation.duplicate_cityobjects_ids(s)
+            if len(dups) > 0:
+                self.j = {}
+                raise ValueError("Invalid CityJSON file, duplicate key for City Object IDs: %r" % (dups[0]))
         #-- a CityJSON file?
         if "type" in self.j and self.j["type"] == "CityJSON":
             pass
         else:
             self.j = {}
             raise ValueError("Not a CityJSON file")
+        #-- the vertices are kept in a NumPy array, lists only in the files
+        if "vertices" in self.j:
+            self.j["vertices"] = vertices_array(self.j["vertices"], "transform" in self.j)
 
             
     def fetch_schema(self, folder_schemas=None):
@@ -344,7 +781,7 @@ class CityJSON:
                 return (False, False, ["Can't find the schema."], [])
             else:
                 print ('\t(using the schemas %s)' % (v))
-                isValid, errs = validation.validate_against_schema(self.j, js)
+                isValid, errs = validation.validate_against_schema(self.get_json(), js)
                 if (isValid == False):
                     es += errs
                     return (False, False, es, [])
@@ -427,6 +864,22 @@ class CityJSON:
         return (isValid, woWarnings, es, ws)
 
 
+    def get_json(self):
+        """The CityJSON as it is in a file (the vertices as lists); only the
+        root is copied"""
+        j = dict(self.j)
+        if "vertices" in j:
+            j["vertices"] = j["vertices"].tolist()
+        return j
+
+
+    def transform_vertices(self, v):
+        """Real-world coordinates of (some of) the vertices"""
+        if "transform" in self.j:
+            return (v * np.array(self.j["transform"]["scale"])) + np.array(self.j["transform"]["translate"])
+        return v
+
+
     def get_bbox(self):
         if "metadata" not in self.j:
             return self.calculate_bbox()
@@ -436,20 +889,12 @@ class CityJSON:
 
 
     def calculate_bbox(self):
-        bbox = [9e9, 9e9, 9e9, -9e9, -9e9, -9e9]    
-        for v in self.j["vertices"]:
-            for i in range(3):
-                if v[i] < bbox[i]:
-                    bbox[i] = v[i]
-            for i in range(3):
-                if v[i] > bbox[i+3]:
-                    bbox[i+3] = v[i]
-        if "transform" in self.j:
-            for i in range(3):
-                bbox[i] = (bbox[i] * self.j["transform"]["scale"][i]) + self.j["transform"]["translate"][i]
-            for i in range(3):
-                bbox[i+3] = (bbox[i+3] * self.j["transform"]["scale"][i]) + self.j["transform"]["translate"][i]
-        return bbox
+        v = self.j["vertices"]
+        if len(v) == 0:
+            bbox = np.array([[9e9, 9e9, 9e9], [-9e9, -9e9, -9e9]])
+        else:
+            bbox = np.array([v.min(axis=0), v.max(axis=0)])
+        return self.transform_vertices(bbox).ravel().tolist()
 
 
     def update_bbox(self):
@@ -495,99 +940,291 @@ class CityJSON:
             return True
 
 
-    def add_bbox_each_cityobjects(self):
-        def recusionvisit(a, vs):
-          for each in a:
-            if isinstance(each, list):
-                recusionvisit(each, vs)
+    def get_cityobjects_extents(self):
+        """The bbox and the centroid of every CityObject, computed at once
+
+        The vertices of all the geometries are gathered in one array and
+        reduced over the segment of each CityObject. The centroid is the
+        mean of the vertices of the boundaries (a vertex used twice counts
+        twice). Both are in real-world coordinates, NaN for the CityObjects
+        without vertices.
+
+        :returns: (ids, bboxes, centroids) -- the list of the IDs, the (N, 6)
+            array of the bboxes and the (N, 3) array of the centroids
+        """
+        ids = list(self.j["CityObjects"])
+        geoms = boundaries.Geometries.of_cityobjects(self.j)
+        ngeoms = np.fromiter((len(self.j["CityObjects"][theid].get("geometry", [])) for theid in ids), dtype=np.int64, count=len(ids))
+        starts = geoms.starts[np.concatenate(([0], np.cumsum(ngeoms)))]
+        lengths = np.diff(starts)
+        bboxes = np.full((len(ids), 6), np.nan)
+        centroids = np.full((len(ids), 3), np.nan)
+        some = lengths > 0
+        if some.any():
+            v = self.j["vertices"][geoms.indices]
+            #-- the empty segments have no length, they can be skipped
+            segments = starts[:-1][some]
+            vmin = self.transform_vertices(np.minimum.reduceat(v, segments, axis=0))
+            vmax = self.transform_vertices(np.maximum.reduceat(v, segments, axis=0))
+            bboxes[some, :3] = np.minimum(vmin, vmax)
+            bboxes[some, 3:] = np.maximum(vmin, vmax)
+            c = np.add.reduceat(v, segments, axis=0, dtype=np.float64) / lengths[some][:, np.newaxis]
+            centroids[some] = self.transform_vertices(c)
+        return (ids, bboxes, centroids)
+
+
+    def spatial_index(self):
+        """The spatial index of the CityObjects, built when needed
+
+        It is rebuilt after the geometries are modified by the methods of
+        CityJSON (or if the CityObjects/vertices are replaced); after
+        modifying them in self.j call invalidate_spatial_index().
+
+        :returns: (ids, bboxes, centroids, tree) -- as returned by
+            get_cityobjects_extents(), and the spatialindex.RTree of the
+            2D bboxes
+        """
+        stamp = self._spatial_stamp()
+        si = getattr(self, '_spatial_index', None)
+        if (si is None) or (si[0] != stamp):
+            ids, bboxes, centroids = self.get_cityobjects_extents()
+            si = (stamp, ids, bboxes, centroids, spatialindex.RTree(bboxes[:, [0, 1, 3, 4]]))
+            self._spatial_index = si
+        return si[1:]
+
+
+    def invalidate_spatial_index(self):
+        self._spatial_index = None
+
+
+    def hierarchy_index(self):
+        """The subset.Hierarchy of the CityObjects (children, parents and
+        members of the groups), built when needed
+
+        It is rebuilt if CityObjects are added or removed; after modifying
+        the hierarchy in self.j call invalidate_hierarchy_index().
+        """
+        stamp = (id(self.j["CityObjects"]), len(self.j["CityObjects"]))
+        h = getattr(self, '_hierarchy_index', None)
+        if (h is None) or (h[0] != stamp):
+            h = (stamp, subset.Hierarchy(self.j["CityObjects"]))
+            self._hierarchy_index = h
+        return h[1]
+
+
+    def invalidate_hierarchy_index(self):
+        self._hierarchy_index = None
+
+
+    def attribute_index(self):
+        """The query.AttributeIndex of the CityObjects, built when needed
+
+        Each attribute is indexed at its first query, and kept for the next
+        ones. It is rebuilt if CityObjects are added or removed; after
+        modifying the attributes in self.j call invalidate_attribute_index().
+        """
+        stamp = (id(self.j["CityObjects"]), len(self.j["CityObjects"]))
+        a = getattr(self, '_attribute_index', None)
+        if (a is None) or (a[0] != stamp):
+            a = (stamp, query.AttributeIndex(self.j["CityObjects"]))
+            self._attribute_index = a
+        return a[1]
+
+
+    def invalidate_attribute_index(self):
+        self._attribute_index = None
+
+
+    def query_where(self, expr):
+        """The IDs of the CityObjects matching an expression on their
+        attributes, type and bbox (see cjio/query.py), eg
+        "yearOfConstruction < 1950 and function == 'residential'"
+
+        :returns: the list of the IDs, in the order of the CityObjects
+        :raises: ValueError if the expression is invalid
+        """
+        mask = query.predicate(expr)(self)
+        ids = self.attribute_index().ids
+        return [ids[i] for i in np.flatnonzero(mask).tolist()]
+
+
+    def _spatial_stamp(self):
+        t = self.j.get("transform", {})
+        return (id(self.j["CityObjects"]), len(self.j["CityObjects"]), id(self.j["vertices"]), len(self.j["vertices"]), repr(t.get("scale")), repr(t.get("translate")))
+
+
+    def query_bbox(self, minx, miny, maxx, maxy, mode='centroid'):
+        """The IDs of the CityObjects in a 2D window, with the spatial index
+
+        :param mode: 'centroid' (the centroid is inside, maxx/maxy
+            excluded), 'intersects' (the bbox intersects the window) or
+            'within' (the bbox is inside the window)
+        :returns: the list of the IDs, in the order of the CityObjects
+        :raises: ValueError if the mode is unknown
+        """
+        if mode not in ('centroid', 'intersects', 'within'):
+            raise ValueError("Unknown mode: %r" % mode)
+        ids, bboxes, centroids, tree = self.spatial_index()
+        #-- the centroid is inside the bbox, the candidates are the bboxes intersecting the window
+        re = tree.query((minx, miny, maxx, maxy))
+        if mode == 'centroid':
+            c = centroids[re]
+            re = re[(c[:, 0] >= minx) & (c[:, 1] >= miny) & (c[:, 0] < maxx) & (c[:, 1] < maxy)]
+        elif mode == 'within':
+            b = bboxes[re]
+            re = re[(b[:, 0] >= minx) & (b[:, 1] >= miny) & (b[:, 3] <= maxx) & (b[:, 4] <= maxy)]
+        return [ids[i] for i in re.tolist()]
+
+
+    def get_tiles(self, max_objects=1000, size=None):
+        """Partition the CityObjects in tiles, by the 2D centroid
+
+        A CityObject is in the tile of its top-level ancestor (the parts of
+        a Building stay with it), and the members of a group (with their
+        hierarchies) are in the tile of the group; the CityObjects whose
+        hierarchy has no vertices are in the first tile.
+
+        :param max_objects: the quadtree is split until each tile has at
+            most this number of top-level CityObjects
+        :param size: if given, a grid of square tiles of this size is used
+            instead of a quadtree
+        :returns: list of (key, bounds, ids) -- the key of the tile, its 2D
+            bounds and the IDs of its CityObjects (in their order)
+        """
+        ids, bboxes, centroids, tree = self.spatial_index()
+        h = self.hierarchy_index()
+        roots = h.roots()
+        #-- the hierarchies linked by a group are merged (union-find of their roots)
+        merged = {}
+        def find(theid):
+            theid = roots.get(theid, theid)
+            while merged.get(theid, theid) != theid:
+                theid = merged[theid]
+            return theid
+        for group, members in h.members.items():
+            for each in members:
+                a = find(group)
+                b = find(each)
+                if a != b:
+                    merged[b] = a
+        #-- the centroid of a hierarchy is the one of its root, else the one of its first member with vertices
+        groups = collections.OrderedDict()
+        for i, theid in enumerate(ids):
+            groups.setdefault(find(theid), []).append(i)
+        pos = {theid: i for i, theid in enumerate(ids)}
+        gcentroids = np.full((len(groups), 2), np.nan)
+        for k, (root, members) in enumerate(groups.items()):
+            for i in [pos[root]] + members:
+                if not np.isnan(centroids[i, 0]):
+                    gcentroids[k] = centroids[i, :2]
+                    break
+        members = list(groups.values())
+        valid = np.flatnonzero(~np.isnan(gcentroids[:, 0]))
+        if len(valid) > 0:
+            lo = gcentroids[valid].min(axis=0)
+            hi = gcentroids[valid].max(axis=0)
+            bounds = (lo[0], lo[1], hi[0], hi[1])
+            if size is None:
+                cells = spatialindex.quadtree(gcentroids[valid], bounds, max_objects)
             else:
-                vs.append(each)
-        for co in self.j["CityObjects"]:
-            vs = []
-            bbox = [9e9, 9e9, 9e9, -9e9, -9e9, -9e9]    
-            for g in self.j['CityObjects'][co]['geometry']:
-                recusionvisit(g["boundaries"], vs)
-                for each in vs:
-                    v = self.j["vertices"][each]
-                    for i in range(3):
-                        if v[i] < bbox[i]:
-                            bbox[i] = v[i]
-                    for i in range(3):
-                        if v[i] > bbox[i+3]:
-                            bbox[i+3] = v[i]
-                if "transform" in self.j:
-                    for i in range(3):
-                        bbox[i] = (bbox[i] * self.j["transform"]["scale"][i]) + self.j["transform"]["translate"][i]
-                    for i in range(3):
-                        bbox[i+3] = (bbox[i+3] * self.j["transform"]["scale"][i]) + self.j["transform"]["translate"][i]
-                self.j["CityObjects"][co]["geographicalExtent"] = bbox
+                cells = spatialindex.grid(gcentroids[valid], bounds, size)
+        else:
+            cells = [("0", (0.0, 0.0, 0.0, 0.0), np.zeros(0, dtype=np.int64))]
+        tiles = []
+        for key, b, indices in cells:
+            cos = [i for k in valid[indices].tolist() for i in members[k]]
+            tiles.append((key, b, cos))
+        #-- the hierarchies without vertices
+        for k in np.flatnonzero(np.isnan(gcentroids[:, 0])).tolist():
+            tiles[0][2].extend(members[k])
+        return [(key, b, [ids[i] for i in sorted(cos)]) for key, b, cos in tiles]
+
+
+    def write_tiles(self, directory, max_objects=1000, size=None, processes=None, indent=0):
+        """Write each tile (see get_tiles()) as a CityJSON file, with only
+        its vertices, templates and appearances, and the index of the tiles
+
+        The subset of each tile is made in this process, and written by a
+        pool of processes: a worker receives only the subset (its
+        CityObjects, vertices, templates and appearances), and at most
+        TILES_WINDOW tiles per process are submitted at a time. The model
+        is not modified.
+
+        :param directory: the files tile_<key>.json and TILES_INDEX are
+            written in it, it is created if needed
+        :param processes: number of processes (all the CPUs by default, 1 to
+            write them in this process)
+        :returns: the index, list of {"file", "bbox", "cityobjects"} -- the
+            name of the file, its bbox and its number of CityObjects
+        :raises: IOError
+        """
+        tiles = self.get_tiles(max_objects, size)
+        os.makedirs(directory, exist_ok=True)
+        names = ['tile_%s.json' % key for key, b, ids in tiles]
+        paths = [os.path.join(directory, name) for name in names]
+        allids = [ids for key, b, ids in tiles]
+        if (processes == 1) or (len(tiles) <= 1):
+            bboxes = [_write_tile(path, self._subset(ids), indent) for path, ids in zip(paths, allids)]
+        else:
+            bboxes = []
+            todo = zip(paths, allids)
+            window = TILES_WINDOW * (processes or os.cpu_count() or 1)
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool, no_gc():
+                pending = collections.deque(pool.submit(_write_tile, path, self._subset(ids), indent) for path, ids in itertools.islice(todo, window))
+                while len(pending) > 0:
+                    bboxes.append(pending.popleft().result())
+                    for path, ids in itertools.islice(todo, 1):
+                        pending.append(pool.submit(_write_tile, path, self._subset(ids), indent))
+        index = []
+        for name, ids, bbox in zip(names, allids, bboxes):
+            index.append({"file": name, "bbox": bbox, "cityobjects": len(ids)})
+        with open(os.path.join(directory, TILES_INDEX), 'w') as fo:
+            json.dump({"tiles": index}, fo, indent=indent if indent else None)
+        return index
+
+
+    def add_bbox_each_cityobjects(self):
+        ids, bboxes, centroids = self.get_cityobjects_extents()
+        for theid, bbox in zip(ids, bboxes.tolist()):
+            if not np.isnan(bbox[0]):
+                self.j["CityObjects"][theid]["geographicalExtent"] = bbox
 
 
     def get_centroid(self, coid):
-        def recusionvisit(a, vs):
-          for each in a:
-            if isinstance(each, list):
-                recusionvisit(each, vs)
-            else:
-                vs.append(each)
         #-- find the 3D centroid
-        centroid = [0, 0, 0]
-        total = 0
-        for g in self.j['CityObjects'][coid]['geometry']:
-            vs = []
-            recusionvisit(g["boundaries"], vs)
-            for each in vs:
-                v = self.j["vertices"][each]
-                total += 1
-                centroid[0] += v[0]
-                centroid[1] += v[1]
-                centroid[2] += v[2]
-        if (total != 0):
-            centroid[0] /= total
-            centroid[1] /= total
-            centroid[2] /= total
-            if "transform" in self.j:
-                centroid[0] = (centroid[0] * self.j["transform"]["scale"][0]) + self.j["transform"]["translate"][0]
-                centroid[1] = (centroid[1] * self.j["transform"]["scale"][1]) + self.j["transform"]["translate"][1]
-                centroid[2] = (centroid[2] * self.j["transform"]["scale"][2]) + self.j["transform"]["translate"][2]
-            return centroid
-        else:
+        vs = boundaries.Geometries(self.j['CityObjects'][coid]['geometry']).indices
+        if len(vs) == 0:
             return None
+        centroid = self.j["vertices"][vs].mean(axis=0)
+        return self.transform_vertices(centroid).tolist()
 
 
     def get_subset_bbox(self, bbox, exclude=False):
         # print ('get_subset_bbox')
+        re = self.query_bbox(bbox[0], bbox[1], bbox[2], bbox[3], mode='centroid')
+        #-- also add the parent-children
+        re = self.hierarchy_index().closure(re)
+        if exclude == True:
+            allkeys = set(self.j["CityObjects"].keys())
+            re = allkeys ^ re
+        #-- in the order of the CityObjects
+        return self._subset([theid for theid in self.j["CityObjects"] if theid in re])
+
+
+    def _subset(self, ids):
+        """A new CityJSON with the CityObjects ids (in their order), their
+        vertices, templates and appearances
+
+        Only the selected CityObjects are copied (their indices are
+        remapped in the copies), the model is not modified.
+        """
         #-- new sliced CityJSON object
         cm2 = CityJSON()
         cm2.j["version"] = self.j["version"]
         cm2.path = self.path
         if "transform" in self.j:
-            cm2.j["transform"] = self.j["transform"]
-        re = set()            
-        for coid in self.j["CityObjects"]:
-            centroid = self.get_centroid(coid)
-            if ((centroid is not None) and
-                (centroid[0] >= bbox[0]) and
-                (centroid[1] >= bbox[1]) and
-                (centroid[0] <  bbox[2]) and
-                (centroid[1] <  bbox[3]) ):
-                re.add(coid)
-        re2 = copy.deepcopy(re)
-        if exclude == True:
-            allkeys = set(self.j["CityObjects"].keys())
-            re = allkeys ^ re
-        #-- also add the parent-children
-        for theid in re2:
-            if "children" in self.j['CityObjects'][theid]:
-                for child in self.j['CityObjects'][theid]['children']:
-                    re.add(child)
-            if "parents" in self.j['CityObjects'][theid]:
-                for each in self.j['CityObjects'][theid]['parents']:
-                    re.add(self.j['CityObjects'][each])
-
-        
-        for each in re:
-            cm2.j["CityObjects"][each] = self.j["CityObjects"][each]
+            cm2.j["transform"] = copy.deepcopy(self.j["transform"])
+        cm2.j["CityObjects"] = copy.deepcopy({each: self.j["CityObjects"][each] for each in ids})
         #-- geometry
         subset.process_geometry(self.j, cm2.j)
         #-- templates
@@ -598,7 +1235,7 @@ class CityJSON:
             subset.process_appearance(self.j, cm2.j)
         #-- metadata
         if ("metadata" in self.j):
-            cm2.j["metadata"] = self.j["metadata"]
+            cm2.j["metadata"] = copy.deepcopy(self.j["metadata"])
         cm2.update_bbox()
         return cm2
 
@@ -634,75 +1271,42 @@ class CityJSON:
         return self.get_subset_ids(re)
 
 
+    def get_subset_where(self, expr, exclude=False):
+        """The subset of the CityObjects matching the expression (see
+        query_where()), with their hierarchies
+
+        :raises: ValueError if the expression is invalid
+        """
+        re = self.hierarchy_index().closure(self.query_where(expr))
+        if exclude == True:
+            re = set(self.j["CityObjects"].keys()) ^ re
+        return self._subset([theid for theid in self.j["CityObjects"] if theid in re])
+
+
     def get_subset_ids(self, lsIDs, exclude=False):
-        #-- new sliced CityJSON object
-        cm2 = CityJSON()
-        cm2.j["version"] = self.j["version"]
-        cm2.path = self.path
-        if "transform" in self.j:
-            cm2.j["transform"] = self.j["transform"]
         #-- copy selected CO to the j2
-        re = subset.select_co_ids(self.j, lsIDs)
+        re = subset.select_co_ids(self.j, lsIDs, self.hierarchy_index())
         if exclude == True:
             allkeys = set(self.j["CityObjects"].keys())
             re = allkeys ^ re
-        for each in re:
-            cm2.j["CityObjects"][each] = self.j["CityObjects"][each]
-        #-- geometry
-        subset.process_geometry(self.j, cm2.j)
-        #-- templates
-        subset.process_templates(self.j, cm2.j)
-        #-- appearance
-        if ("appearance" in self.j):
-            cm2.j["appearance"] = {}
-            subset.process_appearance(self.j, cm2.j)
-        #-- metadata
-        if ("metadata" in self.j):
-            cm2.j["metadata"] = self.j["metadata"]
-        cm2.update_bbox()
-        return cm2
+        #-- in the order of the CityObjects
+        return self._subset([theid for theid in self.j["CityObjects"] if theid in re])
 
 
     def get_subset_cotype(self, cotype, exclude=False):
         # print ('get_subset_cotype')
-        lsCOtypes = [cotype]
-        if cotype == 'Building':
-            lsCOtypes.append('BuildingInstallation')
-            lsCOtypes.append('BuildingPart')
-        if cotype == 'Bridge':
-            lsCOtypes.append('BridgePart')
-            lsCOtypes.append('BridgeInstallation')
-            lsCOtypes.append('BridgeConstructionElement')
-        if cotype == 'Tunnel':
-            lsCOtypes.append('TunnelInstallation')
-            lsCOtypes.append('TunnelPart')
-        #-- new sliced CityJSON object
-        cm2 = CityJSON()
-        cm2.j["version"] = self.j["version"]
-        cm2.path = self.path
-        if "transform" in self.j:
-            cm2.j["transform"] = self.j["transform"]
+        lsCOtypes = subset.get_cotypes(cotype)
         #-- copy selected CO to the j2
+        re = []
         for theid in self.j["CityObjects"]:
-            if exclude == False:
-                if self.j["CityObjects"][theid]["type"] in lsCOtypes:
-                    cm2.j["CityObjects"][theid] = self.j["CityObjects"][theid]
-            else:
-                if self.j["CityObjects"][theid]["type"] not in lsCOtypes:
-                    cm2.j["CityObjects"][theid] = self.j["CityObjects"][theid]
-        #-- geometry
-        subset.process_geometry(self.j, cm2.j)
-        #-- templates
-        subset.process_templates(self.j, cm2.j)
-        #-- appearance
-        if ("appearance" in self.j):
-            cm2.j["appearance"] = {}
-            subset.process_appearance(self.j, cm2.j)
-        #-- metadata
-        if ("metadata" in self.j):
-            cm2.j["metadata"] = self.j["metadata"]
-        cm2.update_bbox()
-        return cm2
+            if self.j["CityObjects"][theid]["type"] in lsCOtypes:
+                re.append(theid)
+        #-- also add the parent-children
+        re = self.hierarchy_index().closure(re)
+        if exclude == True:
+            re = set(self.j["CityObjects"].keys()) ^ re
+        #-- in the order of the CityObjects
+        return self._subset([theid for theid in self.j["CityObjects"] if theid in re])
         
 
     def get_textures_location(self):
@@ -867,7 +1471,15 @@ class CityJSON:
         info = collections.OrderedDict()
         info["cityjson_version"] = self.get_version()
         info["epsg"] = self.get_epsg()
-        info["bbox"] = self.get_bbox()
+        if ("metadata" in self.j) and ("geographicalExtent" in self.j["metadata"]):
+            info["bbox"] = self.get_bbox()
+        else:
+            #-- the extent of the CityObjects (the orphan vertices don't count)
+            ids, bboxes, centroids = self.get_cityobjects_extents()
+            if np.isnan(bboxes[:, 0]).all():
+                info["bbox"] = self.get_bbox()
+            else:
+                info["bbox"] = np.concatenate((np.nanmin(bboxes[:, :3], axis=0), np.nanmax(bboxes[:, 3:], axis=0))).tolist()
         if "extensions" in self.j:
             d = set()
             for i in self.j["extensions"]:
@@ -894,118 +1506,261 @@ class CityJSON:
         return json.dumps(info, indent=2)
 
 
-    def remove_orphan_vertices(self):
-        def visit_geom(a, oldnewids, newvertices):
-          for i, each in enumerate(a):
-            if isinstance(each, list):
-                visit_geom(each, oldnewids, newvertices)
-            else:
-                if each not in oldnewids:
-                    oldnewids[each] = len(newvertices)
-                    newvertices.append(each)
-        def update_face(a, oldnewids):
-          for i, each in enumerate(a):
-            if isinstance(each, list):
-                update_face(each, oldnewids)
-            else:
-                a[i] = oldnewids[each]
-        #--
-        totalinput = len(self.j["vertices"])        
-        oldnewids = {}
-        newvertices = []
-        #-- visit each geom to gather used ids 
-        for theid in self.j["CityObjects"]:
-                for g in self.j['CityObjects'][theid]['geometry']:
-                    visit_geom(g["boundaries"], oldnewids, newvertices)
-        #-- update the faces ids
+    def write(self, fo, indent=0, chunk_size=VERTICES_CHUNK, json_backend=None):
+        """Write the CityJSON to a file, without building the whole JSON string
+
+        The root properties are written in their order, the CityObjects one
+        at a time, and the vertices by chunks. The output is the same as
+        with json.dumps() (with separators=(',',':') if indent is 0).
+
+        :param fo: file object (text mode)
+        :param indent: indentation, 0 for the most compact output
+        :param chunk_size: number of vertices written at once
+        :param json_backend: JSON module encoding the compact output
+        """
+        def members():
+            for key in self.j:
+                if key == "CityObjects":
+                    yield (key, stream.StreamedObject(self.j[key].items()))
+                elif key == "vertices":
+                    yield (key, stream.StreamedArray(stream.chunks(self.j[key], chunk_size)))
+                else:
+                    yield (key, self.j[key])
+        stream.write_json(fo, stream.StreamedObject(members()), indent, backend=json_backend)
+
+
+    def get_features(self):
+        """Generator of the CityJSONFeatures of the model
+
+        Each feature is a CityObject without parent, with all its children
+        (recursively). The geometries are copied and their vertices (and
+        materials/textures) are localised to the feature, the templates
+        stay in the header.
+
+        :returns: generator of CityJSONFeature (dict)
+        """
+        done = set()
+        def feature(theid):
+            ids = []
+            stack = [theid]
+            while len(stack) > 0:
+                each = stack.pop(0)
+                if (each in done) or (each not in self.j["CityObjects"]):
+                    continue
+                done.add(each)
+                ids.append(each)
+                if "children" in self.j["CityObjects"][each]:
+                    stack += self.j["CityObjects"][each]["children"]
+            j2 = collections.OrderedDict()
+            j2["type"] = "CityJSONFeature"
+            j2["id"] = theid
+            j2["CityObjects"] = {}
+            for each in ids:
+                j2["CityObjects"][each] = copy.deepcopy(self.j["CityObjects"][each])
+            subset.process_geometry(self.j, j2)
+            j2["vertices"] = j2["vertices"].tolist()
+            if "appearance" in self.j:
+                j2["appearance"] = {}
+                subset.process_appearance(self.j, j2)
+                if len(j2["appearance"]) == 0:
+                    del j2["appearance"]
+            return j2
+        for theid, co in self.j["CityObjects"].items():
+            if ("parents" in co) or ("parent" in co):
+                continue
+            yield feature(theid)
+        #-- children not referenced by their parent(s)
         for theid in self.j["CityObjects"]:
-                for g in self.j['CityObjects'][theid]['geometry']:
-                    update_face(g["boundaries"], oldnewids)
-        #-- replace the vertices, innit?
-        newv2 = []
-        for v in newvertices:
-            newv2.append(self.j["vertices"][v])
-        self.j["vertices"] = newv2
+            if theid not in done:
+                yield feature(theid)
+
+
+    def get_features_header(self):
+        """The first line of a CityJSON feature sequence: everything but the
+        CityObjects, the vertices and the materials/textures"""
+        header = collections.OrderedDict()
+        for key in self.j:
+            if key in ("CityObjects", "vertices"):
+                header[key] = [] if key == "vertices" else {}
+            elif key == "appearance":
+                a = {k: v for k, v in self.j[key].items() if k not in ("materials", "textures", "vertices-texture")}
+                if len(a) > 0:
+                    header[key] = a
+            else:
+                header[key] = self.j[key]
+        return header
+
+
+    def export2cjseq(self, fo):
+        """Write the model as a CityJSON feature sequence (one JSON per line)
+
+        :param fo: file object (text mode)
+        """
+        fo.write(json.dumps(self.get_features_header(), separators=(',',':')))
+        fo.write('\n')
+        for f in self.get_features():
+            fo.write(json.dumps(f, separators=(',',':')))
+            fo.write('\n')
+
+
+    def add_feature(self, f):
+        """Add a CityJSONFeature to the model (its indices are offset)"""
+        self.add_features([f])
+
+
+    def add_features(self, features):
+        """Add CityJSONFeatures to the model, the vertices are concatenated
+        once at the end"""
+        self.invalidate_spatial_index()
+        vs = [self.j["vertices"]]
+        voffset = len(self.j["vertices"])
+        geoms = []
+        voffsets = []
+        for f in features:
+            for theid, co in f["CityObjects"].items():
+                if theid in self.j["CityObjects"]:
+                    raise ValueError("Invalid CityJSON feature, duplicate key for City Object IDs: %r" % (theid))
+                geoms.extend(co["geometry"])
+                voffsets.extend([voffset] * len(co["geometry"]))
+                self.j["CityObjects"][theid] = co
+            v = vertices_array(f["vertices"], "transform" in self.j)
+            vs.append(v)
+            voffset += len(v)
+            self._add_feature_appearance(f)
+        self.j["vertices"] = np.concatenate(vs)
+        #-- the indices of all the features are offset at once
+        geoms = boundaries.Geometries(geoms)
+        geoms.update(geoms.indices + np.repeat(np.array(voffsets, dtype=np.int64), np.diff(geoms.starts)))
+
+
+    def _add_feature_appearance(self, f):
+        if "appearance" not in f:
+            return
+        if "appearance" not in self.j:
+            self.j["appearance"] = {}
+        a = self.j["appearance"]
+        moffset = len(a.get("materials", []))
+        toffset = len(a.get("textures", []))
+        tvoffset = len(a.get("vertices-texture", []))
+        for key in ("materials", "textures", "vertices-texture"):
+            if key in f["appearance"]:
+                a.setdefault(key, []).extend(f["appearance"][key])
+        for co in f["CityObjects"].values():
+            for g in co["geometry"]:
+                if "material" in g:
+                    for m in g["material"].values():
+                        if "value" in m:
+                            m["value"] += moffset
+                        if "values" in m:
+                            m["values"] = boundaries.map_array(m["values"], max(boundaries.DEPTHS.get(g["type"], 3) - 2, 1), lambda a: a + moffset, True)
+                if "texture" in g:
+                    for t in g["texture"].values():
+                        if "values" in t:
+                            subset.offset_array_indices(t["values"], toffset, 0)
+                            subset.offset_array_indices(t["values"], tvoffset, 1)
+
+
+    def compact_vertices(self):
+        """Keep only the vertices used by the geometries (the orphans are
+        removed), they keep their order and the indices are updated
+
+        :returns: the number of vertices removed
+        """
+        self.invalidate_spatial_index()
+        totalinput = len(self.j["vertices"])
+        used = boundaries.Geometries.of_cityobjects(self.j).compact(totalinput)
+        self.j["vertices"] = self.j["vertices"][used]
         return (totalinput - len(self.j["vertices"]))
 
 
-    def remove_duplicate_vertices(self):
-        def update_geom_indices(a, newids):
-          for i, each in enumerate(a):
-            if isinstance(each, list):
-                update_geom_indices(each, newids)
-            else:
-                a[i] = newids[each]
-        #--            
+    def remove_orphan_vertices(self):
+        return self.compact_vertices()
+
+
+    def remove_duplicate_vertices(self, tolerance=None):
+        """Merge the duplicate vertices, the first occurrence is kept
+
+        :param tolerance: if given, the vertices closer than it (in
+            real-world units) are welded too
+        :returns: the number of vertices removed
+        """
+        self.invalidate_spatial_index()
         totalinput = len(self.j["vertices"])        
-        h = {}
-        newids = [-1] * len(self.j["vertices"])
-        newvertices = []
-        for i, v in enumerate(self.j["vertices"]):
-            s = str(v[0]) + " " + str(v[1]) + " " + str(v[2])
-            if s not in h:
-                newid = len(h)
-                newids[i] = newid
-                h[s] = newid
-                newvertices.append(s)
-            else:
-                newids[i] = h[s]
+        if totalinput == 0:
+            return 0
+        if tolerance:
+            labels = weld_vertices(self.transform_vertices(self.j["vertices"]), tolerance)
+            first = np.flatnonzero(labels == np.arange(totalinput))
+            newids = np.searchsorted(first, labels)
+        else:
+            #-- the unique vertices are kept in the order of their first occurrence
+            u, first, inverse = np.unique(self.j["vertices"], axis=0, return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            newids = np.empty(len(order), dtype=np.int64)
+            newids[order] = np.arange(len(order))
+            newids = newids[inverse.ravel()]
+            first = first[order]
         #-- update indices
-        for theid in self.j["CityObjects"]:
-                for g in self.j['CityObjects'][theid]['geometry']:
-                    update_geom_indices(g["boundaries"], newids)
+        boundaries.Geometries.of_cityobjects(self.j).remap(newids)
         #-- replace the vertices, innit?
-        newv2 = []
-        for v in newvertices:
-            if "transform" in self.j:
-                a = list(map(int, v.split()))
-            else:
-                a = list(map(float, v.split()))
-            newv2.append(a)
-        self.j["vertices"] = newv2
+        self.j["vertices"] = self.j["vertices"][first]
         return (totalinput - len(self.j["vertices"]))
 
 
-    def compress(self, important_digits=3):
+    def compress(self, important_digits=3, max_error=None):
+        """Store the vertices as integers, with a transform
+
+        :param important_digits: number of digits kept (the scale is
+            10^-important_digits), or None for the fewest digits (1 to 10)
+            keeping the quantization error under max_error
+        :param max_error: largest error allowed on a coordinate
+        :returns: (max, rms) -- the maximum and the root mean square of the
+            quantization error of the coordinates
+        :raises: Exception if already compressed, ValueError if the error
+            is over max_error (with any number of digits, if None)
+        """
+        self.invalidate_spatial_index()
         if "transform" in self.j:
             raise Exception("CityJSON already compressed")
             return True
         #-- find the minx/miny/minz
-        bbox = [9e9, 9e9, 9e9]    
-        for v in self.j["vertices"]:
-            for i in range(3):
-                if v[i] < bbox[i]:
-                    bbox[i] = v[i]
+        v = self.j["vertices"]
+        if len(v) == 0:
+            bbox = [9e9, 9e9, 9e9]
+        else:
+            bbox = v.min(axis=0).tolist()
+        if important_digits is None:
+            candidates = range(1, 11)
+        else:
+            candidates = [important_digits]
+        for digits in candidates:
+            scale = float('1e-%d' % digits)
+            q = np.rint((v - bbox) / scale).astype(np.int64)
+            error = quantization_error(v, q, bbox, scale)
+            if (max_error is None) or (error[0] <= max_error):
+                break
+        else:
+            if important_digits is not None:
+                raise ValueError("With %d digits the error is %g, over %g" % (digits, error[0], max_error))
+            raise ValueError("No number of digits (up to 10) keeps the error under %g" % max_error)
         #-- convert vertices in self.j to int
-        n = [0, 0, 0]
-        p = '%.' + str(important_digits) + 'f' 
-        for v in self.j["vertices"]:
-            for i in range(3):
-                n[i] = v[i] - bbox[i]
-            for i in range(3):
-                v[i] = int((p % n[i]).replace('.', ''))
+        self.j["vertices"] = q
         #-- put transform
         self.j["transform"] = {}
-        ss = '0.'
-        ss += '0'*(important_digits - 1)
-        ss += '1'
-        ss = float(ss)
-        self.j["transform"]["scale"] = [ss, ss, ss]
+        self.j["transform"]["scale"] = [scale, scale, scale]
         self.j["transform"]["translate"] = [bbox[0], bbox[1], bbox[2]]
         #-- clean the file
         re = self.remove_duplicate_vertices()
         # print ("Remove duplicates:", re)
-        re = self.remove_orphan_vertices()
+        re = self.compact_vertices()
         # print ("Remove orphans:", re)
-        return True
+        return error
 
 
     def decompress(self):
+        self.invalidate_spatial_index()
         if "transform" in self.j:
-            for v in self.j["vertices"]:
-                v[0] = (v[0] * self.j["transform"]["scale"][0]) + self.j["transform"]["translate"][0]
-                v[1] = (v[1] * self.j["transform"]["scale"][1]) + self.j["transform"]["translate"][1]
-                v[2] = (v[2] * self.j["transform"]["scale"][2]) + self.j["transform"]["translate"][2]
+            self.j["vertices"] = self.transform_vertices(self.j["vertices"]).astype(np.float64)
             del self.j["transform"]
             return True
         else: 
@@ -1013,6 +1768,7 @@ class CityJSON:
 
 
     def merge(self, lsCMs):
+        self.invalidate_spatial_index()
         # decompress() everything
         # updates CityObjects
         # updates vertices
@@ -1020,13 +1776,6 @@ class CityJSON:
         # updates textures
         # updates materials
         #############################
-        def update_geom_indices(a, offset):
-          for i, each in enumerate(a):
-            if isinstance(each, list):
-                update_geom_indices(each, offset)
-            else:
-                if each is not None:
-                    a[i] = each + offset
         def update_texture_indices(a, toffset, voffset):
           for i, each in enumerate(a):
             if isinstance(each, list):
@@ -1054,10 +1803,8 @@ class CityJSON:
                 continue
             #-- add the vertices + update the geom indices
             offset = len(self.j["vertices"])
-            self.j["vertices"] += cm.j["vertices"]
-            for theid in cm.j["CityObjects"]:
-                for g in cm.j['CityObjects'][theid]['geometry']:
-                    update_geom_indices(g["boundaries"], offset)
+            self.j["vertices"] = np.concatenate((self.j["vertices"], cm.j["vertices"]))
+            boundaries.Geometries.of_cityobjects(cm.j).offset(offset)
             #-- templates
             if "geometry-templates" in cm.j:
                 if "geometry-templates" in self.j:
@@ -1072,8 +1819,7 @@ class CityJSON:
                 #-- copy templates
                 for t in cm.j["geometry-templates"]["templates"]:
                     self.j["geometry-templates"]["templates"].append(t)
-                    tmp = self.j["geometry-templates"]["templates"][-1]
-                    update_geom_indices(tmp["boundaries"], novtemplate)
+                boundaries.Geometries(cm.j["geometry-templates"]["templates"]).offset(novtemplate)
                 #-- copy vertices
                 self.j["geometry-templates"]["vertices-templates"] += cm.j["geometry-templates"]["vertices-templates"]
                 #-- update the "template" in each GeometryInstance
@@ -1099,7 +1845,7 @@ class CityJSON:
                     for g in self.j['CityObjects'][theid]['geometry']:
                         if 'material' in g:
                             for m in g['material']:
-                                update_geom_indices(g['material'][m]['values'], offset)
+                                g['material'][m]['values'] = boundaries.map_array(g['material'][m]['values'], max(boundaries.DEPTHS.get(g["type"], 3) - 2, 1), lambda a: a + offset, True)
             #-- textures
             if ("appearance" in cm.j) and ("textures" in cm.j["appearance"]):
                 if ("appearance" in self.j) and ("textures" in self.j["appearance"]):
@@ -1217,100 +1963,97 @@ class CityJSON:
         #-- if already a triangle then return it
         if ( (len(face) == 1) and (len(face[0]) == 3) ):
             return (face, True)
-        sf = np.array([], dtype=np.int32)
-        for ring in face:
-            sf = np.hstack( (sf, np.array(ring)) )
-        sfv = vnp[sf]
-        # print(sf)
-        # print(sfv)
-        rings = np.zeros(len(face), dtype=np.int32)
-        total = 0
-        for i in range(len(face)):
-            total += len(face[i])
-            rings[i] = total
-        # print(rings)
+        rings = np.array([0] + [len(ring) for ring in face], dtype=np.int64).cumsum()
+        re, owners = triangulation.triangulate(vnp, np.array([0, len(face)]), rings, np.array([i for ring in face for i in ring], dtype=np.int64))
+        if len(re) == 0:
+            return (np.zeros(3), False)
+        return (re, True)
 
-        # 1. normal with Newell's method
-        n, b = geom_help.get_normal_newell(sfv)
-        if b == False:
-            return (n, False)
-        # print ("Newell:", n)
-        # 2. project to the plane to get xy
-        sfv2d = np.zeros( (sfv.shape[0], 2))
-        # print (sfv2d)
-        for i,p in enumerate(sfv):
-            xy = geom_help.to_2d(p, n)
-            # print("xy", xy)
-            sfv2d[i][0] = xy[0]
-            sfv2d[i][1] = xy[1]
-        result = mapbox_earcut.triangulate_float64(sfv2d, rings)
-        # print (result.reshape(-1, 3))
-
-        for i,each in enumerate(result):
-            # print (sf[i])        
-            result[i] = sf[each]
-        
-        # print (result.reshape(-1, 3))
-        return (result.reshape(-1, 3), True)
 
-
-    def export2obj(self):
+    def export2obj(self, processes=None, cache=None):
         out = StringIO()
-        #-- write vertices
-        for v in self.j['vertices']:
-            out.write('v ' + str(v[0]) + ' ' + str(v[1]) + ' ' + str(v[2]) + '\n')
-        vnp = np.array(self.j["vertices"])
-        #-- translate to minx,miny
-        minx = 9e9
-        miny = 9e9
-        for each in vnp:
-            if each[0] < minx:
-                    minx = each[0]
-            if each[1] < miny:
-                    miny = each[1]
-        for each in vnp:
-            each[0] -= minx
-            each[1] -= miny
-        # print ("min", minx, miny)
-        # print(vnp)
-        #-- start with the CO
-        for theid in self.j['CityObjects']:
-            for geom in self.j['CityObjects'][theid]['geometry']:
-                out.write('o ' + str(theid) + '\n')
-                if ( (geom['type'] == 'MultiSurface') or (geom['type'] == 'CompositeSurface') ):
-                    for face in geom['boundaries']:
-                        re, b = self.triangulate_face(face, vnp)
-                        if b == True:
-                            for t in re:
-                                out.write("f %d %d %d\n" % (t[0] + 1, t[1] + 1, t[2] + 1))
-                elif (geom['type'] == 'Solid'):
-                    for shell in geom['boundaries']:
-                        for i, face in enumerate(shell):
-                            re, b = self.triangulate_face(face, vnp)
-                            if b == True:
-                                for t in re:
-                                    out.write("f %d %d %d\n" % (t[0] + 1, t[1] + 1, t[2] + 1))
+        self.write_obj(out, processes, cache)
         return out
 
 
-    def reproject(self, epsg):
-        wascompressed = False
-        if "transform" in self.j:
-            self.decompress()
-            wascompressed = True
-        p1 = pyproj.Proj(init='epsg:%d' % (self.get_epsg()))
-        p2 = pyproj.Proj(init='epsg:%d' % (epsg))
-        for v in self.j['vertices']:
-            x, y, z = pyproj.transform(p1, p2, v[0], v[1], v[2])
-            v[0] = x
-            v[1] = y
-            v[2] = z
+    def write_obj(self, fo, processes=None, cache=None):
+        """Write the model as an OBJ file, the surfaces are triangulated
+
+        The CityObjects are triangulated by chunks of OBJ_CHUNK, in this
+        process or in a pool of processes while the vertices are written.
+        A chunk is sent with only its geometries, their vertices and their
+        entries of the cache, and at most OBJ_WINDOW chunks per process are
+        submitted at a time: each one is written (in the order of the
+        CityObjects) as soon as it and the previous ones are completed.
+
+        :param fo: file (text mode)
+        :param processes: number of processes (None to triangulate in this
+            process)
+        :param cache: triangulation.Cache (updated, not saved), or None
+        """
+        vnp = triangulation.translated(self.j["vertices"])
+        cos = [(theid, co.get('geometry', [])) for (theid, co) in self.j['CityObjects'].items()]
+        chunks = (cos[i:i + OBJ_CHUNK] for i in range(0, len(cos), OBJ_CHUNK))
+        if (processes is None) or (processes == 1) or (len(cos) <= OBJ_CHUNK):
+            _write_obj_vertices(fo, self.j['vertices'])
+            for chunk in chunks:
+                fo.write(_obj_faces(chunk, vnp, cache)[0])
+            return
+        def submit(chunk):
+            geoms = [g for (theid, geometries) in chunk for g in geometries]
+            ids = boundaries.Geometries(geoms).indices
+            #-- only the entries of the cache of its geometries
+            part = None if cache is None else cache.subset(triangulation.geometry_keys(geoms, vnp))
+            return pool.submit(_obj_faces, chunk, triangulation.VerticesSubset(vnp, ids), part)
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            pending = collections.deque(submit(chunk) for chunk in itertools.islice(chunks, OBJ_WINDOW * processes))
+            _write_obj_vertices(fo, self.j['vertices'])
+            while len(pending) > 0:
+                block, changes = pending.popleft().result()
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(submit(chunk))
+                fo.write(block)
+                if cache is not None:
+                    cache.merge(changes)
+
+
+    def reproject(self, epsg, processes=None):
+        """Reproject the vertices to another EPSG
+
+        A compressed model stays compressed, with the same scale: the integers
+        are transformed and quantized again chunk by chunk, without
+        decompressing the whole model. The geographicalExtent of the metadata
+        and of the CityObjects (those having one) are updated.
+
+        :param epsg: the new EPSG
+        :param processes: number of processes for the large models (all the
+            CPUs by default, 1 to transform in this process)
+        """
+        self.invalidate_spatial_index()
+        transform = self.j.get("transform")
+        v = reproject_vertices(self.j["vertices"], self.get_epsg(), epsg, transform, processes)
+        if transform is not None:
+            if len(v) > 0:
+                transform["translate"] = v.min(axis=0).tolist()
+            self.j["vertices"] = quantize_vertices(v, transform)
+            self.remove_duplicate_vertices()
+            self.compact_vertices()
+        else:
+            self.j["vertices"] = v
         self.set_epsg(epsg)
-        if wascompressed == True:
-            self.compress()
+        if ("metadata" in self.j) and ("geographicalExtent" in self.j["metadata"]):
+            if len(v) > 0:
+                self.j["metadata"]["geographicalExtent"] = v.min(axis=0).tolist() + v.max(axis=0).tolist()
+        if any("geographicalExtent" in co for co in self.j["CityObjects"].values()):
+            ids, bboxes, centroids = self.get_cityobjects_extents()
+            for theid, bbox in zip(ids, bboxes.tolist()):
+                co = self.j["CityObjects"][theid]
+                if ("geographicalExtent" in co) and (not np.isnan(bbox[0])):
+                    co["geographicalExtent"] = bbox
 
 
     def extract_lod(self, thelod):
+        self.invalidate_spatial_index()
         for co in self.j["CityObjects"]:
             re = []
             for i, g in enumerate(self.j['CityObjects'][co]['geometry']):
@@ -1320,26 +2063,322 @@ class CityJSON:
             for each in re:
                 self.j['CityObjects'][co]['geometry'].remove(each)
         self.remove_duplicate_vertices()
-        self.remove_orphan_vertices()        
+        self.compact_vertices()
 
 
     def translate(self, values, minimum_xyz):
+        self.invalidate_spatial_index()
         if minimum_xyz == True:
             #-- find the minimums
-            bbox = [9e9, 9e9, 9e9]    
-            for v in self.j["vertices"]:
-                for i in range(3):
-                    if v[i] < bbox[i]:
-                        bbox[i] = v[i]
-            bbox[0] = -bbox[0]
-            bbox[1] = -bbox[1]
-            bbox[2] = -bbox[2]
+            if len(self.j["vertices"]) == 0:
+                bbox = [-9e9, -9e9, -9e9]
+            else:
+                bbox = (0.0 - self.transform_vertices(self.j["vertices"].min(axis=0))).tolist()
         else:
             bbox = values
-        for v in self.j['vertices']:
-            v[0] = v[0] + bbox[0]
-            v[1] = v[1] + bbox[1]
-            v[2] = v[2] + bbox[2]
+        #-- the values are in real-world units, with a transform only its translation changes
+        if "transform" in self.j:
+            self.j["transform"]["translate"] = (np.array(self.j["transform"]["translate"]) + bbox).tolist()
+        else:
+            self.j["vertices"] = self.j["vertices"] + np.asarray(bbox, dtype=np.float64)
         self.set_epsg(None)
         self.update_bbox()
         return bbox
+
+
+class CityJSONStream:
+    """A CityJSON file read incrementally (the '--stream' mode of cjio)
+
+    Only the root properties, the vertices and the IDs of the CityObjects
+    (with the offsets of their values in the file) are kept in memory. The
+    vertices are one NumPy array that stays in memory, thus the size of the
+    file that can be streamed is still bounded by the number of vertices.
+    The first pass skips the CityObjects without decoding them; their
+    hierarchy (type, children, parents, members) is read at the first
+    subset. The CityObjects are read from the file, one at a time, each
+    time they are iterated over, thus the file must stay open.
+    """
+
+    HIERARCHY = ('type', 'toplevel', 'children', 'parents', 'parent', 'members')
+
+    def __init__(self, file, ignore_duplicate_keys=False, index=None):
+        self.file = file
+        self.path = os.path.abspath(file.name)
+        if (not file.seekable()) and (not os.path.isfile(self.path)):
+            raise IOError("Streaming needs a file that can be read twice (not stdin).")
+        self.j = {}
+        self.keys = []
+        #-- (id, start, end) of the CityObjects, in the file
+        self.offsets = []
+        self._hierarchy = None
+        self.selection = None
+        self.index = index
+        if index is not None:
+            self._read_index()
+            return
+        sc = stream.Scanner(file)
+        for key in sc.members():
+            self.keys.append(key)
+            if key == "CityObjects":
+                #-- 1st pass: only the IDs and the offsets are kept
+                self.offsets = sc.skip_members()
+                seen = set()
+                for theid, start, end in self.offsets:
+                    if (theid in seen) and (ignore_duplicate_keys == False):
+                        raise ValueError("Invalid CityJSON file, duplicate key for City Object IDs: %r" % (theid))
+                    seen.add(theid)
+            elif key == "vertices":
+                self.j["vertices"] = stream.read_vertices(sc)
+            else:
+                self.j[key] = sc.read_value()
+        if ("type" not in self.j) or (self.j["type"] != "CityJSON"):
+            raise ValueError("Not a CityJSON file")
+        if "vertices" not in self.j:
+            self.j["vertices"] = np.zeros((0, 3))
+
+
+    def _read_index(self):
+        #-- nothing is parsed, everything comes from the index
+        self.keys = self.index["keys"]
+        self.j = dict(self.index["root"])
+        self.j["vertices"] = index.IndexedVertices(self.path, self.index["vertices"])
+        cos = self.index["cityobjects"]
+        self._hierarchy = collections.OrderedDict()
+        for theid, cotype in zip(cos["ids"], cos["types"]):
+            self._hierarchy[theid] = {"type": cotype}
+            if theid in self.index["hierarchy"]:
+                self._hierarchy[theid].update(self.index["hierarchy"][theid])
+
+
+    @property
+    def hierarchy(self):
+        """The type, children, parents and members of the CityObjects, read
+        from the file at the first use"""
+        if self._hierarchy is None:
+            self._hierarchy = collections.OrderedDict()
+            for theid, co in self._read_cityobjects(None):
+                self._hierarchy[theid] = {k: co[k] for k in self.HIERARCHY if k in co}
+        return self._hierarchy
+
+
+    def __repr__(self):
+        return self.get_info()
+
+
+    def get_version(self):
+        return self.j["version"]
+
+
+    def get_epsg(self):
+        return CityJSON(j=self._root()).get_epsg()
+
+
+    def _root(self):
+        """The root properties, without the vertices"""
+        return {k: v for (k, v) in self.j.items() if k != "vertices"}
+
+
+    def iter_cityobjects(self):
+        """Generator of the (id, CityObject) of the file (or of the subset)"""
+        if self.index is not None:
+            yield from self._iter_indexed()
+            return
+        yield from self._read_cityobjects(self.selection)
+
+
+    def _read_cityobjects(self, selection):
+        #-- the CityObjects not selected are skipped, not decoded
+        if len(self.offsets) == 0:
+            return
+        with contextlib.ExitStack() as stack:
+            f = self.file
+            if f.seekable():
+                f.seek(0)
+            else:
+                #-- some compressed streams can't be rewound, they are opened again (and closed)
+                f = stack.enter_context(compression.open_file(self.path, mode='r'))
+            sc = stream.Scanner(f)
+            for theid, start, end in self.offsets:
+                if (selection is None) or (theid in selection):
+                    sc.skip(start - sc.tell())
+                    yield (theid, sc.read_value())
+
+
+    def _iter_indexed(self):
+        cos = self.index["cityobjects"]
+        with open(self.path, 'rb') as fb:
+            for theid, (start, end) in zip(cos["ids"], cos["ranges"]):
+                if (self.selection is None) or (theid in self.selection):
+                    fb.seek(start)
+                    yield (theid, json.loads(fb.read(end - start).decode('utf-8')))
+
+
+    def get_vertices(self, co):
+        """The vertices used by the geometries of one CityObject
+
+        :param co: a CityObject
+        :returns: (indices, coordinates) -- the sorted indices of the vertices
+            and their real-world coordinates (the transform is applied)
+        """
+        ids = np.unique(boundaries.Geometries(co['geometry']).indices)
+        return (ids, self.transform_vertices(self.j["vertices"][ids]))
+
+
+    def transform_vertices(self, v):
+        if "transform" in self.j:
+            return (v * np.array(self.j["transform"]["scale"])) + np.array(self.j["transform"]["translate"])
+        return v
+
+
+    def get_bbox(self):
+        if (self.selection is None) and ("metadata" in self.j) and ("geographicalExtent" in self.j["metadata"]):
+            return self.j["metadata"]["geographicalExtent"]
+        return self.calculate_bbox()
+
+
+    def calculate_bbox(self):
+        if self.selection is None:
+            v = self.j["vertices"][:]
+        else:
+            used = np.zeros(len(self.j["vertices"]), dtype=bool)
+            for theid, co in self.iter_cityobjects():
+                used[self.get_vertices(co)[0]] = True
+            v = self.j["vertices"][used]
+        return self._bbox(v)
+
+
+    def _bbox(self, v):
+        if len(v) == 0:
+            return [0, 0, 0, 0, 0, 0]
+        v = self.transform_vertices(v)
+        return v.min(axis=0).tolist() + v.max(axis=0).tolist()
+
+
+    def _subset(self, re, exclude):
+        if self.selection is None:
+            allkeys = set(self.hierarchy.keys())
+        else:
+            allkeys = self.selection
+        if exclude == True:
+            re = allkeys ^ re
+        s = copy.copy(self)
+        s.selection = re & allkeys
+        if self.index is not None:
+            #-- the vertices of the subset are read at once
+            cos = self.index["cityobjects"]
+            self.j["vertices"].load_ranges(r for (theid, r) in zip(cos["ids"], cos["vertices"]) if theid in s.selection)
+        return s
+
+
+    def get_subset_ids(self, lsIDs, exclude=False):
+        re = subset.select_co_ids({"CityObjects": self.hierarchy}, lsIDs)
+        return self._subset(re, exclude)
+
+
+    def get_subset_cotype(self, cotype, exclude=False):
+        re = subset.select_co_cotype({"CityObjects": self.hierarchy}, cotype)
+        #-- also add the parent-children
+        re = subset.Hierarchy(self.hierarchy).closure(re)
+        return self._subset(re, exclude)
+
+
+    def get_info(self):
+        cm = CityJSON(j=self._root())
+        total = 0
+        cotypes = set()
+        geomtypes = set()
+        used = np.zeros(len(self.j["vertices"]), dtype=bool)
+        for theid, co in self.iter_cityobjects():
+            if cm.is_co_toplevel(co):
+                total += 1
+            cotypes.add(co['type'])
+            for geom in co['geometry']:
+                geomtypes.add(geom["type"])
+            used[boundaries.Geometries(co['geometry']).indices] = True
+        info = collections.OrderedDict()
+        info["cityjson_version"] = self.get_version()
+        info["epsg"] = self.get_epsg()
+        #-- like CityJSON.get_info(): the extent of the CityObjects (the orphan vertices don't count)
+        if (self.selection is None) and ("metadata" in self.j) and ("geographicalExtent" in self.j["metadata"]):
+            info["bbox"] = self.j["metadata"]["geographicalExtent"]
+        elif (self.selection is None) and (not used.any()):
+            info["bbox"] = self.calculate_bbox()
+        else:
+            info["bbox"] = self._bbox(self.j["vertices"][used])
+        if "extensions" in self.j:
+            info["extensions"] = sorted(list(self.j["extensions"]))
+        info["cityobjects_total"] = total
+        info["cityobjects_present"] = sorted(list(cotypes))
+        if self.selection is None:
+            info["vertices_total"] = len(self.j["vertices"])
+        else:
+            info["vertices_total"] = int(used.sum())
+        info["transform/compressed"] = "transform" in self.j
+        info["geom_primitives_present"] = list(geomtypes)
+        if 'appearance' in self.j:
+            info["materials"] = 'materials' in self.j['appearance']
+            info["textures"] = 'textures' in self.j['appearance']
+        else:
+            info["materials"] = False
+            info["textures"] =  False
+        return json.dumps(info, indent=2)
+
+
+    def write(self, fo, indent=0, chunk_size=VERTICES_CHUNK, json_backend=None):
+        """Write the CityJSON (or its subset) to a file, one CityObject at a time
+
+        Without a subset, the root properties are written in their original
+        order. With a subset, the vertices are renumbered in the order of
+        their first use, and "vertices" and "metadata" are written after
+        the "CityObjects". The appearances and templates are kept complete.
+
+        :param fo: file object (text mode)
+        :param indent: indentation, 0 for the most compact output
+        :param chunk_size: number of vertices written at once
+        :param json_backend: JSON module encoding the compact output
+        """
+        vertices = self.j["vertices"]
+        #-- only the old indices are collected, the vertices are copied at the end
+        newids = np.full(len(vertices), -1, dtype=np.int64)
+        newvertices = []
+        count = 0
+        def renumbered(batch):
+            #-- the geometries of a batch of CityObjects are renumbered at once
+            nonlocal count
+            geoms = boundaries.Geometries(g for (theid, co) in batch for g in co['geometry'])
+            old = boundaries.first_occurrences(geoms.indices[newids[geoms.indices] == -1])
+            newids[old] = np.arange(count, count + len(old))
+            count += len(old)
+            newvertices.append(old)
+            geoms.remap(newids)
+            return batch
+        def cityobjects():
+            batch = []
+            for theid, co in self.iter_cityobjects():
+                if self.selection is None:
+                    yield (theid, co)
+                    continue
+                batch.append((theid, co))
+                if len(batch) == CITYOBJECTS_BATCH:
+                    yield from renumbered(batch)
+                    batch = []
+            if len(batch) > 0:
+                yield from renumbered(batch)
+        def members():
+            for key in self.keys:
+                if key == "CityObjects":
+                    yield (key, stream.StreamedObject(cityobjects()))
+                elif self.selection is None:
+                    if key == "vertices":
+                        yield (key, stream.StreamedArray(stream.chunks(vertices, chunk_size)))
+                    else:
+                        yield (key, self.j[key])
+                elif key not in ("vertices", "metadata"):
+                    yield (key, self.j[key])
+            if self.selection is not None:
+                v = vertices[np.concatenate(newvertices + [np.zeros(0, dtype=np.int64)])]
+                yield ("vertices", stream.StreamedArray(stream.chunks(v, chunk_size)))
+                metadata = dict(self.j.get("metadata", {}))
+                metadata["geographicalExtent"] = self._bbox(v)
+                yield ("metadata", metadata)
+        stream.write_json(fo, stream.StreamedObject(members()), indent, backend=json_backend)
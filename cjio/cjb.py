@@ -0,0 +1,218 @@
+
+"""Binary cache of a CityJSON model (.cjb), reloaded without parsing JSON.
+
+Layout of a file (all numbers little-endian):
+
+    MAGIC (8 bytes)
+    the arrays, each starting at a multiple of 8 bytes:
+        "vertices"          (N, 3) int32/int64 (with a transform) or float64
+        "vertices-texture"  (M, 2) float64, if there are textures
+        "offsets"           int64, the offsets of all the flattened arrays
+        "indices"           int32/int64, the indices of all the flattened arrays
+    the sidecar (UTF-8 JSON): the model, where the "vertices" are null and
+        the flattened arrays are replaced by {"$cjb": [depth, ostart, istart, n]},
+        and the description [offset, dtype, shape] of each array
+    footer: offset and length of the sidecar (2 x uint64)
+
+The "boundaries" of a geometry of depth d (eg 3 for a MultiSurface), and the
+"values" of its semantics/materials/textures, are stored like the rows of a
+CSR matrix: d-1 lists of offsets and the indices. The first list of offsets
+(n+1 values) starts at offsets[ostart], the next one is just after and has a
+length of the last offset of the previous one + 1 (each starts at 0), and the
+indices start at indices[istart]; a null index is -1. The arrays that can't
+be flattened (irregular ones, or unknown types of geometry) stay in the
+sidecar.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from cjio import jsonbackend
+from cjio import cityjson
+from cjio import boundaries
+
+
+MAGIC = b'CJB\x00\x01\x00\x00\x00'
+FOOTER = struct.Struct('<QQ')
+ALIGN = 8
+
+#-- depth of the arrays of boundaries
+DEPTHS = boundaries.DEPTHS
+
+
+def is_cjb(path):
+    """True if the file starts with the magic number of the .cjb files"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def _write_array(fo, a):
+    pos = fo.tell()
+    if pos % ALIGN != 0:
+        fo.write(b'\x00' * (ALIGN - pos % ALIGN))
+        pos = fo.tell()
+    fo.write(np.ascontiguousarray(a).tobytes())
+    return [pos, a.dtype.str, list(a.shape)]
+
+
+def write(cm, path):
+    """Write the model (CityJSON) to a .cjb file, the model is not modified
+
+    :param cm: CityJSON
+    :param path: path of the file
+    :raises: IOError
+    """
+    with cityjson.no_gc():
+        _write(cm, path)
+
+
+def _write(cm, path):
+    offsets = []
+    indices = []
+    #-- the number of offsets and indices so far
+    counts = [0, 0]
+    def pack(a, depth, nulls):
+        if not isinstance(a, list):
+            return a
+        re = boundaries.flatten(a, depth, nulls)
+        if re is None:
+            return a
+        desc = {"$cjb": [depth, counts[0], counts[1], len(a)]}
+        for o in re[0]:
+            offsets.append(o)
+            counts[0] += len(o)
+        indices.append(re[1])
+        counts[1] += len(re[1])
+        return desc
+    j = {}
+    for key in cm.j:
+        j[key] = cm.j[key]
+    j["vertices"] = None
+    vt = None
+    if ("appearance" in j) and ("vertices-texture" in j["appearance"]):
+        vt = np.asarray(j["appearance"]["vertices-texture"])
+        if (vt.ndim == 2) and (vt.dtype.kind == 'f'):
+            j["appearance"] = dict(j["appearance"])
+            j["appearance"]["vertices-texture"] = None
+        else:
+            vt = None
+    j["CityObjects"] = {}
+    for theid, co in cm.j["CityObjects"].items():
+        co2 = dict(co)
+        if "geometry" in co:
+            co2["geometry"] = []
+            for g in co["geometry"]:
+                depth = DEPTHS.get(g.get("type"))
+                if (depth is not None) and ("boundaries" in g):
+                    g = dict(g)
+                    g["boundaries"] = pack(g["boundaries"], depth, False)
+                    #-- one value per surface (per point/linestring), one per ring for textures
+                    if ("semantics" in g) and ("values" in g["semantics"]):
+                        g["semantics"] = dict(g["semantics"])
+                        g["semantics"]["values"] = pack(g["semantics"]["values"], max(depth - 2, 1), True)
+                    for each in ("material", "texture"):
+                        if each not in g:
+                            continue
+                        g[each] = dict(g[each])
+                        for theme in g[each]:
+                            if "values" in g[each][theme]:
+                                g[each][theme] = dict(g[each][theme])
+                                d = depth if each == "texture" else max(depth - 2, 1)
+                                g[each][theme]["values"] = pack(g[each][theme]["values"], d, True)
+                co2["geometry"].append(g)
+        j["CityObjects"][theid] = co2
+    offsets = np.concatenate([np.zeros(0, dtype=np.int64)] + offsets).astype('<i8')
+    indices = np.concatenate([np.zeros(0, dtype=np.int64)] + indices)
+    if len(indices) > 0:
+        indices = indices.astype(np.dtype(boundaries.index_dtype(indices.max())).newbyteorder('<'))
+    else:
+        indices = indices.astype('<i4')
+    with open(path, 'wb') as fo:
+        fo.write(MAGIC)
+        arrays = {}
+        v = cityjson.vertices_array(cm.j["vertices"], "transform" in cm.j)
+        arrays["vertices"] = _write_array(fo, v.astype(v.dtype.newbyteorder('<')))
+        if vt is not None:
+            arrays["vertices-texture"] = _write_array(fo, vt.astype('<f8'))
+        arrays["offsets"] = _write_array(fo, offsets)
+        arrays["indices"] = _write_array(fo, indices)
+        sidecar = jsonbackend.dumps({"arrays": arrays, "cityjson": j}).encode('utf-8')
+        pos = fo.tell()
+        fo.write(sidecar)
+        fo.write(FOOTER.pack(pos, len(sidecar)))
+
+
+def load(path):
+    """Memory-map a .cjb file, without rebuilding the model
+
+    :returns: (j, arrays) -- the model as stored in the sidecar, and a dict
+        of the (memory-mapped) NumPy arrays
+    :raises: ValueError if the file is not a .cjb file
+    """
+    m = np.memmap(path, dtype=np.uint8, mode='r')
+    if (len(m) < len(MAGIC) + FOOTER.size) or (m[:len(MAGIC)].tobytes() != MAGIC):
+        raise ValueError("Not a cjb file")
+    pos, length = FOOTER.unpack(m[-FOOTER.size:].tobytes())
+    sidecar = jsonbackend.loads(m[pos:pos + length].tobytes().decode('utf-8'))
+    arrays = {}
+    for name, (offset, dtype, shape) in sidecar["arrays"].items():
+        dtype = np.dtype(dtype)
+        n = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = m[offset:offset + n].view(dtype).reshape(shape)
+    return (sidecar["cityjson"], arrays)
+
+
+def unpack(desc, offsets, indices):
+    """Nested lists from their descriptor [depth, ostart, istart, n], the
+    offsets are a list and the indices an array"""
+    depth, ostart, istart, n = desc
+    levels = []
+    count = n
+    for k in range(depth - 1):
+        o = offsets[ostart:ostart + count + 1]
+        levels.append(o)
+        ostart += count + 1
+        count = o[-1]
+    return boundaries.unflatten(levels, indices[istart:istart + count], nulls=True)
+
+
+def read(path):
+    """Read a .cjb file
+
+    :returns: the model (CityJSON)
+    :raises: ValueError if the file is not a .cjb file
+    """
+    with cityjson.no_gc():
+        j = _read(path)
+    cm = cityjson.CityJSON(j=j)
+    cm.path = os.path.abspath(path)
+    return cm
+
+
+def _read(path):
+    j, arrays = load(path)
+    offsets = arrays["offsets"].tolist()
+    indices = np.asarray(arrays["indices"], dtype=np.int64)
+    def unpacked(a):
+        if isinstance(a, dict) and ("$cjb" in a):
+            return unpack(a["$cjb"], offsets, indices)
+        return a
+    for co in j["CityObjects"].values():
+        for g in co.get("geometry", []):
+            if "boundaries" in g:
+                g["boundaries"] = unpacked(g["boundaries"])
+            if ("semantics" in g) and ("values" in g["semantics"]):
+                g["semantics"]["values"] = unpacked(g["semantics"]["values"])
+            for each in ("material", "texture"):
+                for theme in g.get(each, {}).values():
+                    if "values" in theme:
+                        theme["values"] = unpacked(theme["values"])
+    j["vertices"] = np.array(arrays["vertices"])
+    if "vertices-texture" in arrays:
+        j["appearance"]["vertices-texture"] = arrays["vertices-texture"].tolist()
+    return j
@@ -5,10 +5,18 @@ from os import makedirs
 import click
 import json
 import sys
-import copy
 import glob
+import math
 import cjio
 from cjio import cityjson
+from cjio import jsonbackend
+from cjio import compression
+from cjio import cjb
+from cjio import index
+from cjio import triangulation
+from cjio import gltf
+from cjio import ply
+from cjio import stl
 
 
 #-- https://stackoverflow.com/questions/47437472/in-python-click-how-do-i-see-help-for-subcommands-whose-parents-have-required
@@ -31,17 +39,28 @@ def print_cmd_status(s):
     click.echo(click.style(s, bg='cyan', fg='black'))
 
 
+def streamable(processor):
+    #-- mark the operators that also work with '--stream'
+    processor.streamable = True
+    return processor
+
+
 @click.group(chain=True)
 @click.version_option(version=cjio.__version__)
 @click.argument('input', cls=PerCommandArgWantSubCmdHelp)
 @click.option('--ignore_duplicate_keys', is_flag=True, help='Load a CityJSON file even if some City Objects have the same IDs (technically invalid file)')
+@click.option('--stream', is_flag=True, help='Read the City Objects one at a time instead of loading the whole file (only with info, subset --id/--cotype, and save). All the vertices are still loaded in memory.')
+@click.option('--json-backend', type=click.Choice(jsonbackend.BACKENDS), help='JSON module used to read and save files (default: the fastest installed for reading, json for saving).')
 @click.pass_context
-def cli(context, input, ignore_duplicate_keys):
+def cli(context, input, ignore_duplicate_keys, stream, json_backend):
     """Process and manipulate a CityJSON file, and allow
     different outputs. The different operators can be chained
     to perform several processing in one step, the CityJSON model
     goes through the different operators.
 
+    INPUT can also be a folder: each of its OFF and POLY files becomes
+    a City Object (the files are read in parallel).
+
     To get help on specific command, eg for 'validate':
 
     \b
@@ -53,30 +72,78 @@ def cli(context, input, ignore_duplicate_keys):
         cjio example.json info validate
         cjio example.json assign_epsg 7145 remove_textures export output.obj
         cjio example.json subset --id house12 save out.json
+        cjio --stream large.json subset --cotype Building save out.json
+        cjio meshes/ save meshes.json
     """
-    context.obj = {"argument": input}
+    context.obj = {"argument": input, "json_backend": json_backend}
 
 
 @cli.resultcallback()
-def process_pipeline(processors, input, ignore_duplicate_keys):
-    extensions = ['.json', '.off', '.poly'] #-- input allowed
+def process_pipeline(processors, input, ignore_duplicate_keys, stream, json_backend):
+    extensions = ['.json', '.jsonl', '.cjb', '.off', '.poly'] #-- input allowed
     try:
-        f = click.open_file(input, mode='r')
-        extension = os.path.splitext(input)[1].lower()
-        if extension not in extensions:
-            raise IOError("File type not supported (only .json, .off, and .poly).")
+        jsonbackend.get(json_backend)
+    except ValueError as e:
+        raise click.ClickException("%s." % e)
+    if stream:
+        for processor in processors:
+            if not getattr(processor, 'streamable', False):
+                raise click.ClickException("Only the operators 'info', 'subset' (--id/--cotype) and 'save' can be used with '--stream'.")
+    try:
+        #-- a folder: all its OFF and POLY files
+        if os.path.isdir(input):
+            extension = None
+        else:
+            extension = compression.splitext(input)[0]
+        if (extension is not None) and (extension not in extensions):
+            raise IOError("File type not supported (only .json, .jsonl, .cjb, .off, and .poly; possibly compressed with .gz, .bz2, .xz or .zst).")
+        if stream and (extension != '.json'):
+            raise IOError("Only CityJSON files can be streamed.")
+        #-- with an index (and '--stream'), only the City Objects needed are read
+        indexed = False
+        if (extension == '.json') and (compression.detect(input) is None) and all(getattr(p, 'streamable', False) for p in processors):
+            if any(getattr(p, 'indexes', False) for p in processors):
+                print_cmd_status("Indexing %s" % (input))
+                idx = index.build(input, ignore_duplicate_keys)
+                indexed = True
+            elif stream and index.exists(input):
+                idx = index.load(input)
+                if idx is None:
+                    print_cmd_status("Indexing %s (the index is out of date)" % (input))
+                    idx = index.build(input, ignore_duplicate_keys)
+                indexed = True
+        if extension not in (None, '.cjb'):
+            f = compression.open_file(input, mode='r')
+        if extension is None:
+            print_cmd_status("Converting the OFF and POLY files of %s to CityJSON" % (input))
+            cm = cityjson.dir2cj(input)
+        #-- cjb file: the binary cache, nothing to parse
+        elif (extension == '.cjb'):
+            print_cmd_status("Loading %s" % (input))
+            cm = cjb.read(input)
         #-- OFF file
-        if (extension == '.off'):
+        elif (extension == '.off'):
             print_cmd_status("Converting %s to CityJSON" % (input))
             cm = cityjson.off2cj(f)
         #-- POLY file
         elif (extension == '.poly'):
             print_cmd_status("Converting %s to CityJSON" % (input))
             cm = cityjson.poly2cj(f)            
+        #-- CityJSON feature sequence
+        elif (extension == '.jsonl'):
+            print_cmd_status("Converting %s to CityJSON" % (input))
+            cm = cityjson.cjseq2cj(f)
         #-- CityJSON file
         else: 
-            print_cmd_status("Parsing %s" % (input))
-            cm = cityjson.reader(file=f, ignore_duplicate_keys=ignore_duplicate_keys)
+            if indexed:
+                print_cmd_status("Reading %s with its index" % (input))
+                cm = cityjson.CityJSONStream(f, index=idx)
+            elif stream:
+                print_cmd_status("Parsing %s" % (input))
+                cm = cityjson.CityJSONStream(f, ignore_duplicate_keys=ignore_duplicate_keys)
+            else:
+                print_cmd_status("Parsing %s" % (input))
+                cm = cityjson.reader(file=f, ignore_duplicate_keys=ignore_duplicate_keys, json_backend=json_backend)
             if (cm.get_version() not in cityjson.CITYJSON_VERSIONS_SUPPORTED):
                 allv = ""
                 for v in cityjson.CITYJSON_VERSIONS_SUPPORTED:
@@ -104,54 +171,161 @@ def info_cmd(context):
         theinfo = cm.get_info()
         click.echo(theinfo)
         return cm
-    return processor
+    return streamable(processor)
 
 
 @cli.command('export')
 @click.argument('filename')
-def export_cmd(filename):
+@click.option('--no-tri-cache', is_flag=True, help='Do not use (nor update) the triangulation cache.')
+@click.pass_context
+def export_cmd(context, filename, no_tri_cache):
     """Export the CityJSON to another format.
 
-    Currently only OBJ file are supported; textures are not supported, sorry.
+    OBJ files (textures are not supported, sorry), binary glTF files (.glb:
+    one mesh per City Object, the templates are instanced), binary PLY
+    files (.ply: each face has the index of its City Object and its
+    semantic type), binary STL files (.stl) and CityJSON feature sequences
+    (.jsonl: one City Object with its children per line).
+    The OBJ and .jsonl files are compressed if their name ends with .gz,
+    .bz2, .xz or .zst.
+
+    The triangulations are kept in a cache next to the input file
+    (input.json.tri), the geometries that didn't change are not
+    triangulated again. The cache is not written if the folder of the
+    input is read-only.
     """
+    input = context.obj["argument"]
     def processor(cm):
+        #-- output allowed
+        extensions = ['.obj', '.jsonl', '.glb', '.ply', '.stl'] 
+        #-- the binary formats, written by their module
+        writers = {'.glb': gltf.write, '.ply': ply.write, '.stl': stl.write}
+        extension = compression.splitext(filename)[0]
         #-- mapbox_earcut available?
-        if (cityjson.MODULE_EARCUT_AVAILABLE == False):
-            str = "OBJ export skipped: Python module 'mapbox_earcut' missing (to triangulate faces)"
+        if (extension in ['.obj'] + list(writers)) and (cityjson.MODULE_EARCUT_AVAILABLE == False):
+            str = "%s export skipped: Python module 'mapbox_earcut' missing (to triangulate faces)" % extension[1:].upper()
             click.echo(click.style(str, fg='red'))
             str = "Install it: https://github.com/skogler/mapbox_earcut_python"
             click.echo(str)
             return cm
-        #-- output allowed
-        extensions = ['.obj'] 
         #--
-        print_cmd_status("Converting CityJSON to OBJ (%s)" % (filename))
+        if extension == '.jsonl':
+            print_cmd_status("Converting CityJSON to CityJSON feature sequence (%s)" % (filename))
+        elif extension in writers:
+            print_cmd_status("Converting CityJSON to %s (%s)" % (extension[1:].upper(), filename))
+        else:
+            print_cmd_status("Converting CityJSON to OBJ (%s)" % (filename))
         f = os.path.basename(filename)
         d = os.path.abspath(os.path.dirname(filename))
         if not os.path.isdir(d):
             os.makedirs(d)
         p = os.path.join(d, f)
         try:
-            extension = os.path.splitext(p)[1].lower()
             if (extension not in extensions):
-                raise IOError("Only .obj files supported")
-            fo = click.open_file(p, mode='w')
-            re = cm.export2obj()
-            fo.write(re.getvalue())
+                raise IOError("Only .obj, .glb, .ply, .stl and .jsonl files supported")
+            cache = None
+            if (extension != '.jsonl') and (no_tri_cache == False) and os.path.isfile(input):
+                tri = input + triangulation.CACHE_EXTENSION
+                #-- next to a read-only input, an existing cache is only read
+                writable = os.access(os.path.dirname(os.path.abspath(tri)), os.W_OK)
+                if writable or os.path.isfile(tri):
+                    cache = triangulation.Cache(tri)
+            if extension in writers:
+                if compression.splitext(filename)[1] is not None:
+                    raise IOError("%s files can't be compressed" % extension)
+                writers[extension](cm, p, cache)
+            else:
+                with compression.open_file(p, mode='w') as fo:
+                    if extension == '.jsonl':
+                        cm.export2cjseq(fo)
+                    else:
+                        cm.write_obj(fo, cache=cache)
+            if (cache is not None) and writable:
+                try:
+                    cache.save()
+                except IOError as e:
+                    click.echo("WARNING: the triangulation cache can't be saved (%s)." % e)
         except IOError as e:
             raise click.ClickException('Invalid output file: "%s".\n%s' % (p, e))                
         return cm
     return processor
 
 
+@cli.command('index')
+@click.pass_context
+def index_cmd(context):
+    """Index the CityJSON file for random access.
+
+    The byte ranges of the City Objects, the ranges of their vertices and
+    their types are saved in a sidecar file (input.json.idx). When it
+    exists, 'info', 'subset --id/--cotype' and 'save' with '--stream' read
+    only the City Objects (and the vertices) they need. The index is
+    rebuilt when the file is modified.
+    """
+    path = context.obj["argument"]
+    def processor(cm):
+        #-- already built when the file was opened, except with other operators
+        if getattr(cm, 'index', None) is None:
+            if (compression.splitext(path)[0] != '.json') or (compression.detect(path) is not None):
+                raise click.ClickException("Only CityJSON files (not compressed) can be indexed.")
+            print_cmd_status("Indexing %s" % (path))
+            try:
+                index.build(path)
+            except (ValueError, IOError) as e:
+                raise click.ClickException('%s: "%s".' % (e, path))
+        return cm
+    processor.indexes = True
+    return streamable(processor)
+
+
+@cli.command('tile')
+@click.argument('directory')
+@click.option('--max-objects', type=click.IntRange(min=1), default=1000, show_default=True,
+              help='Maximum number of (top-level) City Objects in a tile of the quadtree.')
+@click.option('--grid', 'size', type=float,
+              help='Use square tiles of this size instead of a quadtree.')
+@click.option('--indent', default=0)
+def tile_cmd(directory, max_objects, size, indent):
+    """Split the city model in tiles, saved in a directory.
+
+    The City Objects are partitioned by their 2D centroid, in a quadtree
+    (tiles are split until they have at most '--max-objects') or a regular
+    grid. A City Object stays in the tile of its parent. Each tile is a
+    CityJSON file with only its vertices, appearances and templates
+    (tile_<key>.json); the files and their bbox are listed in tiles.json.
+    """
+    if (size is not None) and (size <= 0):
+        raise click.BadParameter("must be positive.", param_hint="'--grid'")
+    def processor(cm):
+        print_cmd_status("Tiling CityJSON (%s)" % (directory))
+        try:
+            index = cm.write_tiles(directory, max_objects, size, indent=indent)
+        except IOError as e:
+            raise click.ClickException('Invalid output directory: "%s".\n%s' % (directory, e))
+        click.echo("%d tiles written" % len(index))
+        return cm
+    return processor
+
+
 @cli.command('save')
 @click.argument('filename')
 @click.option('--indent', default=0)
 @click.option('--textures', default=None, 
               type=str,
               help='Path to the new textures directory. This command copies the textures to a new location. Useful when creating an independent subset of a CityJSON file.')
-def save_cmd(filename, indent, textures):
-    """Save the city model to a CityJSON file."""
+@click.option('--format', 'fmt', type=click.Choice(['json', 'cjb']), default=None,
+              help='json (default) or cjb: binary cache reloaded without parsing (default for .cjb files).')
+@click.pass_context
+def save_cmd(context, filename, indent, textures, fmt):
+    """Save the city model to a CityJSON file.
+
+    The file is compressed if its name ends with .gz, .bz2, .xz or .zst.
+    With '--format cjb' (or a .cjb file) the model is saved in a binary
+    file that cjio reads back much faster (eg to chain several runs).
+    """
+    json_backend = context.obj["json_backend"]
+    if fmt is None:
+        fmt = 'cjb' if compression.splitext(filename)[0] == '.cjb' else 'json'
     def processor(cm):
         print_cmd_status("Saving CityJSON to a file (%s)" % (filename))
         f = os.path.basename(filename)
@@ -160,18 +334,26 @@ def save_cmd(filename, indent, textures):
             os.makedirs(d)
         p = os.path.join(d, f)
         try:
-            fo = click.open_file(p, mode='w')
-            if textures:
-                cm.copy_textures(textures, p)
-            if indent == 0:
-                json_str = json.dumps(cm.j, separators=(',',':'))
-                fo.write(json_str)
-            else:
-                json_str = json.dumps(cm.j, indent=indent)
-                fo.write(json_str)
+            if fmt == 'cjb':
+                if isinstance(cm, cityjson.CityJSONStream):
+                    raise click.ClickException("cjb files can't be saved with '--stream'.")
+                if compression.splitext(p)[1] is not None:
+                    raise IOError("cjb files can't be compressed.")
+                if textures:
+                    cm.copy_textures(textures, p)
+                cjb.write(cm, p)
+                return cm
+            with compression.open_file(p, mode='w') as fo:
+                if textures:
+                    if isinstance(cm, cityjson.CityJSONStream):
+                        raise click.ClickException("Textures can't be copied with '--stream'.")
+                    cm.copy_textures(textures, p)
+                cm.write(fo, indent, json_backend=json_backend)
         except IOError as e:
             raise click.ClickException('Invalid output file: "%s".\n%s' % (p, e))                
         return cm
+    if (fmt == 'json') and (textures is None):
+        return streamable(processor)
     return processor
 
 
@@ -242,7 +424,8 @@ def validate_cmd(hide_errors, skip_schema, folder_schemas):
 
 @cli.command('merge')
 @click.argument('filepattern')
-def merge_cmd(filepattern):
+@click.pass_context
+def merge_cmd(context, filepattern):
     """
     Merge the current CityJSON with others.
     All City Objects with their textures/materials/templates are handled.
@@ -257,8 +440,8 @@ def merge_cmd(filepattern):
         g = glob.glob(filepattern)
         for i in g:
             try:
-                f = click.open_file(i, mode='r')
-                lsCMs.append(cityjson.reader(f))
+                f = compression.open_file(i, mode='r')
+                lsCMs.append(cityjson.reader(f, json_backend=context.obj["json_backend"]))
             except ValueError as e:
                 raise click.ClickException('%s: "%s".' % (e, input))
             except IOError as e:
@@ -280,23 +463,37 @@ def merge_cmd(filepattern):
 @click.option('--cotype',
     type=click.Choice(['Building', 'Bridge', 'Road', 'TransportSquare', 'LandUse', 'Railway', 'TINRelief', 'WaterBody', 'PlantCover', 'SolitaryVegetationObject', 'CityFurniture', 'GenericCityObject', 'Tunnel']), 
     help='The City Object type')
+@click.option('--where', help="Expression on the attributes, the type and the bbox, eg \"yearOfConstruction < 1950 and function == 'residential'\".")
 @click.option('--exclude', is_flag=True, help='Excludes the selection, thus delete the selected object(s).')
-def subset_cmd(id, bbox, random, cotype, exclude):
+def subset_cmd(id, bbox, random, cotype, where, exclude):
     """
     Create a subset of a CityJSON file.
     One can select City Objects by
     (1) IDs of City Objects;
     (2) bbox;
     (3) City Object type;
-    (4) randomly.
+    (4) randomly;
+    (5) an expression on their attributes, type ('type') and bbox
+    ('bbox.minx' ... 'bbox.maxz'), combining comparisons (==, !=, <, <=,
+    >, >=, in) with and, or, not, eg:
+
+    \b
+        --where "yearOfConstruction < 1950 and function == 'residential'"
+        --where "type in ('Bridge', 'Tunnel') or bbox.maxz > 30"
 
     These can be combined, except random which overwrites others.
 
     Option '--exclude' excludes the selected objects, or "reverse" the selection.
+
+    With '--stream' only '--id' and '--cotype' can be used.
     """
     def processor(cm):
         print_cmd_status('Subset of CityJSON') 
-        s = copy.deepcopy(cm)
+        if isinstance(cm, cityjson.CityJSONStream):
+            if (random is not None) or (len(bbox) > 0) or (where is not None):
+                raise click.ClickException("Only '--id' and '--cotype' can be used with '--stream'.")
+        #-- the subsets copy only the selected City Objects, cm is not modified
+        s = cm
         if random is not None:
             s = s.get_subset_random(random, exclude=exclude)
             return s
@@ -306,12 +503,20 @@ def subset_cmd(id, bbox, random, cotype, exclude):
             s = s.get_subset_bbox(bbox, exclude=exclude)
         if cotype is not None:
             s = s.get_subset_cotype(cotype, exclude=exclude)
+        if where is not None:
+            try:
+                s = s.get_subset_where(where, exclude=exclude)
+            except ValueError as e:
+                raise click.ClickException('Invalid expression: "%s".\n%s' % (where, e))
         return s 
+    if (random is None) and (len(bbox) == 0) and (where is None):
+        return streamable(processor)
     return processor
 
 
 @cli.command('clean')
-def clean_cmd():
+@click.option('--tolerance', type=click.FloatRange(min=0), help='Weld the vertices closer than this distance.')
+def clean_cmd(tolerance):
     """
     Clean 
     =
@@ -321,22 +526,29 @@ def clean_cmd():
     """
     def processor(cm):
         print_cmd_status('Clean the file')
-        cm.remove_duplicate_vertices()
-        cm.remove_orphan_vertices()
+        cm.remove_duplicate_vertices(tolerance)
+        cm.compact_vertices()
         return cm
     return processor
 
 
 @cli.command('remove_duplicate_vertices')
-def remove_duplicate_vertices_cmd():
+@click.option('--tolerance', type=click.FloatRange(min=0), help='Weld the vertices closer than this distance.')
+def remove_duplicate_vertices_cmd(tolerance):
     """
     Remove duplicate vertices a CityJSON file.
     Only the geometry vertices are processed,
     and not those of the textures/templates.
+
+    With --tolerance, the vertices closer than the distance
+    (in the units of the coordinates) are welded too,
+    the first one is kept:
+
+        $ cjio myfile.json remove_duplicate_vertices --tolerance 0.001 save out.json
     """
     def processor(cm):
         print_cmd_status('Remove duplicate vertices')
-        cm.remove_duplicate_vertices()
+        cm.remove_duplicate_vertices(tolerance)
         return cm
     return processor
 
@@ -368,15 +580,41 @@ def remove_materials_cmd():
 
 
 @cli.command('compress')
-@click.option('--digit', default=3, type=click.IntRange(1, 10), help='Number of digit to keep.')
-def compress_cmd(digit):
+@click.option('--digit', default='3', help='Number of digit to keep (1-10), or "auto" with --max-error.')
+@click.option('--max-error', type=click.FloatRange(min=0), help='Largest quantization error allowed (with a number of digits, it is only checked).')
+def compress_cmd(digit, max_error):
     """
     Compress a CityJSON file, ie stores its vertices with integers.
+
+    The quantization error (max and RMS) is reported. With '--digit auto'
+    the fewest digits keeping the error under '--max-error' are used:
+
+        $ cjio myfile.json compress --digit auto --max-error 0.005 save out.json
+
+    With a number of digits, '--max-error' is a check: the file is not
+    compressed if the error is over it.
     """
+    if digit == 'auto':
+        if max_error is None:
+            raise click.ClickException('--digit auto needs --max-error.')
+        digit = None
+    else:
+        try:
+            digit = int(digit)
+        except ValueError:
+            digit = 0
+        if (digit < 1) or (digit > 10):
+            raise click.ClickException('--digit must be between 1 and 10, or auto.')
     def processor(cm):
-        print_cmd_status('Compressing the CityJSON (with %d digit)' % digit)
+        if digit is None:
+            print_cmd_status('Compressing the CityJSON (error <= %g)' % max_error)
+        else:
+            print_cmd_status('Compressing the CityJSON (with %d digit)' % digit)
         try:
-            cm.compress(digit)
+            error = cm.compress(digit, max_error)
+            if digit is None:
+                click.echo("Digits: %d" % -round(math.log10(cm.j["transform"]["scale"][0])))
+            click.echo("Quantization error: max %g, RMS %g" % error)
         except Exception as e:
             click.echo("WARNING: %s." % e)
         return cm
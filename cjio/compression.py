@@ -0,0 +1,119 @@
+
+import os
+import io
+import sys
+import gzip
+import bz2
+import lzma
+
+import click
+
+MODULE_ZSTANDARD_AVAILABLE = True
+try:
+    import zstandard
+except ImportError as e:
+    MODULE_ZSTANDARD_AVAILABLE = False
+
+
+EXTENSIONS = {'.gz': 'gzip',
+              '.bz2': 'bz2',
+              '.xz': 'xz',
+              '.zst': 'zstd'}
+
+MAGIC = ((b'\x1f\x8b', 'gzip'),
+         (b'BZh', 'bz2'),
+         (b'\xfd7zXZ\x00', 'xz'),
+         (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+
+class TextFile(io.TextIOWrapper):
+    """Text file over a (de)compressing binary stream, keeping the name of
+    the file (the compressed streams do not all have one)."""
+
+    def __init__(self, buffer, name, **kwargs):
+        super().__init__(buffer, **kwargs)
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+
+def splitext(path):
+    """Extension of the file, ignoring the compression one
+
+    :returns: (extension, codec) -- eg ('.json', 'gzip') for 'a.json.gz',
+        and ('.json', None) for 'a.json'
+    """
+    root, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext in EXTENSIONS:
+        return (os.path.splitext(root)[1].lower(), EXTENSIONS[ext])
+    return (ext, None)
+
+
+def detect(path):
+    """Compression of a file to read, from its extension or from its first
+    bytes (for misnamed files)
+
+    :returns: 'gzip', 'bz2', 'xz', 'zstd' or None
+    """
+    codec = splitext(path)[1]
+    if codec is not None:
+        return codec
+    if path == '-':
+        head = sys.stdin.buffer.peek(6)
+    else:
+        with open(path, 'rb') as f:
+            head = f.read(6)
+    for magic, codec in MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def _open_binary(target, codec, mode):
+    #-- target is a path (closed with the stream) or a file object (kept open)
+    if codec == 'gzip':
+        if isinstance(target, str):
+            return gzip.GzipFile(filename=target, mode=mode + 'b')
+        return gzip.GzipFile(fileobj=target, mode=mode + 'b')
+    elif codec == 'bz2':
+        return bz2.BZ2File(target, mode=mode)
+    elif codec == 'xz':
+        return lzma.LZMAFile(target, mode=mode)
+    if MODULE_ZSTANDARD_AVAILABLE == False:
+        raise IOError("zstd files need the Python module 'zstandard' (pip install zstandard)")
+    closefd = isinstance(target, str)
+    if closefd:
+        target = open(target, mode + 'b')
+    if mode == 'r':
+        return zstandard.ZstdDecompressor().stream_reader(target, closefd=closefd)
+    return zstandard.ZstdCompressor().stream_writer(target, closefd=closefd)
+
+
+def open_file(path, mode='r'):
+    """Open a file in text mode, (de)compressing it on the fly if needed
+
+    Reading: the compression is detected with the extension or the first
+    bytes. Writing: it is given by the extension (.gz, .bz2, .xz, .zst).
+    '-' is stdin/stdout.
+
+    :param path: path of the file
+    :param mode: 'r' or 'w'
+    :returns: file object (text mode)
+    :raises: IOError
+    """
+    if mode == 'r':
+        codec = detect(path)
+    else:
+        codec = splitext(path)[1]
+    if codec is None:
+        return click.open_file(path, mode=mode)
+    target = path
+    if path == '-':
+        if mode == 'r':
+            target = sys.stdin.buffer
+        else:
+            target = sys.stdout.buffer
+    return TextFile(_open_binary(target, codec, mode), path, encoding='utf-8')
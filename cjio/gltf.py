@@ -0,0 +1,220 @@
+
+"""Export to binary glTF (.glb).
+
+Each CityObject is a node (its ID and its type are in the "extras" of the
+node) with one mesh: the triangles of all its geometries. The positions are
+float32, in real-world units but translated to the origin of the model (the
+minimum of its vertices, kept in the "extras" of the root node); the root
+node rotates the model from z-up (CityJSON) to y-up (glTF). The indices are
+uint32, local to each mesh.
+
+The templates (geometry-templates) are meshes, and each GeometryInstance is
+a child node of its CityObject with the mesh of its template and its
+transformation matrix (translated to the reference point): the templates
+are not expanded.
+
+All the positions are in one bufferView and all the indices in another one,
+in the only buffer (the BIN chunk).
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from cjio import cityjson
+from cjio import triangulation
+
+
+MAGIC = b'glTF'
+VERSION = 2
+HEADER = struct.Struct('<4sII')
+CHUNK = struct.Struct('<I4s')
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+FLOAT = 5126
+UNSIGNED_INT = 5125
+TRIANGLES = 4
+
+#-- from z-up to y-up: -90 degrees around the x-axis (quaternion x, y, z, w)
+Z_UP_TO_Y_UP = [-0.7071067811865476, 0.0, 0.0, 0.7071067811865476]
+
+
+def meshes(v, triangles, starts):
+    """Split triangles into meshes, each with its own positions
+
+    :param v: (N, 3) array of the positions of the vertices
+    :param triangles: (T, 3) array of the vertex indices of the triangles
+    :param starts: offsets of the triangles of each mesh
+    :returns: (positions, pstarts, indices) -- the (P, 3) float32 array of
+        the positions of all the meshes, the offsets of the positions of
+        each mesh, and the (T, 3) uint32 array of the indices (local to
+        each mesh)
+    """
+    counts = np.diff(starts)
+    owners = np.repeat(np.arange(len(counts), dtype=np.int64), counts * 3)
+    n = max(len(v), 1)
+    #-- the vertices used by each mesh, sorted by mesh
+    keys = owners * n + triangles.ravel()
+    used, inverse = np.unique(keys, return_inverse=True)
+    first = np.searchsorted(used, np.arange(len(counts) + 1, dtype=np.int64) * n)
+    indices = (inverse.ravel() - first[owners]).astype(np.uint32).reshape(-1, 3)
+    positions = v[used % n].astype(np.float32)
+    return (positions, first, indices)
+
+
+class _Builder:
+    #-- the meshes, accessors and the arrays of the BIN chunk
+
+    def __init__(self):
+        self.meshes = []
+        self.accessors = []
+        self.positions = []
+        self.indices = []
+        self.npositions = 0
+        self.nindices = 0
+
+    def add(self, v, triangles, starts):
+        """Add the meshes, returns the index of each one (None if it has no triangles)"""
+        positions, pstarts, indices = meshes(v, triangles, starts)
+        self.positions.append(positions)
+        self.indices.append(indices)
+        re = []
+        some = np.flatnonzero(np.diff(starts) > 0)
+        vmin = np.zeros((len(starts) - 1, 3), dtype=np.float32)
+        vmax = np.zeros((len(starts) - 1, 3), dtype=np.float32)
+        if len(some) > 0:
+            vmin[some] = np.minimum.reduceat(positions, pstarts[some], axis=0)
+            vmax[some] = np.maximum.reduceat(positions, pstarts[some], axis=0)
+        vmin = vmin.tolist()
+        vmax = vmax.tolist()
+        pstarts = pstarts.tolist()
+        starts = starts.tolist()
+        for i in range(len(starts) - 1):
+            if starts[i + 1] == starts[i]:
+                re.append(None)
+                continue
+            self.accessors.append({
+                "bufferView": 0,
+                "byteOffset": (self.npositions + pstarts[i]) * 12,
+                "componentType": FLOAT,
+                "count": pstarts[i + 1] - pstarts[i],
+                "type": "VEC3",
+                "min": vmin[i],
+                "max": vmax[i]
+            })
+            self.accessors.append({
+                "bufferView": 1,
+                "byteOffset": (self.nindices + starts[i]) * 12,
+                "componentType": UNSIGNED_INT,
+                "count": (starts[i + 1] - starts[i]) * 3,
+                "type": "SCALAR"
+            })
+            re.append(len(self.meshes))
+            self.meshes.append({"primitives": [{
+                "attributes": {"POSITION": len(self.accessors) - 2},
+                "indices": len(self.accessors) - 1,
+                "mode": TRIANGLES
+            }]})
+        self.npositions += len(positions)
+        self.nindices += len(indices)
+        return re
+
+
+def write(cm, path, cache=None):
+    """Write the model (CityJSON) to a .glb file, the model is not modified
+
+    :param cm: CityJSON
+    :param path: path of the file
+    :param cache: triangulation.Cache (updated, not saved), or None
+    :raises: IOError
+    """
+    with cityjson.no_gc():
+        _write(cm, path, cache)
+
+
+def _write(cm, path, cache):
+    v = cm.transform_vertices(cm.j["vertices"]).astype(np.float64)
+    if len(v) > 0:
+        origin = v.min(axis=0)
+    else:
+        origin = np.zeros(3)
+    v -= origin
+    builder = _Builder()
+    #-- the geometries of the CityObjects, their instances aside
+    ids = list(cm.j["CityObjects"])
+    geoms = []
+    ngeoms = []
+    instances = []
+    for theid in ids:
+        k = 0
+        for g in cm.j["CityObjects"][theid].get("geometry", []):
+            if g.get("type") == "GeometryInstance":
+                instances.append((len(ngeoms), g))
+            else:
+                geoms.append(g)
+                k += 1
+        ngeoms.append(k)
+    triangles, starts = triangulation.triangulate_geometries(geoms, triangulation.translated(cm.j["vertices"]), cache)
+    gstarts = np.concatenate(([0], np.cumsum(ngeoms))).astype(np.int64)
+    comeshes = builder.add(v, triangles, starts[gstarts])
+    #-- the templates
+    tmeshes = []
+    if (len(instances) > 0) and ("geometry-templates" in cm.j):
+        t = cm.j["geometry-templates"]
+        tv = np.array(t["vertices-templates"], dtype=np.float64).reshape(-1, 3)
+        triangles, starts = triangulation.triangulate_geometries(t["templates"], tv, cache)
+        tmeshes = builder.add(tv, triangles, starts)
+    nodes = [{
+        "name": "CityJSON",
+        "rotation": Z_UP_TO_Y_UP,
+        "children": list(range(1, len(ids) + 1)),
+        "extras": {"origin": origin.tolist()}
+    }]
+    for theid, mesh in zip(ids, comeshes):
+        node = {"name": theid, "extras": {"id": theid, "type": cm.j["CityObjects"][theid].get("type")}}
+        if mesh is not None:
+            node["mesh"] = mesh
+        nodes.append(node)
+    for i, g in instances:
+        mesh = None
+        if isinstance(g.get("template"), int) and (0 <= g["template"] < len(tmeshes)):
+            mesh = tmeshes[g["template"]]
+        if mesh is None:
+            continue
+        m = np.array(g.get("transformationMatrix", np.eye(4).ravel()), dtype=np.float64).reshape(4, 4)
+        m[:3, 3] += v[g["boundaries"][0]]
+        nodes[i + 1].setdefault("children", []).append(len(nodes))
+        nodes.append({"mesh": mesh, "matrix": m.T.ravel().tolist()})
+    j = {
+        "asset": {"version": "2.0", "generator": "cjio"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": nodes
+    }
+    psize = builder.npositions * 12
+    isize = builder.nindices * 12
+    if psize > 0:
+        j["meshes"] = builder.meshes
+        j["accessors"] = builder.accessors
+        j["bufferViews"] = [
+            {"buffer": 0, "byteOffset": 0, "byteLength": psize, "target": ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": psize, "byteLength": isize, "target": ELEMENT_ARRAY_BUFFER}
+        ]
+        j["buffers"] = [{"byteLength": psize + isize}]
+    s = json.dumps(j, separators=(',', ':')).encode('utf-8')
+    s += b' ' * (-len(s) % 4)
+    length = HEADER.size + CHUNK.size + len(s)
+    if psize > 0:
+        length += CHUNK.size + psize + isize
+    with open(path, 'wb') as fo:
+        fo.write(HEADER.pack(MAGIC, VERSION, length))
+        fo.write(CHUNK.pack(len(s), b'JSON'))
+        fo.write(s)
+        if psize > 0:
+            fo.write(CHUNK.pack(psize + isize, b'BIN\x00'))
+            for a in builder.positions:
+                fo.write(np.ascontiguousarray(a, dtype='<f4').tobytes())
+            for a in builder.indices:
+                fo.write(np.ascontiguousarray(a, dtype='<u4').tobytes())
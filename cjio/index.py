@@ -0,0 +1,246 @@
+
+"""Sidecar index of a CityJSON file (FILE.json.idx), for random access.
+
+The index records, for each CityObject, its byte range in the file, its type,
+the range of the indices of its vertices and its hierarchy (children,
+parents); and the byte offset of every BLOCK-th vertex. The CityObjects and
+the vertices of a subset are then read directly, without parsing the rest
+of the file. The index is valid as long as the size and the modification
+time of the file don't change.
+"""
+
+import os
+import io
+import re
+import json
+
+import numpy as np
+
+from cjio import stream
+from cjio import jsonbackend
+from cjio import boundaries
+
+
+VERSION = 1
+EXTENSION = '.idx'
+#-- number of vertices between 2 recorded offsets
+BLOCK = 1024
+
+HIERARCHY = ('toplevel', 'children', 'parents', 'parent', 'members')
+
+#-- str.isascii() needs Python 3.7
+NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+class ByteScanner(stream.Scanner):
+    """Scanner over the bytes of a file: they are decoded as latin-1 (one
+    character per byte) thus tell() gives offsets in bytes. The values with
+    non-ASCII characters are decoded again as UTF-8."""
+
+    def __init__(self, fb, chunk_size=stream.CHUNK_SIZE):
+        super().__init__(io.TextIOWrapper(fb, encoding='latin-1', newline=''), chunk_size)
+
+    def read_value(self):
+        self.peek()
+        start = self.tell()
+        v = super().read_value()
+        raw = self.buf[start - self.offset:self.pos]
+        if NON_ASCII.search(raw) is not None:
+            v = json.loads(raw.encode('latin-1').decode('utf-8'))
+        return v
+
+
+def path_of(path):
+    return path + EXTENSION
+
+
+def stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def vertex_range(co):
+    """(min, max) of the indices of the vertices of a CityObject, (-1, -1) if none"""
+    vs = boundaries.Geometries(co.get("geometry", [])).indices
+    if len(vs) == 0:
+        return [-1, -1]
+    return [int(vs.min()), int(vs.max())]
+
+
+def read_vertex_offsets(sc, block=BLOCK):
+    """Go over the "vertices" array at the current position of the scanner
+
+    :returns: (count, offsets, end) -- the number of vertices, the offset of
+        every block-th vertex and the offset of the end of the array
+    """
+    sc.expect('[')
+    count = 0
+    offsets = []
+    if sc.peek() == ']':
+        sc.pos += 1
+        return (0, offsets, sc.tell())
+    while True:
+        m = stream.RE_END_ARRAY_OF_ARRAYS.search(sc.buf, sc.pos)
+        if m is not None:
+            end = m.start() + 1
+        else:
+            #-- the vertices are separated by commas, the rest will be read again
+            end = sc.buf.rfind(',', sc.pos)
+        if end > sc.pos:
+            a = np.frombuffer(sc.buf[sc.pos:end].encode('latin-1'), dtype=np.uint8)
+            starts = np.flatnonzero(a == ord('['))
+            k = np.arange(count, count + len(starts))
+            offsets.extend((sc.tell() + starts[k % block == 0]).tolist())
+            count += len(starts)
+            sc.pos = end
+        if m is not None:
+            sc.pos = m.end()
+            return (count, offsets, sc.tell() - 1)
+        if sc.fill() == False:
+            raise ValueError("Unexpected end of the file")
+
+
+def build(path, ignore_duplicate_keys=False):
+    """Index a CityJSON file and save the index next to it
+
+    :param path: path of the CityJSON file (not compressed)
+    :returns: the index (dict)
+    :raises: ValueError, IOError
+    """
+    size, mtime = stamp(path)
+    keys = []
+    root = {}
+    ids = []
+    types = []
+    ranges = []
+    vranges = []
+    hierarchy = {}
+    vertices = {"count": 0, "block": BLOCK, "offsets": [], "end": 0}
+    seen = set()
+    with open(path, 'rb') as fb:
+        sc = ByteScanner(fb)
+        for key in sc.members():
+            keys.append(key)
+            if key == "CityObjects":
+                for theid in sc.members():
+                    sc.peek()
+                    start = sc.tell()
+                    co = sc.read_value()
+                    if (theid in seen) and (ignore_duplicate_keys == False):
+                        raise ValueError("Invalid CityJSON file, duplicate key for City Object IDs: %r" % (theid))
+                    seen.add(theid)
+                    ids.append(theid)
+                    types.append(co.get("type"))
+                    ranges.append([start, sc.tell()])
+                    vranges.append(vertex_range(co))
+                    h = {k: co[k] for k in HIERARCHY if k in co}
+                    if len(h) > 0:
+                        hierarchy[theid] = h
+            elif key == "vertices":
+                count, offsets, end = read_vertex_offsets(sc)
+                vertices = {"count": count, "block": BLOCK, "offsets": offsets, "end": end}
+            else:
+                root[key] = sc.read_value()
+    if ("type" not in root) or (root["type"] != "CityJSON"):
+        raise ValueError("Not a CityJSON file")
+    idx = {"version": VERSION,
+           "size": size,
+           "mtime": mtime,
+           "keys": keys,
+           "root": root,
+           "vertices": vertices,
+           "cityobjects": {"ids": ids, "types": types, "ranges": ranges, "vertices": vranges},
+           "hierarchy": hierarchy}
+    with open(path_of(path), 'w') as fo:
+        fo.write(jsonbackend.dumps(idx))
+    return idx
+
+
+def load(path):
+    """The index of a CityJSON file, None if there is none or if it is stale"""
+    try:
+        with open(path_of(path), 'r') as f:
+            idx = jsonbackend.loads(f.read())
+        if (idx["version"] != VERSION) or ([idx["size"], idx["mtime"]] != list(stamp(path))):
+            return None
+        return idx
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def get(path, ignore_duplicate_keys=False):
+    """The index of a CityJSON file, (re)built if missing or stale"""
+    idx = load(path)
+    if idx is None:
+        idx = build(path, ignore_duplicate_keys)
+    return idx
+
+
+def exists(path):
+    return os.path.isfile(path_of(path))
+
+
+class IndexedVertices:
+    """The vertices of an indexed file, read by blocks when they are accessed.
+
+    Behaves like the (N, 3) array of the vertices for len() and indexing
+    with an array of indices, a boolean mask or a slice.
+    """
+
+    def __init__(self, path, vertices):
+        self.path = path
+        self.count = vertices["count"]
+        self.block = vertices["block"]
+        self.offsets = vertices["offsets"]
+        self.end = vertices["end"]
+        self.blocks = {}
+
+    def __len__(self):
+        return self.count
+
+    def load(self, blocks):
+        """Read the blocks of vertices (consecutive ones at once)"""
+        blocks = sorted(set(blocks) - set(self.blocks))
+        if len(blocks) == 0:
+            return
+        with open(self.path, 'rb') as fb:
+            i = 0
+            while i < len(blocks):
+                j = i
+                while (j + 1 < len(blocks)) and (blocks[j + 1] == blocks[j] + 1):
+                    j += 1
+                start = self.offsets[blocks[i]]
+                if blocks[j] + 1 < len(self.offsets):
+                    end = self.offsets[blocks[j] + 1]
+                else:
+                    end = self.end
+                fb.seek(start)
+                s = fb.read(end - start).decode('utf-8').rstrip(' \t\n\r,')
+                v = np.array(json.loads('[' + s + ']'))
+                for b in range(blocks[i], blocks[j] + 1):
+                    k = (b - blocks[i]) * self.block
+                    self.blocks[b] = v[k:k + self.block]
+                i = j + 1
+
+    def load_ranges(self, ranges):
+        """Read the blocks of vertices of ranges of indices [(first, last), ...]"""
+        blocks = set()
+        for first, last in ranges:
+            if first >= 0:
+                blocks.update(range(first // self.block, last // self.block + 1))
+        self.load(blocks)
+
+    def __getitem__(self, ids):
+        if isinstance(ids, slice):
+            ids = np.arange(self.count)[ids]
+        ids = np.asarray(ids)
+        if ids.dtype == bool:
+            ids = np.flatnonzero(ids)
+        ids = ids.astype(np.int64)
+        if len(ids) == 0:
+            return np.zeros((0, 3))
+        b = ids // self.block
+        ub = np.unique(b)
+        self.load(ub.tolist())
+        v = np.concatenate([self.blocks[each] for each in ub.tolist()])
+        return v[np.searchsorted(ub, b) * self.block + ids % self.block]
@@ -0,0 +1,65 @@
+
+import json
+
+#-- the faster JSON modules are used when they are installed
+MODULES = {}
+try:
+    import orjson
+    MODULES['orjson'] = orjson
+except ImportError as e:
+    pass
+try:
+    import ujson
+    MODULES['ujson'] = ujson
+except ImportError as e:
+    pass
+MODULES['json'] = json
+
+#-- in order of preference
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def available():
+    return [b for b in BACKENDS if b in MODULES]
+
+
+def get(name=None):
+    """Name of the JSON backend to use: the fastest one installed if name is None
+
+    :raises: ValueError if the backend is unknown or not installed
+    """
+    if name is None:
+        return available()[0]
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend '%s' (%s)" % (name, ', '.join(BACKENDS)))
+    if name not in MODULES:
+        raise ValueError("JSON backend '%s' is not installed" % name)
+    return name
+
+
+def loads(s, backend=None):
+    backend = get(backend)
+    return MODULES[backend].loads(s)
+
+
+def dumps(obj, indent=0, backend=None):
+    """Serialise to a str; indent=0 gives the most compact output, like
+    json.dumps(obj, separators=(',',':')).
+
+    Unlike for loads(), the json module is used by default: the other backends
+    do not give byte-for-byte the same output (orjson for instance writes
+    non-ASCII characters unescaped, and 1e16 instead of 1e+16).
+    """
+    if backend is None:
+        backend = 'json'
+    backend = get(backend)
+    if backend == 'orjson':
+        if indent == 0:
+            return orjson.dumps(obj).decode('utf-8')
+        elif indent == 2:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+    elif backend == 'ujson':
+        return ujson.dumps(obj, indent=indent, ensure_ascii=True, escape_forward_slashes=False)
+    if indent == 0:
+        return json.dumps(obj, separators=(',',':'))
+    return json.dumps(obj, indent=indent)
@@ -0,0 +1,59 @@
+
+"""Export to binary PLY (little-endian).
+
+The vertices are those of the model (real-world coordinates, as doubles),
+the faces are the triangles of the surfaces of the CityObjects. Each face
+has the index of its CityObject (in the order of the CityObjects of the
+model) and the code of its semantic surface type (255 if none), the types
+are listed in the comments of the header ("comment semantic CODE TYPE").
+"""
+
+import numpy as np
+
+from cjio import cityjson
+from cjio import triangulation
+
+
+NONE = 255
+
+FACE = np.dtype([('n', 'u1'), ('vertices', '<i4', (3,)), ('cityobject', '<i4'), ('semantic', 'u1')])
+
+
+def write(cm, path, cache=None):
+    """Write the model (CityJSON) to a .ply file, the model is not modified
+
+    :param cm: CityJSON
+    :param path: path of the file
+    :param cache: triangulation.Cache (updated, not saved), or None
+    :raises: IOError
+    """
+    with cityjson.no_gc():
+        _write(cm, path, cache)
+
+
+def _write(cm, path, cache):
+    triangles, cityobjects, semantics, types = triangulation.triangulate_cityobjects(cm.j, cache)
+    v = cm.transform_vertices(cm.j["vertices"]).astype('<f8')
+    faces = np.empty(len(triangles), dtype=FACE)
+    faces['n'] = 3
+    faces['vertices'] = triangles
+    faces['cityobject'] = cityobjects
+    faces['semantic'] = np.where((semantics < 0) | (semantics >= NONE), NONE, semantics)
+    header = ["ply", "format binary_little_endian 1.0", "comment cjio"]
+    for code, t in enumerate(types[:NONE]):
+        header.append("comment semantic %d %s" % (code, t))
+    header += [
+        "element vertex %d" % len(v),
+        "property double x",
+        "property double y",
+        "property double z",
+        "element face %d" % len(faces),
+        "property list uchar int vertex_indices",
+        "property int cityobject",
+        "property uchar semantic",
+        "end_header"
+    ]
+    with open(path, 'wb') as fo:
+        fo.write(('\n'.join(header) + '\n').encode('utf-8'))
+        v.tofile(fo)
+        faces.tofile(fo)
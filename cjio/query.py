@@ -0,0 +1,312 @@
+
+"""Queries on the attributes, the type and the bbox of the CityObjects.
+
+An expression is a combination, with "and", "or", "not" and parentheses, of
+comparisons:
+
+    yearOfConstruction < 1950 and function == 'residential'
+    type in ('Building', 'Bridge') and not roofType == null
+    bbox.maxz > 30 or `roof type` in ('gable', 'hip')
+
+The left side of a comparison is "type", "bbox.minx" (miny, minz, maxx,
+maxy, maxz; the bbox of the CityObject), or the name of an attribute
+("attributes.name" if it is one of these, `name` with backquotes if it is
+not an identifier). The right side is a number, a 'string' (or "string"),
+true, false or null, or a list of them with "in". The operators are ==
+(or =), !=, <, <=, > and >=; a string is compared to the strings and a
+number to the numbers only. A CityObject without the attribute (or with
+null) matches only "== null".
+
+An expression is compiled once into a function giving a boolean array (one
+value per CityObject), each comparison is answered by the AttributeIndex:
+the values of each attribute queried are sorted once (numbers and strings
+apart), a comparison is a binary search.
+"""
+
+import ast
+import re
+
+import numpy as np
+
+
+KEYWORDS = ('and', 'or', 'not', 'in', 'true', 'false', 'null')
+OPERATORS = ('==', '!=', '<', '<=', '>', '>=')
+BBOX = ('minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz')
+
+TOKEN = re.compile(r'''\s*(?:
+    (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<op>==|!=|<=|>=|<|>|=|\(|\)|,)
+    |(?P<name>`[^`]*`|[A-Za-z_][\w.:\-]*)
+    )''', re.VERBOSE)
+
+#-- the value of a CityObject without the attribute
+_MISSING = object()
+
+
+def tokenize(expr):
+    """The tokens (kind, value) of the expression
+
+    :raises: ValueError
+    """
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = TOKEN.match(expr, pos)
+        if (m is None) or (m.end() == pos):
+            raise ValueError("Invalid expression at %r" % expr[pos:pos + 20].strip())
+        kind = m.lastgroup
+        s = m.group(kind)
+        if kind == 'number':
+            value = float(s) if any(c in s for c in '.eE') else int(s)
+        elif kind == 'string':
+            value = ast.literal_eval(s)
+        elif kind == 'op':
+            value = '==' if s == '=' else s
+        elif s.startswith('`'):
+            value = s[1:-1]
+        elif s.lower() in KEYWORDS:
+            kind = 'keyword'
+            value = s.lower()
+        else:
+            value = s
+        tokens.append((kind, value))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    #-- recursive descent, the nodes are tuples
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of the expression")
+        self.pos += 1
+        return token
+
+    def expect(self, kind, value):
+        token = self.next()
+        if token != (kind, value):
+            raise ValueError("Expected %r instead of %r" % (value, token[1]))
+
+    def parse(self):
+        node = self.disjunction()
+        if self.peek()[0] is not None:
+            raise ValueError("Unexpected %r" % (self.peek()[1],))
+        return node
+
+    def disjunction(self):
+        node = self.conjunction()
+        while self.peek() == ('keyword', 'or'):
+            self.next()
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == ('keyword', 'and'):
+            self.next()
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == ('keyword', 'not'):
+            self.next()
+            return ('not', self.negation())
+        if self.peek() == ('op', '('):
+            self.next()
+            node = self.disjunction()
+            self.expect('op', ')')
+            return node
+        return self.comparison()
+
+    def comparison(self):
+        kind, name = self.next()
+        if kind != 'name':
+            raise ValueError("Expected a name instead of %r" % (name,))
+        field = field_of(name)
+        kind, op = self.next()
+        if (kind, op) == ('keyword', 'in'):
+            self.expect('op', '(')
+            values = [self.value()]
+            while self.peek() == ('op', ','):
+                self.next()
+                values.append(self.value())
+            self.expect('op', ')')
+            return ('in', field, values)
+        if (kind != 'op') or (op not in OPERATORS):
+            raise ValueError("Expected an operator instead of %r" % (op,))
+        return ('compare', field, op, self.value())
+
+    def value(self):
+        kind, value = self.next()
+        if kind in ('number', 'string'):
+            return value
+        if kind == 'keyword' and value in ('true', 'false', 'null'):
+            return {'true': True, 'false': False, 'null': None}[value]
+        raise ValueError("Expected a value instead of %r" % (value,))
+
+
+def field_of(name):
+    """The field of a name: ('type',), ('bbox', k) or ('attribute', name)"""
+    if name == 'type':
+        return ('type',)
+    if name.startswith('bbox.') and (name[5:] in BBOX):
+        return ('bbox', BBOX.index(name[5:]))
+    if name.startswith('attributes.'):
+        return ('attribute', name[11:])
+    return ('attribute', name)
+
+
+def predicate(expr):
+    """Compile the expression into a function of a CityJSON returning the
+    boolean array of the CityObjects matching it (in their order)
+
+    :raises: ValueError if the expression is invalid
+    """
+    return _compile(_Parser(tokenize(expr)).parse())
+
+
+def _compile(node):
+    if node[0] == 'and':
+        a = _compile(node[1])
+        b = _compile(node[2])
+        return lambda cm: a(cm) & b(cm)
+    if node[0] == 'or':
+        a = _compile(node[1])
+        b = _compile(node[2])
+        return lambda cm: a(cm) | b(cm)
+    if node[0] == 'not':
+        a = _compile(node[1])
+        return lambda cm: ~a(cm)
+    if node[0] == 'in':
+        tests = [_compile(('compare', node[1], '==', v)) for v in node[2]]
+        def f(cm):
+            mask = tests[0](cm)
+            for test in tests[1:]:
+                mask = mask | test(cm)
+            return mask
+        return f
+    field, op, value = node[1:]
+    if isinstance(value, bool) and (op not in ('==', '!=')):
+        raise ValueError("true and false can only be compared with == and !=")
+    if (value is None) and (op not in ('==', '!=')):
+        raise ValueError("null can only be compared with == and !=")
+    if field[0] == 'bbox':
+        if isinstance(value, str) or isinstance(value, bool):
+            raise ValueError("bbox.%s is compared to numbers only" % BBOX[field[1]])
+        return lambda cm: _compare_numbers(cm.spatial_index()[1][:, field[1]], op, value)
+    return lambda cm: cm.attribute_index().column(field).compare(op, value)
+
+
+def _compare_numbers(a, op, value):
+    #-- NaN is null
+    null = np.isnan(a)
+    if value is None:
+        return null if op == '==' else ~null
+    with np.errstate(invalid='ignore'):
+        if op == '!=':
+            return ~null & (a != value)
+        return {'==': np.equal, '<': np.less, '<=': np.less_equal,
+                '>': np.greater, '>=': np.greater_equal}[op](a, value)
+
+
+class Column:
+    """The values of one field of the CityObjects, sorted
+
+    The numbers and the strings are in two sorted arrays (with the position
+    of their CityObject), the booleans and the nulls in masks.
+    """
+
+    def __init__(self, values):
+        n = len(values)
+        self.present = np.ones(n, dtype=bool)
+        self.null = np.zeros(n, dtype=bool)
+        self.true = np.zeros(n, dtype=bool)
+        self.false = np.zeros(n, dtype=bool)
+        numbers = []
+        nrows = []
+        strings = []
+        srows = []
+        for i, v in enumerate(values):
+            if v is _MISSING:
+                self.present[i] = False
+            elif v is None:
+                self.null[i] = True
+            elif v is True:
+                self.true[i] = True
+            elif v is False:
+                self.false[i] = True
+            elif isinstance(v, (int, float)):
+                numbers.append(v)
+                nrows.append(i)
+            elif isinstance(v, str):
+                strings.append(v)
+                srows.append(i)
+        self.numbers, self.nrows = self._sorted(np.array(numbers, dtype=np.float64), nrows)
+        self.strings, self.srows = self._sorted(np.array(strings, dtype=str), srows)
+
+    def _sorted(self, keys, rows):
+        order = np.argsort(keys, kind='stable')
+        return (keys[order], np.array(rows, dtype=np.int64)[order])
+
+    def __len__(self):
+        return len(self.present)
+
+    def compare(self, op, value):
+        """The boolean array of the values compared to value"""
+        valid = self.present & ~self.null
+        if value is None:
+            return ~valid if op == '==' else valid
+        if isinstance(value, bool):
+            re = self.true.copy() if value else self.false.copy()
+        else:
+            if isinstance(value, str):
+                keys, rows = self.strings, self.srows
+            else:
+                keys, rows = self.numbers, self.nrows
+            bounds = {
+                '==': (keys.searchsorted(value, 'left'), keys.searchsorted(value, 'right')),
+                '!=': (keys.searchsorted(value, 'left'), keys.searchsorted(value, 'right')),
+                '<': (0, keys.searchsorted(value, 'left')),
+                '<=': (0, keys.searchsorted(value, 'right')),
+                '>': (keys.searchsorted(value, 'right'), len(keys)),
+                '>=': (keys.searchsorted(value, 'left'), len(keys))
+            }
+            re = np.zeros(len(self), dtype=bool)
+            re[rows[bounds[op][0]:bounds[op][1]]] = True
+        if op == '!=':
+            return valid & ~re
+        return re
+
+
+class AttributeIndex:
+    """The columns of the CityObjects, each one built at its first query
+    and kept"""
+
+    def __init__(self, cityobjects):
+        self.cityobjects = cityobjects
+        self.ids = list(cityobjects)
+        self.columns = {}
+
+    def column(self, field):
+        """The Column of a field, ('type',) or ('attribute', name)"""
+        if field not in self.columns:
+            cos = self.cityobjects.values()
+            if field == ('type',):
+                values = [co.get("type", _MISSING) for co in cos]
+            else:
+                values = [co.get("attributes", {}).get(field[1], _MISSING) for co in cos]
+            self.columns[field] = Column(values)
+        return self.columns[field]
@@ -0,0 +1,136 @@
+
+"""Spatial index (2D) over boxes, a packed R-tree.
+
+The boxes are sorted with the Sort-Tile-Recursive algorithm (slices along x,
+then sorted along y in each slice) and grouped by CAPACITY consecutive
+boxes in the leaves, the leaves by CAPACITY in their parents, and so on. The
+tree is a list of levels, each one a (n, 4) array of boxes; the children of
+the node i are the nodes [i * CAPACITY, (i+1) * CAPACITY) of the level below.
+A query goes down level by level, with one NumPy operation per level.
+"""
+
+import math
+
+import numpy as np
+
+
+#-- number of children of each node
+CAPACITY = 16
+
+
+def intersects(boxes, window):
+    """True for the boxes (n, 4) intersecting the window (minx, miny,
+    maxx, maxy), touching counts"""
+    return ((boxes[:, 0] <= window[2]) &
+            (boxes[:, 1] <= window[3]) &
+            (boxes[:, 2] >= window[0]) &
+            (boxes[:, 3] >= window[1]))
+
+
+class RTree:
+    """Packed R-tree over 2D boxes; the boxes with NaN are not indexed"""
+
+    def __init__(self, boxes, capacity=CAPACITY):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.capacity = capacity
+        valid = np.flatnonzero(~np.isnan(boxes).any(axis=1))
+        self.order = valid[self._str_order(boxes[valid])]
+        self.levels = [boxes[self.order]]
+        while len(self.levels[-1]) > 1:
+            b = self.levels[-1]
+            starts = np.arange(0, len(b), capacity)
+            self.levels.append(np.column_stack((
+                np.minimum.reduceat(b[:, 0], starts),
+                np.minimum.reduceat(b[:, 1], starts),
+                np.maximum.reduceat(b[:, 2], starts),
+                np.maximum.reduceat(b[:, 3], starts))))
+
+    def _str_order(self, boxes):
+        n = len(boxes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        leaves = math.ceil(n / self.capacity)
+        size = math.ceil(math.sqrt(leaves)) * self.capacity
+        byx = np.argsort(cx, kind='stable')
+        slices = np.arange(n) // size
+        #-- by slice (along x), then by y
+        return byx[np.lexsort((cy[byx], slices))]
+
+    def __len__(self):
+        return len(self.order)
+
+    def query(self, window):
+        """The indices (in the boxes given) of the boxes intersecting the
+        window (minx, miny, maxx, maxy), sorted"""
+        if len(self.order) == 0:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.arange(len(self.levels[-1]), dtype=np.int64)
+        for k in range(len(self.levels) - 1, -1, -1):
+            candidates = candidates[intersects(self.levels[k][candidates], window)]
+            if k > 0:
+                candidates = (candidates[:, np.newaxis] * self.capacity + np.arange(self.capacity)).ravel()
+                candidates = candidates[candidates < len(self.levels[k - 1])]
+        return np.sort(self.order[candidates])
+
+
+#-- maximum depth of the quadtree (the points at the same place cannot be split)
+MAX_DEPTH = 16
+
+
+def quadtree(points, bounds, capacity, max_depth=MAX_DEPTH):
+    """Split the bounds in 4 quadrants, recursively, until each one has at
+    most capacity points (or max_depth is reached)
+
+    The key of a quadrant is the key of its parent followed by its digit
+    (0: SW, 1: SE, 2: NW, 3: NE), the key of the root is "0".
+
+    :param points: (n, 2) array
+    :param bounds: (minx, miny, maxx, maxy) containing the points
+    :returns: the non-empty leaves, list of (key, bounds, indices) sorted
+        by key
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    leaves = []
+    stack = [("0", tuple(bounds), np.arange(len(points)))]
+    while len(stack) > 0:
+        key, b, indices = stack.pop()
+        if (len(indices) <= capacity) or (len(key) > max_depth):
+            if len(indices) > 0:
+                leaves.append((key, b, indices))
+            continue
+        mx = (b[0] + b[2]) / 2
+        my = (b[1] + b[3]) / 2
+        p = points[indices]
+        digits = (p[:, 0] >= mx).astype(np.int64) + 2 * (p[:, 1] >= my)
+        children = [(b[0], b[1], mx, my), (mx, b[1], b[2], my),
+                    (b[0], my, mx, b[3]), (mx, my, b[2], b[3])]
+        for d in (3, 2, 1, 0):
+            stack.append((key + str(d), children[d], indices[digits == d]))
+    leaves.sort(key=lambda leaf: leaf[0])
+    return leaves
+
+
+def grid(points, bounds, size):
+    """Split the bounds in square cells of size, from (minx, miny)
+
+    The key of a cell is "column_row".
+
+    :param points: (n, 2) array
+    :param bounds: (minx, miny, maxx, maxy) containing the points
+    :returns: the non-empty cells, list of (key, bounds, indices) sorted
+        by row then column
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    cells = np.floor((points - np.array(bounds[:2])) / size).astype(np.int64)
+    order = np.lexsort((cells[:, 0], cells[:, 1]))
+    cells = cells[order]
+    starts = np.flatnonzero(np.concatenate(([True], (cells[1:] != cells[:-1]).any(axis=1), [True])))
+    re = []
+    for b, e in zip(starts[:-1].tolist(), starts[1:].tolist()):
+        i, j = cells[b].tolist()
+        minx = bounds[0] + i * size
+        miny = bounds[1] + j * size
+        re.append(("%d_%d" % (i, j), (minx, miny, minx + size, miny + size), order[b:e]))
+    return re
@@ -0,0 +1,50 @@
+
+"""Export to binary STL.
+
+The triangles of the surfaces of the CityObjects, with their normals. The
+coordinates are float32, thus they are translated to the origin of the model
+(the minimum of its vertices), written in the 80-byte header.
+"""
+
+import struct
+
+import numpy as np
+
+from cjio import cityjson
+from cjio import triangulation
+
+
+TRIANGLE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+
+def write(cm, path, cache=None):
+    """Write the model (CityJSON) to a .stl file, the model is not modified
+
+    :param cm: CityJSON
+    :param path: path of the file
+    :param cache: triangulation.Cache (updated, not saved), or None
+    :raises: IOError
+    """
+    with cityjson.no_gc():
+        _write(cm, path, cache)
+
+
+def _write(cm, path, cache):
+    triangles, cityobjects, semantics, types = triangulation.triangulate_cityobjects(cm.j, cache)
+    v = cm.transform_vertices(cm.j["vertices"]).astype(np.float64)
+    if len(v) > 0:
+        origin = v.min(axis=0)
+    else:
+        origin = np.zeros(3)
+    p = (v - origin)[triangles]
+    n = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    norm = np.sqrt((n * n).sum(axis=1))
+    n[norm > 0] /= norm[norm > 0][:, np.newaxis]
+    records = np.zeros(len(triangles), dtype=TRIANGLE)
+    records['normal'] = n
+    records['vertices'] = p
+    header = ("cjio, origin %r %r %r" % tuple(origin.tolist())).encode('utf-8')[:80]
+    with open(path, 'wb') as fo:
+        fo.write(header.ljust(80, b' '))
+        fo.write(struct.pack('<I', len(records)))
+        records.tofile(fo)
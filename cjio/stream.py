@@ -0,0 +1,332 @@
+
+import json
+import re
+
+import numpy as np
+
+from cjio import jsonbackend
+
+
+#-- number of characters read from the file at once
+CHUNK_SIZE = 1 << 16
+
+RE_WS = re.compile(r'[ \t\n\r]*')
+RE_END_ARRAY_OF_ARRAYS = re.compile(r'\][ \t\n\r]*\]')
+
+#-- change of depth of each ASCII character
+STEPS = np.zeros(128, dtype=np.int8)
+STEPS[[ord('['), ord('{')]] = 1
+STEPS[[ord(']'), ord('}')]] = -1
+
+
+class Scanner:
+    """Incremental reader of a JSON document.
+
+    Only the part of the file that is currently processed is kept in memory,
+    the values are decoded one at a time with the json module (thus in C).
+    """
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        #-- number of characters consumed before self.buf[0]
+        self.offset = 0
+        self.decoder = json.JSONDecoder()
+
+    @classmethod
+    def from_string(cls, s):
+        """Scanner over a JSON document already in memory (no copy is made)."""
+        sc = cls(None)
+        sc.buf = s
+        sc.eof = True
+        return sc
+
+    def tell(self):
+        """Offset (in characters) of the current position in the file."""
+        return self.offset + self.pos
+
+    def fill(self, size=None):
+        if self.eof:
+            return False
+        if size is None:
+            size = self.chunk_size
+        data = self.file.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def skip(self, n):
+        """Skip the next n characters."""
+        while n > 0:
+            left = len(self.buf) - self.pos
+            if left >= n:
+                self.pos += n
+                return
+            n -= left
+            self.pos = len(self.buf)
+            if self.fill() == False:
+                raise ValueError("Unexpected end of the file")
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ('' at the end)."""
+        while True:
+            self.pos = RE_WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.fill() == False:
+                return ''
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError("Invalid JSON file, expected '%s' at character %d" % (c, self.tell()))
+        self.pos += 1
+
+    def read_value(self):
+        """Decode the next JSON value, reading more of the file when needed."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                #-- a number could be cut by the end of the buffer
+                if (end < len(self.buf)) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise ValueError("Invalid JSON file, error at character %d" % (self.tell()))
+            self.fill(max(self.chunk_size, len(self.buf)))
+
+    def members(self):
+        """Generator over the keys of the JSON object starting at the current
+        position. The caller must consume the value of each key before asking
+        for the next one."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            c = self.peek()
+            self.pos += 1
+            if c == '}':
+                return
+            if c != ',':
+                raise ValueError("Invalid JSON file, expected ',' or '}' at character %d" % (self.tell() - 1))
+
+    def skip_members(self):
+        """Go over the JSON object starting at the current position without
+        decoding its values, only the keys are decoded.
+
+        The text is processed in blocks with NumPy: the quotes that are not
+        escaped delimit the strings, the brackets outside of the strings give
+        the depth, and only the characters at the depth of the members (the
+        quotes of the keys, the colons and the commas) are looked at.
+
+        :returns: list of (key, start, end) -- the offsets of each value
+        """
+        self.expect('{')
+        members = []
+        size = self.chunk_size
+        #-- state at the end of the processed text
+        depth = 1
+        instring = False
+        backslashes = 0
+        key = None
+        start = None
+        while True:
+            if self.pos == len(self.buf):
+                if self.fill() == False:
+                    raise ValueError("Unexpected end of the file")
+            end = min(len(self.buf), self.pos + size)
+            text = self.buf[self.pos:end]
+            c = np.frombuffer(text.encode('utf-8', 'surrogatepass'), dtype=np.uint8)
+            if len(c) != len(text):
+                #-- one item per character
+                c = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+            if (backslashes > 0) or ('\\' in text):
+                #-- number of backslashes just before each character
+                i = np.arange(len(c))
+                nonbs = np.maximum.accumulate(np.where(c == 92, -1, i))
+                last = np.concatenate(([-1], nonbs[:-1]))
+                before = i - 1 - last + np.where(last == -1, backslashes, 0)
+                quote = (c == 34) & (before % 2 == 0)
+                if nonbs[-1] == -1:
+                    backslashes += len(c)
+                else:
+                    backslashes = int(len(c) - 1 - nonbs[-1])
+            else:
+                quote = c == 34
+                backslashes = 0
+            inside = np.logical_xor.accumulate(quote) ^ instring
+            step = np.where(inside, 0, STEPS[np.minimum(c, 127)])
+            d = np.cumsum(step, dtype=np.int32) + depth
+            events = np.flatnonzero((d == 1) & (quote | (~inside & ((c == 58) | (c == 44)))) | ((d == 0) & (step == -1)))
+            base = self.offset + self.pos
+            done = None
+            for k in events.tolist():
+                ch = int(c[k])
+                if ch == 34:
+                    if start is not None:
+                        #-- a string value
+                        continue
+                    if key is None:
+                        key = k
+                    else:
+                        raw = self.buf[self.pos + key:self.pos + k + 1]
+                        key = json.loads(raw) if '\\' in raw else raw[1:-1]
+                elif ch == 58:
+                    start = base + k + 1
+                else:
+                    if key is not None:
+                        members.append((key, start, base + k))
+                    key = None
+                    start = None
+                    if ch == 125:
+                        done = k
+                        break
+            if done is not None:
+                self.pos += done + 1
+                return members
+            if isinstance(key, int):
+                #-- a key cut by the end of the block is read again
+                self.pos += key
+                depth = 1
+                instring = False
+                backslashes = 0
+                if key > 0:
+                    size = self.chunk_size
+                elif end < len(self.buf):
+                    size *= 2
+                elif self.fill() == False:
+                    raise ValueError("Unexpected end of the file")
+                key = None
+            else:
+                depth = int(d[-1])
+                instring = bool(inside[-1])
+                self.pos = end
+                size = self.chunk_size
+
+    def array_chunks(self):
+        """Generator over an array of arrays of numbers (eg the "vertices"),
+        yields the items in lists of up to ~chunk_size characters."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            m = RE_END_ARRAY_OF_ARRAYS.search(self.buf, self.pos)
+            if m is not None:
+                chunk = self.buf[self.pos:m.start() + 1]
+                self.pos = m.end()
+                yield json.loads('[' + chunk + ']')
+                return
+            k = self.buf.rfind(']', self.pos)
+            if k != -1:
+                i = RE_WS.match(self.buf, k + 1).end()
+                if (i < len(self.buf)) and (self.buf[i] == ','):
+                    chunk = self.buf[self.pos:k + 1]
+                    self.pos = i + 1
+                    yield json.loads('[' + chunk + ']')
+                    continue
+            if self.fill() == False:
+                raise ValueError("Unexpected end of the file")
+
+
+def read_vertices(scanner):
+    """Read the "vertices" array at the current position of the scanner into
+    a (N, 3) NumPy array, one chunk at a time."""
+    chunks = [np.array(c) for c in scanner.array_chunks()]
+    if len(chunks) == 0:
+        return np.zeros((0, 3))
+    return np.concatenate(chunks)
+
+
+class StreamedObject:
+    """A JSON object whose members are produced by an iterable of
+    (key, value) pairs, written with write_json() without being built."""
+
+    def __init__(self, members):
+        self.members = members
+
+
+class StreamedArray:
+    """A JSON array whose items are produced by an iterable of chunks (lists
+    or NumPy arrays of items), written with write_json()."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+
+def chunks(a, n):
+    """Split a list (or an array) in consecutive pieces of n items."""
+    for i in range(0, len(a), n):
+        yield a[i:i + n]
+
+
+def _dumps(value, indent, level, backend):
+    if not indent:
+        return jsonbackend.dumps(value, 0, backend)
+    s = json.dumps(value, indent=indent)
+    if level > 0:
+        s = s.replace('\n', '\n' + ' ' * (indent * level))
+    return s
+
+
+def write_json(fo, value, indent=None, level=0, backend=None):
+    """Write a JSON value to the file object fo, exactly like json.dumps()
+    would, but streaming the StreamedObject and StreamedArray values it
+    contains. indent=0 (or None) gives the compact separators (',',':').
+
+    The compact output can be encoded with another backend (see jsonbackend).
+    """
+    if isinstance(value, StreamedObject):
+        opening, closing = '{', '}'
+        chunks = ({k: v} for (k, v) in value.members)
+    elif isinstance(value, StreamedArray):
+        opening, closing = '[', ']'
+        chunks = value.chunks
+    else:
+        fo.write(_dumps(value, indent, level, backend))
+        return
+    if indent:
+        nl = '\n' + ' ' * (indent * (level + 1))
+        sep = ',' + nl
+    else:
+        nl = ''
+        sep = ','
+    fo.write(opening)
+    first = True
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            for k, v in chunk.items():
+                fo.write(nl if first else sep)
+                first = False
+                fo.write(json.dumps(k))
+                fo.write(': ' if indent else ':')
+                write_json(fo, v, indent, level + 1, backend)
+        else:
+            if isinstance(chunk, np.ndarray):
+                chunk = chunk.tolist()
+            if len(chunk) == 0:
+                continue
+            s = _dumps(chunk, indent, level, backend)
+            #-- remove the brackets of the chunk (and the newlines around)
+            if indent:
+                s = s[len(nl) + 1:-(indent * level + 2)]
+            else:
+                s = s[1:-1]
+            fo.write(nl if first else sep)
+            first = False
+            fo.write(s)
+    if not first and indent:
+        fo.write('\n' + ' ' * (indent * level))
+    fo.write(closing)
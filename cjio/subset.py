@@ -1,50 +1,134 @@
 
 import json
 
+from cjio import boundaries
+
 def select_co_bbox(j, bbox):
     #-- select the CO whose
     pass
 
-def select_co_ids(j, IDs):
-    IDs = list(IDs)
+def get_cotypes(cotype):
+    #-- the "sub" types of a CityObject type are selected with it
+    lsCOtypes = [cotype]
+    if cotype == 'Building':
+        lsCOtypes.append('BuildingInstallation')
+        lsCOtypes.append('BuildingPart')
+    if cotype == 'Bridge':
+        lsCOtypes.append('BridgePart')
+        lsCOtypes.append('BridgeInstallation')
+        lsCOtypes.append('BridgeConstructionElement')
+    if cotype == 'Tunnel':
+        lsCOtypes.append('TunnelInstallation')
+        lsCOtypes.append('TunnelPart')
+    return lsCOtypes
+
+
+def select_co_cotype(j, cotype):
+    lsCOtypes = get_cotypes(cotype)
     re = set()
     for theid in j["CityObjects"]:
-        if theid in IDs:
+        if j["CityObjects"][theid]["type"] in lsCOtypes:
             re.add(theid)
+    return re
+
+
+class Hierarchy:
+    """Adjacency index of the CityObjects: children, parents and members of
+    the groups (the references to missing CityObjects are ignored)
+
+    The parents are read from "parents" (and "parent") and from the
+    "children" of the other CityObjects, and conversely.
+    """
+
+    def __init__(self, cityobjects):
+        self.children = {}
+        self.parents = {}
+        self.members = {}
+        for theid, co in cityobjects.items():
+            parents = co.get("parents", co.get("parent"))
+            if isinstance(parents, str):
+                parents = [parents]
+            for each in parents or []:
+                if each in cityobjects:
+                    self._link(each, theid)
+            for each in co.get("children", []):
+                if each in cityobjects:
+                    self._link(theid, each)
+            if co.get("type") == "CityObjectGroup":
+                members = [each for each in co.get("members", []) if isinstance(each, str) and each in cityobjects]
+                if len(members) > 0:
+                    self.members[theid] = members
+
+    def _link(self, parent, child):
+        children = self.children.setdefault(parent, [])
+        if child not in children:
+            children.append(child)
+            self.parents.setdefault(child, []).append(parent)
+
+    def closure(self, ids):
+        """The CityObjects ids, the members of the groups among them, and
+        all the CityObjects of their hierarchies (their ancestors and all
+        the descendants of these)
+
+        :param ids: IDs of existing CityObjects
+        :returns: set of IDs
+        """
+        re = set()
+        stack = list(ids)
+        while len(stack) > 0:
+            each = stack.pop()
+            if each not in re:
+                re.add(each)
+                stack.extend(self.members.get(each, ()))
+        for links in (self.parents, self.children):
+            stack = list(re)
+            while len(stack) > 0:
+                for each in links.get(stack.pop(), ()):
+                    if each not in re:
+                        re.add(each)
+                        stack.append(each)
+        return re
+
+    def roots(self):
+        """The top-level ancestor of each CityObject of a hierarchy (the
+        first parent is followed), a top-level one is its own"""
+        roots = {}
+        for theid in self.parents:
+            path = []
+            each = theid
+            while (each not in roots) and (each not in path):
+                path.append(each)
+                if each not in self.parents:
+                    break
+                each = self.parents[each][0]
+            root = roots.get(each, each)
+            for each in path:
+                roots[each] = root
+        return roots
+
+
+def select_co_ids(j, IDs, hierarchy=None):
+    """The CityObjects IDs with their hierarchies (see Hierarchy.closure()),
+    the missing ones are ignored with a warning
+
+    :param hierarchy: Hierarchy of j["CityObjects"], built if None
+    """
+    if hierarchy is None:
+        hierarchy = Hierarchy(j["CityObjects"])
+    found = []
     for theid in IDs:
-        if theid not in j["CityObjects"]:
-            IDs.remove(theid)
+        if theid in j["CityObjects"]:
+            found.append(theid)
+        else:
             print ("WARNING: ID", theid, "not found in input file; ignored.")
-    #-- deal with CityObjectGroup
-    for each in j["CityObjects"]:
-        if each in IDs:
-            if j["CityObjects"][each]["type"] == "CityObjectGroup" and "members" in j["CityObjects"][each]:
-                for member in j["CityObjects"][each]["members"]:
-                    re.add(member)
-    #-- also add the children
-    for id in j["CityObjects"]:
-        if id in IDs:
-            if "children" in j['CityObjects'][id]:
-                for child in j['CityObjects'][id]['children']:
-                    re.add(child)
-            if "parent" in j['CityObjects'][id]:
-                re.add(j['CityObjects'][id]['parent']) 
-                #-- add siblings
-                if "children" in j['CityObjects'][id]['parent']:
-                    for child in j['CityObjects'][id]['parent']:
-                        re.add(child)
-    return re                
-
+    return hierarchy.closure(found)
 
 
 def process_geometry(j, j2):
-    #-- update vertex indices
-    oldnewids = {}
-    newvertices = []    
-    for each in j2["CityObjects"]:
-        for geom in j2['CityObjects'][each]['geometry']:
-            update_array_indices(geom["boundaries"], oldnewids, j["vertices"], newvertices, -1)
-    j2["vertices"] = newvertices
+    #-- update vertex indices (only the used vertices are kept, in their order)
+    newvertices = boundaries.Geometries.of_cityobjects(j2).compact(len(j["vertices"]))
+    #-- the vertices are taken at once from the (N, 3) array
+    j2["vertices"] = j["vertices"][newvertices]
 
 
 def process_templates(j, j2):
@@ -127,3 +211,14 @@ def update_array_indices(a, dOldNewIDs, oldarray, newarray, slicearray):
                     a[i] = len(newarray)
                     dOldNewIDs[each] = len(newarray)
                     newarray.append(oldarray[each])      
+
+
+def offset_array_indices(a, offset, slicearray=-1):
+    #-- add offset to all the (not null) indices of a
+    #-- slicearray: -1=none ; 0=use-only-first (for textures) ; 1=use-1+ (for textures)
+    for i, each in enumerate(a):
+        if isinstance(each, list):
+            offset_array_indices(each, offset, slicearray)
+        elif each is not None:
+            if ( (slicearray == -1) or (slicearray == 0 and i == 0) or (slicearray == 1 and i > 0) ):
+                a[i] = each + offset
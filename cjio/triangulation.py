@@ -0,0 +1,468 @@
+
+"""Triangulation of the surfaces of the geometries, in batch.
+
+The surfaces (of all the geometries of a model) are given as flat arrays,
+like the flattened boundaries (see boundaries.py): the offsets of the rings
+of each surface, the offsets of the indices of each ring, and the indices.
+The normals (Newell's method) and the projections of the points to the
+plane of their surface are computed for all the surfaces at once; only the
+triangulation itself (earcut) is done surface by surface.
+
+The triangulations can be kept in a Cache (a sidecar file, FILE.json.tri),
+by geometry: the key is a hash of the offsets of its surfaces and rings and
+of the coordinates of its points, the triangles are stored as positions in
+the points of the geometry (thus they don't depend on the numbering of the
+vertices).
+"""
+
+import os
+import hashlib
+import zipfile
+
+import numpy as np
+
+MODULE_EARCUT_AVAILABLE = True
+try:
+    import mapbox_earcut
+except ImportError as e:
+    MODULE_EARCUT_AVAILABLE = False
+
+from cjio import boundaries
+
+
+#-- the geometries whose surfaces are triangulated, and the level of the offsets of their surfaces
+SURFACE_LEVELS = {
+    'MultiSurface': 0,
+    'CompositeSurface': 0,
+    'Solid': 1
+}
+
+
+def surfaces_of(geometries):
+    """The surfaces of the geometries as flat arrays, the geometries other
+    than MultiSurface, CompositeSurface and Solid (and the irregular ones)
+    have no surfaces
+
+    :param geometries: list of geometries
+    :returns: (geoms, surfaces, rings, indices) -- the offsets of the
+        surfaces of each geometry, of the rings of each surface, of the
+        indices of each ring (int64 arrays), and the indices
+    """
+    geoms = [0]
+    surfaces = [np.zeros(1, dtype=np.int64)]
+    rings = [np.zeros(1, dtype=np.int64)]
+    indices = []
+    nrings = 0
+    nindices = 0
+    for g in geometries:
+        level = SURFACE_LEVELS.get(g.get("type"))
+        re = None
+        if (level is not None) and ("boundaries" in g):
+            re = boundaries.flatten(g["boundaries"], boundaries.DEPTHS[g["type"]])
+        if re is None:
+            geoms.append(geoms[-1])
+            continue
+        offsets, ids = re
+        s = offsets[level]
+        r = offsets[level + 1]
+        geoms.append(geoms[-1] + len(s) - 1)
+        surfaces.append(s[1:] + nrings)
+        rings.append(r[1:] + nindices)
+        indices.append(ids)
+        nrings += len(r) - 1
+        nindices += len(ids)
+    if len(indices) == 0:
+        indices = np.zeros(0, dtype=np.int64)
+    else:
+        indices = np.concatenate(indices).astype(np.int64)
+    return (np.array(geoms, dtype=np.int64), np.concatenate(surfaces), np.concatenate(rings), indices)
+
+
+def semantic_types(geometries, types=None):
+    """The type of the semantic surface of each surface of the geometries
+
+    :param geometries: list of geometries
+    :param types: dict of the codes of the types (the new types are added)
+    :returns: (codes, types) -- the code of the type of each surface (the
+        surfaces of surfaces_of()), -1 if it has none, and the dict of the
+        codes of the types
+    """
+    if types is None:
+        types = {}
+    codes = []
+    for g in geometries:
+        level = SURFACE_LEVELS.get(g.get("type"))
+        if level is None:
+            continue
+        re = None
+        if "boundaries" in g:
+            re = boundaries.flatten(g["boundaries"], boundaries.DEPTHS[g["type"]])
+        if re is None:
+            continue
+        n = len(re[0][level]) - 1
+        sem = g.get("semantics") or {}
+        values = sem.get("values")
+        if (values is not None) and (level == 1) and isinstance(values, list):
+            #-- a null shell has no semantic surfaces
+            shells = np.diff(re[0][0]).tolist()
+            if len(values) == len(shells):
+                values = [[None] * k if v is None else v for v, k in zip(values, shells)]
+        if values is not None:
+            values = boundaries.flatten(values, level + 1, nulls=True)
+        if (values is None) or (len(values[1]) != n):
+            codes.append(np.full(n, -1, dtype=np.int64))
+            continue
+        surfaces = sem.get("surfaces", [])
+        table = [types.setdefault(s.get("type"), len(types)) for s in surfaces] + [-1]
+        values = values[1].astype(np.int64)
+        values[(values < 0) | (values >= len(surfaces))] = len(surfaces)
+        codes.append(np.array(table, dtype=np.int64)[values])
+    if len(codes) == 0:
+        return (np.zeros(0, dtype=np.int64), types)
+    return (np.concatenate(codes), types)
+
+
+def triangulate_cityobjects(j, cache=None):
+    """Triangulate the surfaces of all the CityObjects of a model
+
+    :param j: the CityJSON model (dict)
+    :param cache: Cache of the triangulations, or None
+    :returns: (triangles, cityobjects, semantics, types) -- the (T, 3)
+        array of the vertex indices of the triangles, the index of the
+        CityObject of each triangle (in the order of j["CityObjects"]), the
+        code of the semantic type of each triangle (-1 if none), and the
+        list of the types (by code)
+    """
+    geoms = []
+    ngeoms = []
+    for co in j["CityObjects"].values():
+        gs = co.get("geometry", [])
+        geoms.extend(gs)
+        ngeoms.append(len(gs))
+    triangles, starts, surfaceof = triangulate_geometries(geoms, translated(j["vertices"]), cache, owners=True)
+    gstarts = starts[np.concatenate(([0], np.cumsum(ngeoms))).astype(np.int64)]
+    cityobjects = np.repeat(np.arange(len(ngeoms), dtype=np.int64), np.diff(gstarts))
+    codes, types = semantic_types(geoms)
+    return (triangles, cityobjects, codes[surfaceof], list(types))
+
+
+def translated(vertices):
+    """A copy of the vertices translated to their min x and y, the vertices
+    given to the triangulation (less rounding with large coordinates)"""
+    v = np.array(vertices)
+    if len(v) > 0:
+        v[:, :2] -= v[:, :2].min(axis=0)
+    return v
+
+
+class VerticesSubset:
+    """Some vertices, indexed with their indices in the whole array (the
+    vertices sent to a worker process with the geometries using them)"""
+
+    def __init__(self, vertices, ids):
+        self.ids = np.unique(ids)
+        self.vertices = vertices[self.ids]
+
+    def __getitem__(self, ids):
+        return self.vertices[np.searchsorted(self.ids, ids)]
+
+
+def normals(points, starts):
+    """The unit normals of polygons (Newell's method)
+
+    :param points: (N, 3) array of the points of all the polygons
+    :param starts: offsets of the points of each polygon (len+1), the
+        polygons can't be empty
+    :returns: (n, valid) -- the (P, 3) array of the normals, and False for
+        the degenerate polygons (whose normal is null)
+    """
+    lengths = np.diff(starts)
+    #-- the next point, the last one goes back to the first
+    nxt = np.arange(1, len(points) + 1, dtype=np.int64)
+    nxt[starts[1:] - 1] = starts[:-1]
+    p = points
+    q = points[nxt]
+    terms = np.empty((len(points), 3), dtype=np.float64)
+    terms[:, 0] = (p[:, 1] - q[:, 1]) * (p[:, 2] + q[:, 2])
+    terms[:, 1] = (p[:, 2] - q[:, 2]) * (p[:, 0] + q[:, 0])
+    terms[:, 2] = (p[:, 0] - q[:, 0]) * (p[:, 1] + q[:, 1])
+    if len(lengths) == 0:
+        return (np.zeros((0, 3)), np.zeros(0, dtype=bool))
+    n = np.add.reduceat(terms, starts[:-1], axis=0)
+    norm = np.sqrt((n * n).sum(axis=1))
+    valid = norm != 0
+    n[valid] /= norm[valid][:, np.newaxis]
+    return (n, valid)
+
+
+def to_2d(points, n, owners):
+    """Project the points to the planes of their polygons
+
+    :param points: (N, 3) array of the points
+    :param n: (P, 3) array of the unit normals of the polygons
+    :param owners: the polygon of each point
+    :returns: (N, 2) array
+    """
+    #-- the x-axis of each plane, from (1.1, 1.1, 1.1) made orthogonal to n
+    x3 = 1.1 - (1.1 * n).sum(axis=1)[:, np.newaxis] * n
+    x3 /= np.sqrt((x3 ** 2).sum(axis=1))[:, np.newaxis]
+    y3 = np.cross(n, x3)
+    xy = np.empty((len(points), 2), dtype=np.float64)
+    xy[:, 0] = np.einsum('ij,ij->i', points, x3[owners])
+    xy[:, 1] = np.einsum('ij,ij->i', points, y3[owners])
+    return xy
+
+
+def triangulate(vertices, surfaces, rings, indices):
+    """Triangulate surfaces (with holes) given as flat arrays
+
+    The surfaces made of one ring of 3 vertices are kept as they are; the
+    degenerate ones (null normal) are skipped.
+
+    :param vertices: (N, 3) array of the vertices
+    :param surfaces: offsets of the rings of each surface
+    :param rings: offsets of the indices of each ring
+    :param indices: the vertex indices
+    :returns: (triangles, owners) -- the (T, 3) int64 array of the vertex
+        indices of the triangles, and the surface of each triangle, in the
+        order of the surfaces
+    """
+    positions, owners = _triangulate(vertices, surfaces, rings, indices)
+    return (indices[positions], owners)
+
+
+def _triangulate(vertices, surfaces, rings, indices):
+    #-- the triangles as positions in the indices
+    nsurfaces = len(surfaces) - 1
+    #-- the range of the points of each surface
+    starts = rings[surfaces]
+    lengths = np.diff(starts)
+    nrings = np.diff(surfaces)
+    triangle = (nrings == 1) & (lengths == 3)
+    todo = np.flatnonzero((~triangle) & (lengths > 0))
+    n = np.zeros((nsurfaces, 3))
+    valid = np.zeros(nsurfaces, dtype=bool)
+    if len(todo) > 0:
+        #-- the points of the surfaces to triangulate, surface after surface
+        sel = np.repeat(starts[todo] - np.cumsum(np.concatenate(([0], lengths[todo][:-1]))), lengths[todo])
+        sel += np.arange(len(sel), dtype=np.int64)
+        pstarts = np.concatenate(([0], np.cumsum(lengths[todo])))
+        points = vertices[indices[sel]]
+        n[todo], valid[todo] = normals(points, pstarts)
+        owners = np.repeat(np.arange(len(todo), dtype=np.int64), lengths[todo])
+        xy = to_2d(points.astype(np.float64), n[todo], owners)
+    triangles = []
+    owners = []
+    k = 0
+    for s in range(nsurfaces):
+        if triangle[s]:
+            triangles.append(np.arange(starts[s], starts[s] + 3, dtype=np.int64).reshape(1, 3))
+            owners.append(s)
+            continue
+        if (lengths[s] == 0) or (not valid[s]):
+            k += (lengths[s] > 0)
+            continue
+        b = pstarts[k]
+        e = pstarts[k + 1]
+        ends = (rings[surfaces[s] + 1:surfaces[s + 1] + 1] - starts[s]).astype(np.uint32)
+        re = mapbox_earcut.triangulate_float64(xy[b:e], ends)
+        triangles.append((re.astype(np.int64) + starts[s]).reshape(-1, 3))
+        owners.extend([s] * (len(re) // 3))
+        k += 1
+    if len(triangles) == 0:
+        return (np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return (np.concatenate(triangles), np.array(owners, dtype=np.int64))
+
+
+def triangulate_geometries(geometries, vertices, cache=None, owners=False):
+    """Triangulate the surfaces of geometries (MultiSurface,
+    CompositeSurface and Solid)
+
+    :param geometries: list of geometries
+    :param vertices: (N, 3) array of the vertices
+    :param cache: Cache of the triangulations, or None
+    :param owners: True to get the surface of each triangle too
+    :returns: (triangles, starts) -- the (T, 3) array of the vertex indices
+        of the triangles, and the offsets of the triangles of each geometry;
+        with owners, (triangles, starts, owners) where owners are the
+        indices of the surfaces (the surfaces of all the geometries, in
+        order, as in surfaces_of())
+    """
+    geoms, surfaces, rings, indices = surfaces_of(geometries)
+    if cache is None:
+        triangles, surfaceof = triangulate(vertices, surfaces, rings, indices)
+        starts = np.searchsorted(surfaceof, geoms, side='left')
+        if owners:
+            return (triangles, starts, surfaceof)
+        return (triangles, starts)
+    gp = rings[surfaces[geoms]]
+    keys = _geometry_keys(geoms, surfaces, rings, vertices[indices])
+    found = []
+    missing = []
+    for i, key in enumerate(keys):
+        t = cache.get(key)
+        if t is None:
+            missing.append(i)
+        found.append(t)
+    if len(missing) > 0:
+        if len(missing) == len(geometries):
+            geoms2, surfaces2, rings2, indices2 = geoms, surfaces, rings, indices
+        else:
+            geoms2, surfaces2, rings2, indices2 = surfaces_of([geometries[i] for i in missing])
+        positions, surfaceof = _triangulate(vertices, surfaces2, rings2, indices2)
+        starts2 = np.searchsorted(surfaceof, geoms2, side='left')
+        gp2 = rings2[surfaces2[geoms2]]
+        for k, i in enumerate(missing):
+            t = (positions[starts2[k]:starts2[k + 1]] - gp2[k]).astype(np.uint32)
+            cache.put(keys[i], t)
+            found[i] = t
+    counts = [len(t) for t in found]
+    starts = np.zeros(len(geometries) + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    if starts[-1] == 0:
+        positions = np.zeros((0, 3), dtype=np.int64)
+    else:
+        positions = np.concatenate(found).astype(np.int64) + np.repeat(gp[:-1], counts)[:, np.newaxis]
+    if owners:
+        #-- the surface of the first point of each triangle
+        surfaceof = np.searchsorted(rings[surfaces], positions[:, 0], side='right') - 1
+        return (indices[positions], starts, surfaceof)
+    return (indices[positions], starts)
+
+
+#-- extension of the sidecar file of the triangulation cache
+CACHE_EXTENSION = '.tri'
+#-- maximum size (bytes) of the triangles of a cache, the least recently used are dropped
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+def geometry_key(surfaces, rings, points):
+    """The key of a geometry in the Cache: a hash of the offsets of its
+    surfaces and rings (starting at 0) and of its points"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(points.dtype.str.encode())
+    h.update(np.ascontiguousarray(surfaces, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(rings, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(points).tobytes())
+    return h.digest()
+
+
+def geometry_keys(geometries, vertices):
+    """The keys of the geometries in the Cache, one per geometry"""
+    geoms, surfaces, rings, indices = surfaces_of(geometries)
+    return _geometry_keys(geoms, surfaces, rings, vertices[indices])
+
+
+def _geometry_keys(geoms, surfaces, rings, points):
+    #-- the range of the surfaces, rings and points of each geometry
+    gr = surfaces[geoms]
+    gp = rings[gr]
+    return [geometry_key(surfaces[geoms[i]:geoms[i + 1] + 1] - gr[i], rings[gr[i]:gr[i + 1] + 1] - gp[i], points[gp[i]:gp[i + 1]]) for i in range(len(geoms) - 1)]
+
+
+class Cache:
+    """The triangulations of geometries, saved in a file.
+
+    Each entry has the generation (the number of the run) when it was last
+    used; when the cache is saved the least recently used entries are
+    dropped to keep the size of the triangles under max_size. The changes
+    (added and used entries) since begin() can be merged in another cache,
+    eg from a worker process.
+    """
+
+    def __init__(self, path=None, max_size=CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        #-- key: [triangles, generation]
+        self.entries = {}
+        self.generation = 0
+        self.begin()
+        if (path is not None) and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with np.load(self.path) as a:
+                keys = a["keys"]
+                counts = a["counts"]
+                triangles = a["triangles"]
+                used = a["used"]
+        except (IOError, ValueError, KeyError, zipfile.BadZipFile):
+            #-- not a cache, it will be replaced
+            return
+        ends = np.cumsum(counts)
+        for key, t, u in zip(keys, np.split(triangles, ends[:-1]), used.tolist()):
+            self.entries[key.tobytes()] = [t, u]
+        if len(used) > 0:
+            self.generation = int(used.max()) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        e = self.entries.get(key)
+        if e is None:
+            return None
+        e[1] = self.generation
+        self.hits.append(key)
+        return e[0]
+
+    def put(self, key, triangles):
+        self.entries[key] = [triangles, self.generation]
+        self.added[key] = triangles
+
+    def subset(self, keys):
+        """A Cache (without file) with only the entries of keys, eg for the
+        geometries sent to a worker process"""
+        c = Cache(max_size=self.max_size)
+        c.generation = self.generation
+        for key in keys:
+            if key in self.entries:
+                c.entries[key] = list(self.entries[key])
+        return c
+
+    def begin(self):
+        self.added = {}
+        self.hits = []
+
+    def changes(self):
+        return (self.added, self.hits)
+
+    def merge(self, changes):
+        added, hits = changes
+        for key in hits:
+            if key in self.entries:
+                self.entries[key][1] = self.generation
+        for key, t in added.items():
+            self.entries[key] = [t, self.generation]
+
+    def save(self, path=None):
+        """Save the cache (atomically), without the least recently used
+        entries above max_size
+
+        :raises: IOError
+        """
+        if path is None:
+            path = self.path
+        keys = sorted(self.entries, key=lambda k: self.entries[k][1], reverse=True)
+        size = 0
+        kept = []
+        for key in keys:
+            size += self.entries[key][0].nbytes
+            if size > self.max_size:
+                break
+            kept.append(key)
+        for key in keys[len(kept):]:
+            del self.entries[key]
+        if len(kept) > 0:
+            triangles = np.concatenate([self.entries[k][0] for k in kept]).reshape(-1, 3)
+        else:
+            triangles = np.zeros((0, 3), dtype=np.uint32)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fo:
+            np.savez(fo,
+                     keys=np.frombuffer(b''.join(kept), dtype=np.uint8).reshape(-1, 16),
+                     counts=np.array([len(self.entries[k][0]) for k in kept], dtype=np.int64),
+                     triangles=triangles.astype(np.uint32),
+                     used=np.array([self.entries[k][1] for k in kept], dtype=np.int64))
+        os.replace(tmp, path)
@@ -4,6 +4,11 @@ import json
 import jsonschema
 import jsonref
 
+import numpy as np
+
+from cjio import stream
+from cjio import boundaries
+
 #-- ERRORS
  # validate_against_schema
  # parent_children_consistency
@@ -34,6 +39,34 @@ def dict_raise_on_duplicates(ordered_pairs):
     return d
 
 
+def duplicate_cityobjects_ids(s):
+    """IDs of the CityObjects present more than once in a CityJSON document
+
+    Only the keys of the "CityObjects" are checked, their values are skipped
+    without being decoded and the parsing stops after them, thus it's much
+    cheaper than dict_raise_on_duplicates.
+
+    :param s: the CityJSON document (str)
+    :returns: list of the duplicate IDs
+    """
+    sc = stream.Scanner.from_string(s)
+    dups = []
+    for key in sc.members():
+        if key == "CityObjects":
+            ids = set()
+            for theid, start, end in sc.skip_members():
+                if theid in ids:
+                    dups.append(theid)
+                ids.add(theid)
+            break
+        elif key == "vertices":
+            for chunk in sc.array_chunks():
+                pass
+        else:
+            sc.read_value()
+    return dups
+
+
 def city_object_groups(j):
     isValid = True
     es = []
@@ -265,22 +298,16 @@ def geometry_empty(j):
 
 
 def wrong_vertex_index(j):
-    def recusionvisit(a, co, errs):
-      for each in a:
-        if isinstance(each, list):
-            recusionvisit(each, co, errs)
-        else:
-            if (each >= len(j['vertices'])):
-                es = []
-                s = "ERROR:   CityObject #" + co + " has geometry with wrong vertex."
-                es.append(s)
-                s = "\t(vertex #" + str(each) + " doesn't exist)"   
-                es.append(s)
-                errs.append(es)
     errs = []
     for co in j["CityObjects"]:
-        for g in j['CityObjects'][co]['geometry']:
-            recusionvisit(g["boundaries"], co, errs)    
+        ids = boundaries.Geometries(j['CityObjects'][co]['geometry']).indices
+        for each in ids[ids >= len(j['vertices'])].tolist():
+            es = []
+            s = "ERROR:   CityObject #" + co + " has geometry with wrong vertex."
+            es.append(s)
+            s = "\t(vertex #" + str(each) + " doesn't exist)"   
+            es.append(s)
+            errs.append(es)
     es = []
     if (len(errs) > 0):
         isValid = False
@@ -305,14 +332,11 @@ def cityjson_properties(j, js):
 def duplicate_vertices(j):
     isValid = True
     ws = []
-    thev = set()
-    duplicates = set()
-    for v in j["vertices"]:
-        s = str(v[0]) + " " + str(v[1]) + " " + str(v[2])
-        if s in thev:
-            duplicates.add(s)
-        else:
-            thev.add(s)
+    duplicates = []
+    if len(j["vertices"]) > 0:
+        u, counts = np.unique(j["vertices"], axis=0, return_counts=True)
+        for v in u[counts > 1].tolist():
+            duplicates.append(str(v[0]) + " " + str(v[1]) + " " + str(v[2]))
     if len(duplicates) > 0:
         s = 'WARNING: there are ' + str(len(duplicates)) + ' duplicate vertices in j["vertices"]'
         ws.append(s)
@@ -325,28 +349,16 @@ def duplicate_vertices(j):
 
 
 def orphan_vertices(j):
-    def recusionvisit(a, ids):
-      for each in a:
-        if isinstance(each, list):
-            recusionvisit(each, ids)
-        else:
-            ids.add(each)
     isValid = True
     ws = []
-    ids = set()
-    for co in j["CityObjects"]:
-        for g in j['CityObjects'][co]['geometry']:
-            recusionvisit(g["boundaries"], ids)
+    ids = np.unique(boundaries.Geometries.of_cityobjects(j).indices)
     noorphans = len(j["vertices"]) - len(ids)
     if noorphans > 0:
         s = 'WARNING: there are ' + str(noorphans) + ' orphan vertices in j["vertices"]'
         ws.append(s)
         isValid = False
     if noorphans > 5:
-        all = set()
-        for i in range(len(j["vertices"])):
-            all.add(i)
-        symdiff = all.symmetric_difference(ids)
+        symdiff = np.setxor1d(np.arange(len(j["vertices"])), ids).tolist()
         s = '\t['
         for each in symdiff:
             s += str(each) + ', '
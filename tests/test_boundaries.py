@@ -0,0 +1,46 @@
+import copy
+
+import numpy as np
+import pytest
+
+from cjio import boundaries
+
+
+@pytest.mark.parametrize("model", ["dummy", "rotterdam_subset"])
+def test_flatten_round_trip(request, model):
+    cm = request.getfixturevalue(model)
+    for co in cm.j["CityObjects"].values():
+        for g in co["geometry"]:
+            offsets, indices = boundaries.flatten(g["boundaries"], boundaries.DEPTHS[g["type"]])
+            assert len(offsets) == boundaries.DEPTHS[g["type"]] - 1
+            assert boundaries.unflatten(offsets, indices) == g["boundaries"]
+
+
+def test_flatten_nulls():
+    offsets, indices = boundaries.flatten([[0, None], [], [2]], 2, nulls=True)
+    assert indices.tolist() == [0, -1, 2]
+    assert [o.tolist() for o in offsets] == [[0, 2, 2, 3]]
+    assert boundaries.unflatten(offsets, indices, nulls=True) == [[0, None], [], [2]]
+    assert boundaries.flatten([[0, None]], 2) is None
+
+
+def test_geometries():
+    gs = [{"type": "MultiSurface", "boundaries": [[[0, 1, 2]], [[]], []]},
+          {"type": "Unknown", "boundaries": [[[[3]]]]},
+          {"type": "Solid", "boundaries": [[[[5, 4]]]]},
+          {"type": "MultiSurface", "boundaries": [[0, 1, 2]]},
+          {"type": "MultiPoint", "boundaries": [9, 7]}]
+    before = copy.deepcopy(gs)
+    geoms = boundaries.Geometries(gs)
+    #-- in the order of the geometries, even when they are not regular
+    assert geoms.indices.tolist() == [0, 1, 2, 3, 5, 4, 0, 1, 2, 9, 7]
+    assert geoms.indices_of(2).tolist() == [5, 4]
+    geoms.offset(10)
+    assert gs[2]["boundaries"] == [[[[15, 14]]]]
+    geoms.offset(-10)
+    assert gs == before
+    #-- the unused 6 and 8 are removed, the others keep their order
+    assert geoms.compact(10).tolist() == [0, 1, 2, 3, 4, 5, 7, 9]
+    assert gs[4]["boundaries"] == [7, 6]
+    assert gs[2]["boundaries"] == [[[[5, 4]]]]
+    assert gs[3]["boundaries"] == [[0, 1, 2]]
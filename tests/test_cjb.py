@@ -0,0 +1,53 @@
+import os.path
+import json
+
+import pytest
+
+from cjio import cityjson, cjb
+
+
+@pytest.mark.parametrize("model", ["dummy", "dummy_noappearance", "rotterdam_subset"])
+def test_cjb_round_trip(request, tmpdir, model):
+    cm = request.getfixturevalue(model)
+    before = json.dumps(cm.get_json())
+    p = str(tmpdir.join('model.cjb'))
+    cjb.write(cm, p)
+    assert json.dumps(cm.get_json()) == before
+    assert cjb.is_cjb(p)
+    cm2 = cjb.read(p)
+    assert json.dumps(cm2.get_json()) == before
+    assert cm2.path == os.path.abspath(p)
+
+
+def test_cjb_arrays(tmpdir, rotterdam_subset):
+    p = str(tmpdir.join('model.cjb'))
+    cjb.write(rotterdam_subset, p)
+    j, arrays = cjb.load(p)
+    assert arrays["vertices"].shape == (len(rotterdam_subset.j["vertices"]), 3)
+    assert arrays["vertices"].dtype.kind == 'i'
+    assert j["vertices"] is None
+    assert arrays["indices"].dtype.itemsize == 4
+
+
+def test_cjb_irregular_boundaries(tmpdir):
+    cm = cityjson.CityJSON()
+    cm.j["vertices"] = cityjson.vertices_array([[0.5, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0]])
+    cm.j["CityObjects"]["a"] = {
+        "type": "Building",
+        "geometry": [
+            {"type": "MultiSurface", "lod": 1, "boundaries": [[[0, 1, 2]], [[]], []],
+             "semantics": {"surfaces": [{"type": "RoofSurface"}], "values": [0, None, None]}},
+            {"type": "MultiSurface", "lod": 2, "boundaries": [[0, 1, 2]]},
+            {"type": "Unknown", "boundaries": [[[[0]]]]}
+        ]
+    }
+    p = str(tmpdir.join('model.cjb'))
+    cjb.write(cm, p)
+    assert cjb.read(p).get_json() == cm.get_json()
+
+
+def test_cjb_not_cjb(data_dir):
+    p = os.path.join(data_dir, 'dummy', 'dummy.json')
+    assert cjb.is_cjb(p) == False
+    with pytest.raises(ValueError):
+        cjb.read(p)
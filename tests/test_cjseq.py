@@ -0,0 +1,62 @@
+import json
+from io import StringIO
+
+import pytest
+
+from cjio import cityjson
+
+
+def resolved_geometry(cm):
+    """The boundaries of each City Object, with the coordinates instead of the
+    vertex indices"""
+    def resolve(a):
+        if isinstance(a, list):
+            return [resolve(each) for each in a]
+        return cm.j["vertices"][a].tolist()
+    re = {}
+    for theid, co in cm.j["CityObjects"].items():
+        re[theid] = [resolve(g["boundaries"]) for g in co["geometry"]]
+    return re
+
+
+@pytest.mark.parametrize("model", ["dummy", "dummy_noappearance", "rotterdam_subset"])
+def test_cjseq_round_trip(request, model):
+    cm = request.getfixturevalue(model)
+    out = StringIO()
+    cm.export2cjseq(out)
+    lines = out.getvalue().splitlines()
+    header = json.loads(lines[0])
+    assert header["CityObjects"] == {}
+    assert header["vertices"] == []
+    for l in lines[1:]:
+        assert json.loads(l)["type"] == "CityJSONFeature"
+    f = StringIO(out.getvalue())
+    f.name = 'features.jsonl'
+    cm2 = cityjson.cjseq2cj(f)
+    assert set(cm2.j["CityObjects"].keys()) == set(cm.j["CityObjects"].keys())
+    assert resolved_geometry(cm2) == resolved_geometry(cm)
+    assert cm2.j.get("transform") == cm.j.get("transform")
+
+
+def test_cjseq_features_have_their_children(dummy):
+    for f in dummy.get_features():
+        for co in f["CityObjects"].values():
+            for child in co.get("children", []):
+                assert child in f["CityObjects"]
+
+
+def test_cjseq_duplicate_ids(dummy):
+    out = StringIO()
+    dummy.export2cjseq(out)
+    lines = out.getvalue().splitlines()
+    f = StringIO('\n'.join(lines + lines[1:2]))
+    f.name = 'features.jsonl'
+    with pytest.raises(ValueError):
+        cityjson.cjseq2cj(f)
+
+
+def test_cjseq_not_a_sequence():
+    f = StringIO('{"type":"CityJSONFeature","id":"a","CityObjects":{},"vertices":[]}\n')
+    f.name = 'features.jsonl'
+    with pytest.raises(ValueError):
+        cityjson.cjseq2cj(f)
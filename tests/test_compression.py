@@ -0,0 +1,51 @@
+import os.path
+import json
+
+import pytest
+
+from cjio import cityjson
+from cjio import compression
+
+
+CODECS = ['.gz', '.bz2', '.xz']
+if compression.MODULE_ZSTANDARD_AVAILABLE:
+    CODECS.append('.zst')
+
+
+def test_splitext():
+    assert compression.splitext('a/b.json.gz') == ('.json', 'gzip')
+    assert compression.splitext('b.JSON') == ('.json', None)
+    assert compression.splitext('b.obj.zst') == ('.obj', 'zstd')
+
+
+@pytest.mark.parametrize("ext", CODECS)
+def test_roundtrip(tmp_path, dummy, ext):
+    p = str(tmp_path / ('dummy.json' + ext))
+    with compression.open_file(p, mode='w') as fo:
+        dummy.write(fo)
+    assert compression.detect(p) == compression.EXTENSIONS[ext]
+    with compression.open_file(p, mode='r') as f:
+        cm = cityjson.reader(f)
+        assert cm.get_json() == dummy.get_json()
+        assert cm.path == os.path.abspath(p)
+
+
+@pytest.mark.parametrize("ext", CODECS)
+def test_stream_compressed(tmp_path, dummy, ext):
+    p = str(tmp_path / ('dummy.json' + ext))
+    with compression.open_file(p, mode='w') as fo:
+        dummy.write(fo)
+    with compression.open_file(p, mode='r') as f:
+        cos = dict(cityjson.iter_cityobjects(f))
+    assert cos == dummy.j["CityObjects"]
+
+
+def test_detect_magic(tmp_path, dummy):
+    p = str(tmp_path / 'dummy.json.gz')
+    with compression.open_file(p, mode='w') as fo:
+        fo.write(json.dumps(dummy.get_json()))
+    misnamed = str(tmp_path / 'dummy.json')
+    os.rename(p, misnamed)
+    assert compression.detect(misnamed) == 'gzip'
+    with compression.open_file(misnamed, mode='r') as f:
+        assert json.loads(f.read()) == dummy.get_json()
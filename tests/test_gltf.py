@@ -0,0 +1,75 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from cjio import gltf
+from cjio import triangulation
+
+
+pytestmark = pytest.mark.skipif(not triangulation.MODULE_EARCUT_AVAILABLE, reason="mapbox_earcut missing")
+
+
+def read_glb(path):
+    with open(path, 'rb') as f:
+        b = f.read()
+    magic, version, length = struct.unpack('<4sII', b[:12])
+    assert (magic == b'glTF') and (version == 2) and (length == len(b))
+    n, kind = struct.unpack('<I4s', b[12:20])
+    assert (kind == b'JSON') and (n % 4 == 0)
+    j = json.loads(b[20:20 + n])
+    binary = b''
+    if len(b) > 20 + n:
+        m, kind = struct.unpack('<I4s', b[20 + n:28 + n])
+        assert kind == b'BIN\x00'
+        binary = b[28 + n:28 + n + m]
+    return (j, binary)
+
+
+def mesh_triangles(j, binary, mesh):
+    #-- the (T, 3, 3) positions of the triangles of a mesh
+    p = j["meshes"][mesh]["primitives"][0]
+    def accessor(i, dtype, width):
+        a = j["accessors"][i]
+        offset = j["bufferViews"][a["bufferView"]]["byteOffset"] + a["byteOffset"]
+        return np.frombuffer(binary, dtype=dtype, count=a["count"] * width, offset=offset).reshape(-1, width)
+    positions = accessor(p["attributes"]["POSITION"], '<f4', 3)
+    a = j["accessors"][p["attributes"]["POSITION"]]
+    assert positions.min(axis=0).tolist() == a["min"]
+    assert positions.max(axis=0).tolist() == a["max"]
+    indices = accessor(p["indices"], '<u4', 1).ravel()
+    assert indices.max() < len(positions)
+    return positions[indices].reshape(-1, 3, 3)
+
+
+def test_glb(rotterdam_subset, tmp_path):
+    path = str(tmp_path / 'r.glb')
+    gltf.write(rotterdam_subset, path)
+    j, binary = read_glb(path)
+    cos = rotterdam_subset.j["CityObjects"]
+    assert len(j["nodes"]) == len(cos) + 1
+    v = rotterdam_subset.transform_vertices(rotterdam_subset.j["vertices"]) - j["nodes"][0]["extras"]["origin"]
+    for theid, node in zip(cos, j["nodes"][1:]):
+        assert node["extras"] == {"id": theid, "type": cos[theid]["type"]}
+        triangles, starts = triangulation.triangulate_geometries(cos[theid]["geometry"], triangulation.translated(rotterdam_subset.j["vertices"]))
+        t = mesh_triangles(j, binary, node["mesh"])
+        assert np.allclose(t, v[triangles], atol=1e-3)
+
+
+def test_glb_templates(dummy, tmp_path):
+    path = str(tmp_path / 'd.glb')
+    gltf.write(dummy, path)
+    j, binary = read_glb(path)
+    ids = list(dummy.j["CityObjects"])
+    node = j["nodes"][ids.index("onebigtree-template") + 1]
+    assert "mesh" not in node
+    assert len(node["children"]) == 1
+    instance = j["nodes"][node["children"][0]]
+    m = np.array(instance["matrix"]).reshape(4, 4).T
+    assert m[0, 0] == 2.0
+    v = dummy.transform_vertices(dummy.j["vertices"]) - j["nodes"][0]["extras"]["origin"]
+    assert np.allclose(m[:3, 3], v[2])
+    t = dummy.j["geometry-templates"]
+    triangles, starts = triangulation.triangulate_geometries(t["templates"][:1], np.array(t["vertices-templates"]))
+    assert np.allclose(mesh_triangles(j, binary, instance["mesh"]), np.array(t["vertices-templates"])[triangles])
@@ -0,0 +1,66 @@
+import os
+import json
+import shutil
+from io import StringIO
+
+import pytest
+
+from cjio import cityjson, index
+
+
+@pytest.fixture
+def dummy_copy(data_dir, tmpdir):
+    p = str(tmpdir.join('dummy.json'))
+    shutil.copy(os.path.join(data_dir, 'dummy', 'dummy.json'), p)
+    yield p
+
+
+def test_index_cityobjects(dummy_copy, dummy):
+    idx = index.build(dummy_copy)
+    assert os.path.isfile(index.path_of(dummy_copy))
+    with open(dummy_copy, 'r') as f:
+        s = cityjson.CityJSONStream(f, index=idx)
+        assert dict(s.iter_cityobjects()) == dummy.j["CityObjects"]
+        assert s.j["vertices"][:].tolist() == dummy.j["vertices"].tolist()
+        assert s.keys == list(dummy.j.keys())
+
+
+def test_index_subset_same_as_stream(dummy_copy):
+    idx = index.build(dummy_copy)
+    outs = []
+    for i in (None, idx):
+        with open(dummy_copy, 'r') as f:
+            s = cityjson.CityJSONStream(f, index=i).get_subset_cotype('Building')
+            out = StringIO()
+            s.write(out)
+            outs.append(out.getvalue())
+    assert outs[0] == outs[1]
+
+
+def test_index_stale(dummy_copy):
+    index.build(dummy_copy)
+    assert index.load(dummy_copy) is not None
+    with open(dummy_copy, 'a') as f:
+        f.write('\n')
+    assert index.load(dummy_copy) is None
+    assert index.get(dummy_copy) is not None
+    assert index.load(dummy_copy) is not None
+
+
+def test_index_utf8(tmpdir):
+    j = {"type": "CityJSON", "version": "1.0",
+         "CityObjects": {"hôtel": {"type": "Building", "attributes": {"nom": "Hôtel de ville ✓"},
+                                    "geometry": [{"type": "MultiSurface", "lod": 1, "boundaries": [[[0, 1, 2]]]}]},
+                         "gare": {"type": "Building",
+                                  "geometry": [{"type": "MultiSurface", "lod": 1, "boundaries": [[[2, 3, 4]]]}]}},
+         "vertices": [[i, i, i] for i in range(5)]}
+    p = str(tmpdir.join('utf8.json'))
+    with open(p, 'w', encoding='utf-8') as f:
+        json.dump(j, f, ensure_ascii=False, indent=2)
+    idx = index.build(p)
+    assert idx["cityobjects"]["ids"] == ["hôtel", "gare"]
+    assert idx["cityobjects"]["vertices"] == [[0, 2], [2, 4]]
+    with open(p, 'r', encoding='utf-8') as f:
+        s = cityjson.CityJSONStream(f, index=idx).get_subset_ids(["gare"])
+        assert dict(s.iter_cityobjects()) == {"gare": j["CityObjects"]["gare"]}
+        assert s.get_vertices(j["CityObjects"]["gare"])[1].tolist() == j["vertices"][2:]
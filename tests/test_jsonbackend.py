@@ -0,0 +1,40 @@
+import json
+from io import StringIO
+
+import pytest
+
+from cjio import cityjson
+from cjio import jsonbackend
+from cjio import validation
+
+
+DUPLICATES = '{"type":"CityJSON","version":"1.0","CityObjects":{"a":{"type":"Building","geometry":[]},"b":{"type":"Road","geometry":[]},"a":{"type":"Building","geometry":[]}},"vertices":[]}'
+
+
+@pytest.mark.parametrize("backend", jsonbackend.available())
+def test_loads_dumps(dummy, backend):
+    s = json.dumps(dummy.get_json())
+    assert jsonbackend.loads(s, backend) == dummy.get_json()
+    assert json.loads(jsonbackend.dumps(dummy.get_json(), 0, backend)) == dummy.get_json()
+
+
+def test_dumps_json_compact(dummy):
+    assert jsonbackend.dumps(dummy.get_json(), 0, 'json') == json.dumps(dummy.get_json(), separators=(',',':'))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        jsonbackend.get('simplejson')
+
+
+def test_duplicate_cityobjects_ids(dummy):
+    assert validation.duplicate_cityobjects_ids(DUPLICATES) == ["a"]
+    assert validation.duplicate_cityobjects_ids(json.dumps(dummy.get_json())) == []
+
+
+def test_read_duplicates():
+    with pytest.raises(ValueError):
+        cityjson.CityJSON().read(StringIO(DUPLICATES))
+    cm = cityjson.CityJSON()
+    cm.read(StringIO(DUPLICATES), ignore_duplicate_keys=True)
+    assert len(cm.j["CityObjects"]) == 2
@@ -0,0 +1,66 @@
+from io import StringIO
+
+import pytest
+
+from cjio import cityjson
+
+
+OFF = """OFF
+# a pyramid
+5 5 0
+0 0 0
+1 0 0
+1 1 0
+0 1 0
+0.5 0.5 1
+4 0 3 2 1
+3 0 1 4
+3 1 2 4
+3 2 3 4
+3 3 0 4
+"""
+
+POLY = """4 3 0 0
+1 0 0 0
+2 4 0 0
+3 4 4 0
+4 0 4 0
+1 0
+2 1 1
+4 1 2 3 4
+3 1 2 3
+1 2 1 0
+"""
+
+
+def test_off2cj():
+    cm = cityjson.off2cj(StringIO(OFF))
+    assert cm.j["vertices"].tolist() == [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [0.5, 0.5, 1]]
+    g = cm.j["CityObjects"]["id-1"]["geometry"][0]
+    assert g["type"] == "Solid"
+    assert g["boundaries"] == [[[[0, 3, 2, 1]], [[0, 1, 4]], [[1, 2, 4]], [[2, 3, 4]], [[3, 0, 4]]]]
+
+
+def test_poly2cj():
+    cm = cityjson.poly2cj(StringIO(POLY))
+    assert len(cm.j["vertices"]) == 4
+    #-- the vertices are numbered from 1 in the file, the hole is a 2nd ring
+    g = cm.j["CityObjects"]["id-1"]["geometry"][0]
+    assert g["boundaries"] == [[[[0, 1, 2, 3], [0, 1, 2]]]]
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_dir2cj(tmpdir, processes):
+    tmpdir.join('pyramid.off').write(OFF)
+    tmpdir.join('square.poly').write(POLY)
+    tmpdir.join('other.txt').write('not a mesh')
+    cm = cityjson.dir2cj(str(tmpdir), processes=processes)
+    assert list(cm.j["CityObjects"].keys()) == ["pyramid", "square"]
+    assert len(cm.j["vertices"]) == 9
+    g = cm.j["CityObjects"]["square"]["geometry"][0]
+    assert g["boundaries"] == [[[[5, 6, 7, 8], [5, 6, 7]]]]
+
+
+def test_dir2cj_empty(tmpdir):
+    with pytest.raises(ValueError):
+        cityjson.dir2cj(str(tmpdir))
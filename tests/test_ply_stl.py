@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from cjio import ply
+from cjio import stl
+from cjio import triangulation
+
+
+pytestmark = pytest.mark.skipif(not triangulation.MODULE_EARCUT_AVAILABLE, reason="mapbox_earcut missing")
+
+
+def test_triangulate_cityobjects(rotterdam_subset):
+    triangles, cityobjects, semantics, types = triangulation.triangulate_cityobjects(rotterdam_subset.j)
+    obj = rotterdam_subset.export2obj(processes=1).getvalue()
+    assert len(triangles) == obj.count('\nf ')
+    assert (np.diff(cityobjects) >= 0).all()
+    assert set(types) == {"RoofSurface", "GroundSurface", "WallSurface"}
+    assert (semantics >= 0).all()
+
+
+def test_ply(rotterdam_subset, tmp_path):
+    path = str(tmp_path / 'r.ply')
+    ply.write(rotterdam_subset, path)
+    with open(path, 'rb') as f:
+        b = f.read()
+    end = b.index(b'end_header\n') + len(b'end_header\n')
+    header = b[:end].decode().split('\n')
+    assert header[1] == "format binary_little_endian 1.0"
+    nv = int([l for l in header if l.startswith("element vertex")][0].split()[-1])
+    nf = int([l for l in header if l.startswith("element face")][0].split()[-1])
+    v = np.frombuffer(b, dtype='<f8', count=nv * 3, offset=end).reshape(-1, 3)
+    faces = np.frombuffer(b, dtype=ply.FACE, count=nf, offset=end + nv * 24)
+    assert end + nv * 24 + nf * ply.FACE.itemsize == len(b)
+    assert np.allclose(v, rotterdam_subset.transform_vertices(rotterdam_subset.j["vertices"]))
+    triangles, cityobjects, semantics, types = triangulation.triangulate_cityobjects(rotterdam_subset.j)
+    assert (faces['n'] == 3).all()
+    assert (faces['vertices'] == triangles).all()
+    assert (faces['cityobject'] == cityobjects).all()
+    assert "comment semantic %d %s" % (faces['semantic'][0], types[semantics[0]]) in header
+
+
+def test_stl(rotterdam_subset, tmp_path):
+    path = str(tmp_path / 'r.stl')
+    stl.write(rotterdam_subset, path)
+    with open(path, 'rb') as f:
+        b = f.read()
+    n = int(np.frombuffer(b, dtype='<u4', count=1, offset=80)[0])
+    assert len(b) == 84 + n * 50
+    records = np.frombuffer(b, dtype=stl.TRIANGLE, count=n, offset=84)
+    origin = np.array([float(x) for x in b[:80].decode().split()[-3:]])
+    triangles = triangulation.triangulate_cityobjects(rotterdam_subset.j)[0]
+    v = rotterdam_subset.transform_vertices(rotterdam_subset.j["vertices"])
+    assert np.allclose(records['vertices'] + origin, v[triangles], atol=1e-2)
+    assert np.allclose(np.linalg.norm(records['normal'], axis=1), 1, atol=1e-5)
+
+
+def test_null_semantics(dummy, tmp_path):
+    #-- "values": null (mycanal), and a null shell in a Solid (102636712)
+    cos = dummy.j["CityObjects"]
+    codes, types = triangulation.semantic_types(cos["mycanal"]["geometry"])
+    assert codes.tolist() == [-1] * 6
+    codes, types = triangulation.semantic_types(cos["102636712"]["geometry"][1:])
+    assert codes[6:].tolist() == [-1] * 4
+    assert codes[:6].tolist() == [types["RoofSurface"], types["WallSurface"], -1, -1, types["WallSurface"], types["WallSurface"]]
+    ply.write(dummy, str(tmp_path / 'd.ply'))
+    stl.write(dummy, str(tmp_path / 'd.stl'))
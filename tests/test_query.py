@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+from cjio import query
+
+
+@pytest.fixture
+def model(dummy):
+    cm = copy.deepcopy(dummy)
+    cos = cm.j["CityObjects"]
+    cos["2929"]["attributes"] = {"yearOfConstruction": 1850, "function": "residential"}
+    cos["itcanbeastringtoo"]["attributes"] = {"yearOfConstruction": 1990.5, "function": "residential", "measuredHeight": None}
+    cos["LondonTower"]["attributes"] = {"yearOfConstruction": "unknown", "heritage": True}
+    return cm
+
+
+def brute(cm, test):
+    return [theid for theid, co in cm.j["CityObjects"].items() if test(co.get("attributes", {}))]
+
+
+def test_query_where(model):
+    assert model.query_where("yearOfConstruction < 1950 and function == 'residential'") == ["2929"]
+    assert model.query_where("yearOfConstruction >= 1904") == brute(model, lambda a: isinstance(a.get("yearOfConstruction"), (int, float)) and a["yearOfConstruction"] >= 1904)
+    assert model.query_where('yearOfConstruction = "unknown" or heritage == true') == ["LondonTower"]
+    assert model.query_where("measuredHeight == null") == brute(model, lambda a: a.get("measuredHeight") is None)
+    assert model.query_where("not measuredHeight == null") == model.query_where("measuredHeight != null")
+    assert model.query_where("yearOfConstruction != 1904") == ["2929", "itcanbeastringtoo", "LondonTower"]
+    assert model.query_where("type in ('Bridge', 'TINRelief')") == ["myterrain01", "LondonTower"]
+    assert model.query_where("(type == 'Building') and attributes.owner == 'Elvis Presley'") == ["102636712"]
+    #-- the columns are kept
+    assert ("attribute", "yearOfConstruction") in model.attribute_index().columns
+    index = model.attribute_index()
+    model.query_where("type == 'Bridge'")
+    assert model.attribute_index() is index
+
+
+def test_query_bbox_fields(model):
+    ids, bboxes, centroids, tree = model.spatial_index()
+    z = sorted(set(bboxes[:, 5][bboxes[:, 5] == bboxes[:, 5]].tolist()))[0]
+    assert model.query_where("bbox.maxz <= %r" % z) == [theid for theid, b in zip(ids, bboxes) if b[5] <= z]
+    assert model.query_where("bbox.minx == null") == [theid for theid, b in zip(ids, bboxes) if b[0] != b[0]]
+
+
+@pytest.mark.parametrize("expr", ["", "a <", "a < 3 and", "(a == 1", "a ~ 3", "a < true", "bbox.maxz == 'x'", "3 == a", "a in 3"])
+def test_query_invalid(model, expr):
+    with pytest.raises(ValueError):
+        model.query_where(expr)
+
+
+def test_subset_where(model):
+    model.j["CityObjects"]["102636712"]["children"] = ["2929"]
+    before = copy.deepcopy(model.j["CityObjects"])
+    #-- with the parent of 2929
+    s = model.get_subset_where("function == 'residential'")
+    assert list(s.j["CityObjects"]) == ["102636712", "2929", "itcanbeastringtoo"]
+    s = model.get_subset_where("function == 'residential'", exclude=True)
+    assert ("102636712" not in s.j["CityObjects"]) and ("LondonTower" in s.j["CityObjects"])
+    assert model.j["CityObjects"] == before
+
+
+def test_tokenize():
+    assert query.tokenize("`my attr` >= -1.5e2 AND x = 'it\\'s'") == [
+        ("name", "my attr"), ("op", ">="), ("number", -150.0), ("keyword", "and"),
+        ("name", "x"), ("op", "=="), ("string", "it's")]
@@ -0,0 +1,154 @@
+import os.path
+import copy
+import json
+from io import StringIO
+
+import pytest
+
+from cjio import cityjson
+from cjio import stream
+
+
+@pytest.fixture(scope='module')
+def dummy_path(data_dir):
+    yield os.path.join(data_dir, 'dummy', 'dummy.json')
+
+
+def test_iter_cityobjects(dummy_path, dummy):
+    with open(dummy_path, 'r') as f:
+        cos = dict(cityjson.iter_cityobjects(f))
+    assert cos == dummy.j["CityObjects"]
+    assert list(cos.keys()) == list(dummy.j["CityObjects"].keys())
+
+
+def test_stream_root_properties(dummy_path, dummy):
+    with open(dummy_path, 'r') as f:
+        s = cityjson.CityJSONStream(f)
+        assert s.get_version() == dummy.get_version()
+        assert s.get_epsg() == dummy.get_epsg()
+        assert s.j["vertices"].tolist() == dummy.j["vertices"].tolist()
+        assert s.keys == list(dummy.j.keys())
+
+
+@pytest.mark.parametrize("indent", [0, 2])
+def test_stream_write_same_as_dumps(dummy_path, dummy, indent):
+    with open(dummy_path, 'r') as f:
+        s = cityjson.CityJSONStream(f)
+        out = StringIO()
+        s.write(out, indent=indent)
+    if indent == 0:
+        assert out.getvalue() == json.dumps(dummy.get_json(), separators=(',',':'))
+    else:
+        assert out.getvalue() == json.dumps(dummy.get_json(), indent=indent)
+
+
+def test_stream_subset_cotype(dummy_path, dummy):
+    with open(dummy_path, 'r') as f:
+        s = cityjson.CityJSONStream(f).get_subset_cotype('Building')
+        out = StringIO()
+        s.write(out)
+    j = json.loads(out.getvalue())
+    assert set(j["CityObjects"].keys()) == {"102636712", "2929", "801", "itcanbeastringtoo"}
+    s = json.dumps([g["boundaries"] for co in j["CityObjects"].values() for g in co["geometry"]])
+    ids = [int(i) for i in s.replace('[', ' ').replace(']', ' ').replace(',', ' ').split()]
+    assert set(ids) == set(range(len(j["vertices"])))
+
+
+@pytest.mark.parametrize("exclude", [False, True])
+def test_stream_subset_cotype_hierarchy(tmp_path, dummy_noappearance, exclude):
+    #-- the appearances are kept complete when streaming, thus none here
+    cm = copy.deepcopy(dummy_noappearance)
+    cos = cm.j["CityObjects"]
+    cos["102636712"]["children"] = ["2929", "myterrain01"]
+    cos["2929"]["parents"] = ["102636712"]
+    cos["myterrain01"]["parents"] = ["102636712"]
+    p = str(tmp_path / 'hierarchy.json')
+    with open(p, 'w') as fo:
+        cm.write(fo)
+    expected = cm.get_subset_cotype('TINRelief', exclude)
+    with open(p, 'r') as f:
+        s = cityjson.CityJSONStream(f).get_subset_cotype('TINRelief', exclude)
+        out = StringIO()
+        s.write(out)
+    j = json.loads(out.getvalue())
+    assert list(j["CityObjects"]) == list(expected.j["CityObjects"])
+    assert resolved(j) == resolved(expected.get_json())
+
+
+def resolved(j):
+    #-- the CityObjects with the coordinates instead of the indices of the vertices
+    def coordinates(b):
+        if isinstance(b, list):
+            return [coordinates(each) for each in b]
+        return j["vertices"][b]
+    cos = copy.deepcopy(j["CityObjects"])
+    for co in cos.values():
+        for g in co["geometry"]:
+            g["boundaries"] = coordinates(g["boundaries"])
+    return cos
+
+
+def test_stream_info_same_bbox(dummy_path, dummy):
+    with open(dummy_path, 'r') as f:
+        s = cityjson.CityJSONStream(f)
+        assert json.loads(s.get_info())["bbox"] == json.loads(dummy.get_info())["bbox"]
+        s = s.get_subset_cotype('Building')
+        assert json.loads(s.get_info())["bbox"] == json.loads(dummy.get_subset_cotype('Building').get_info())["bbox"]
+
+
+def test_stream_not_seekable(dummy_path, dummy, monkeypatch):
+    #-- the file is opened again at each pass, and closed
+    opened = []
+    def open_file(path, mode='r'):
+        f = open(path, mode)
+        opened.append(f)
+        return f
+    monkeypatch.setattr(cityjson.compression, "open_file", open_file)
+    with open(dummy_path, 'r') as f:
+        f.seekable = lambda: False
+        s = cityjson.CityJSONStream(f)
+        for i in range(2):
+            assert dict(s.iter_cityobjects()) == dummy.j["CityObjects"]
+        assert not f.closed
+    assert len(opened) == 2
+    assert all(f.closed for f in opened)
+
+
+def test_stream_duplicate_keys():
+    f = StringIO('{"type":"CityJSON","CityObjects":{"a":{"type":"Building","geometry":[]},"a":{"type":"Building","geometry":[]}},"vertices":[]}')
+    f.name = 'duplicates.json'
+    with pytest.raises(ValueError):
+        cityjson.CityJSONStream(f)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_skip_members(rotterdam_subset, chunk_size):
+    cos = dict(rotterdam_subset.j["CityObjects"])
+    cos['a"\\'] = {"type": "Building", "attributes": {"s": '}],:"\\', "é": "[{"}}
+    s = json.dumps({"CityObjects": cos, "x": 1}, indent=1)
+    sc = stream.Scanner(StringIO(s), chunk_size=chunk_size)
+    for key in sc.members():
+        assert key == "CityObjects"
+        members = sc.skip_members()
+        break
+    assert [m[0] for m in members] == list(cos)
+    for theid, start, end in members:
+        assert json.loads(s[start:end]) == cos[theid]
+    assert sc.peek() == ','
+
+
+@pytest.mark.parametrize("indent", [0, 2, 4])
+def test_write_same_as_dumps(rotterdam_subset, indent):
+    out = StringIO()
+    rotterdam_subset.write(out, indent=indent, chunk_size=10)
+    if indent == 0:
+        assert out.getvalue() == json.dumps(rotterdam_subset.get_json(), separators=(',',':'))
+    else:
+        assert out.getvalue() == json.dumps(rotterdam_subset.get_json(), indent=indent)
+
+
+def test_write_empty():
+    cm = cityjson.CityJSON()
+    out = StringIO()
+    cm.write(out, indent=2)
+    assert out.getvalue() == json.dumps(cm.get_json(), indent=2)
@@ -0,0 +1,68 @@
+import copy
+
+import numpy as np
+
+from cjio import cityjson
+
+
+def test_subset_copies_selection(dummy):
+    cm = copy.deepcopy(dummy)
+    before = copy.deepcopy(cm.j)
+    s = cm.get_subset_ids(["102636712", "onebigtree-template"])
+    s = s.get_subset_cotype("Building")
+    assert list(s.j["CityObjects"]) == ["102636712"]
+    #-- the source is not modified, the subset shares nothing with it
+    assert cm.j["CityObjects"] == before["CityObjects"]
+    assert cm.j["metadata"] == before["metadata"]
+    assert np.array_equal(cm.j["vertices"], before["vertices"])
+    assert s.j["CityObjects"]["102636712"] is not cm.j["CityObjects"]["102636712"]
+    assert s.j["metadata"] is not cm.j["metadata"]
+    assert np.array_equal(s.get_centroid("102636712"), cm.get_centroid("102636712"))
+    assert len(s.j["vertices"]) < len(cm.j["vertices"])
+
+
+def hierarchy_model(dummy):
+    #-- building 102636712 > part 2929 > installation 801, and a group of mylake
+    cm = copy.deepcopy(dummy)
+    cos = cm.j["CityObjects"]
+    cos["102636712"]["children"] = ["2929"]
+    cos["2929"]["parents"] = ["102636712"]
+    cos["2929"]["children"] = ["801"]
+    cos["801"]["parent"] = "2929"
+    cos["mygroup1"]["members"] = ["mylake", "missing"]
+    return cm
+
+
+def test_hierarchy_closure(dummy):
+    cm = hierarchy_model(dummy)
+    h = cm.hierarchy_index()
+    assert h.parents["801"] == ["2929"]
+    assert h.members["mygroup1"] == ["mylake"]
+    family = {"102636712", "2929", "801"}
+    for theid in family:
+        assert h.closure([theid]) == family
+    assert h.closure(["mygroup1"]) == {"mygroup1", "mylake"}
+    assert h.roots() == {"102636712": "102636712", "2929": "102636712", "801": "102636712"}
+    assert cm.hierarchy_index() is h
+
+
+def test_subset_hierarchy(dummy):
+    cm = hierarchy_model(dummy)
+    family = {"102636712", "2929", "801"}
+    assert set(cm.get_subset_ids(["801"]).j["CityObjects"]) == family
+    assert family.isdisjoint(cm.get_subset_ids(["2929"], exclude=True).j["CityObjects"])
+    ids, bboxes, centroids = cm.get_cityobjects_extents()
+    c = centroids[ids.index("2929")]
+    s = cm.get_subset_bbox((c[0], c[1], c[0] + 1e-6, c[1] + 1e-6))
+    assert family <= set(s.j["CityObjects"])
+
+
+def test_subset_model_order(rotterdam_subset):
+    ids = list(rotterdam_subset.j["CityObjects"])
+    s = rotterdam_subset.get_subset_ids(ids[::-1][:10])
+    assert list(s.j["CityObjects"]) == [theid for theid in ids if theid in ids[-10:]]
+    s = rotterdam_subset.get_subset_ids(ids[:10], exclude=True)
+    assert list(s.j["CityObjects"]) == ids[10:]
+    b = rotterdam_subset.get_bbox()
+    s = rotterdam_subset.get_subset_bbox((b[0] - 1, b[1] - 1, b[3] + 1, b[4] + 1))
+    assert list(s.j["CityObjects"]) == ids
@@ -0,0 +1,75 @@
+import copy
+import json
+import os
+
+import numpy as np
+import pytest
+
+from cjio import cityjson
+from cjio import spatialindex
+
+
+def test_quadtree():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0, 100, (500, 2))
+    leaves = spatialindex.quadtree(points, (0, 0, 100, 100), 20)
+    assert [key for key, b, indices in leaves] == sorted(key for key, b, indices in leaves)
+    assert np.array_equal(np.sort(np.concatenate([indices for key, b, indices in leaves])), np.arange(500))
+    for key, b, indices in leaves:
+        assert len(indices) <= 20
+        p = points[indices]
+        assert (p >= b[:2]).all() and (p <= b[2:]).all()
+    #-- the same point can't be split
+    assert len(spatialindex.quadtree(np.zeros((5, 2)), (0, 0, 0, 0), 2)) == 1
+
+
+def test_grid():
+    points = np.array([[0, 0], [15, 1], [5, 5], [25, 12]])
+    cells = spatialindex.grid(points, (0, 0, 25, 12), 10)
+    assert [(key, indices.tolist()) for key, b, indices in cells] == [("0_0", [0, 2]), ("1_0", [1]), ("2_1", [3])]
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_write_tiles(rotterdam_subset, tmp_path, processes):
+    cm = copy.deepcopy(rotterdam_subset)
+    before = copy.deepcopy(cm.j)
+    index = cm.write_tiles(str(tmp_path), max_objects=4, processes=processes)
+    assert len(index) > 1
+    assert json.load(open(str(tmp_path / cityjson.TILES_INDEX)))["tiles"] == index
+    #-- the model is not modified
+    assert cm.j["CityObjects"] == before["CityObjects"]
+    assert np.array_equal(cm.j["vertices"], before["vertices"])
+    ids = []
+    for tile in index:
+        with open(str(tmp_path / tile["file"])) as f:
+            part = cityjson.CityJSON(file=f)
+        assert len(part.j["CityObjects"]) == tile["cityobjects"]
+        assert part.j["metadata"]["geographicalExtent"] == tile["bbox"]
+        for theid, co in part.j["CityObjects"].items():
+            assert np.array_equal(part.get_centroid(theid), cm.get_centroid(theid))
+            for child in co.get("children", []):
+                assert child in part.j["CityObjects"]
+        ids.extend(part.j["CityObjects"])
+    assert sorted(ids) == sorted(cm.j["CityObjects"])
+
+
+def test_tiles_hierarchy(dummy):
+    cm = copy.deepcopy(dummy)
+    cos = cm.j["CityObjects"]
+    cos["102636712"]["children"] = ["2929"]
+    cos["2929"]["parents"] = ["102636712"]
+    cos["801"]["parents"] = ["itcanbeastringtoo"]
+    tiles = cm.get_tiles(max_objects=1)
+    assert len(tiles) > 1
+    tile = {theid: key for key, b, ids in tiles for theid in ids}
+    assert len(tile) == len(cos)
+    assert tile["2929"] == tile["102636712"]
+    assert tile["801"] == tile["itcanbeastringtoo"]
+    #-- the members of a group (and their hierarchies) are with the group
+    assert tile["mygroup1"] == tile["102636712"] == tile["mylake"]
+    cos["mygroup1"]["members"].append("801")
+    cm.invalidate_hierarchy_index()
+    tiles = cm.get_tiles(max_objects=1)
+    assert len(tiles) > 1
+    tile = {theid: key for key, b, ids in tiles for theid in ids}
+    assert tile["mygroup1"] == tile["2929"] == tile["mylake"] == tile["itcanbeastringtoo"]
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from cjio import cityjson
+from cjio import triangulation
+
+
+pytestmark = pytest.mark.skipif(not triangulation.MODULE_EARCUT_AVAILABLE, reason="mapbox_earcut missing")
+
+
+@pytest.fixture
+def vertices():
+    #-- a vertical square with a square hole, and a triangle
+    return np.array([[0, 0, 0], [4, 0, 0], [4, 0, 4], [0, 0, 4],
+                     [1, 0, 1], [1, 0, 3], [3, 0, 3], [3, 0, 1],
+                     [0, 0, 9], [1, 1, 9], [0, 1, 9]], dtype=np.int64)
+
+
+def test_surfaces_of():
+    geoms = [
+        {"type": "MultiSurface", "boundaries": [[[0, 1, 2, 3], [4, 5, 6, 7]], [[8, 9, 10]]]},
+        {"type": "MultiPoint", "boundaries": [0, 1]},
+        {"type": "Solid", "boundaries": [[[[8, 9, 10]]], [[[0, 1, 2]]]]}
+    ]
+    geoms, surfaces, rings, indices = triangulation.surfaces_of(geoms)
+    assert geoms.tolist() == [0, 2, 2, 4]
+    assert surfaces.tolist() == [0, 2, 3, 4, 5]
+    assert rings.tolist() == [0, 4, 8, 11, 14, 17]
+    assert indices.tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 8, 9, 10, 0, 1, 2]
+
+
+def test_triangulate(vertices):
+    #-- the last surface is degenerate (3 times the same vertex, in 2 rings)
+    indices = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 0, 0, 0])
+    surfaces = np.array([0, 2, 3, 5])
+    rings = np.array([0, 4, 8, 11, 12, 14])
+    triangles, owners = triangulation.triangulate(vertices, surfaces, rings, indices)
+    assert owners.tolist() == [0] * 8 + [1]
+    assert triangles[-1].tolist() == [8, 9, 10]
+    #-- the area of the square minus the hole
+    p = vertices[triangles[:8]].astype(float)
+    area = np.linalg.norm(np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]), axis=1).sum() / 2
+    assert area == pytest.approx(12.0)
+
+
+def test_normals(vertices):
+    n, valid = triangulation.normals(vertices[[0, 1, 2, 3, 8, 8, 8]], np.array([0, 4, 7]))
+    assert valid.tolist() == [True, False]
+    assert np.abs(n[0]).tolist() == [0.0, 1.0, 0.0]
+
+
+def test_write_obj(rotterdam_subset, monkeypatch):
+    one = rotterdam_subset.export2obj(processes=1).getvalue()
+    monkeypatch.setattr(cityjson, "OBJ_CHUNK", 3)
+    monkeypatch.setattr(cityjson, "OBJ_WINDOW", 1)
+    assert rotterdam_subset.export2obj(processes=2).getvalue() == one
+    assert one.count('\no ') + one.startswith('o ') == sum(len(co['geometry']) for co in rotterdam_subset.j['CityObjects'].values())
+
+
+def test_cache(rotterdam_subset, tmp_path):
+    path = str(tmp_path / 'rotterdam.json.tri')
+    one = rotterdam_subset.export2obj(processes=1).getvalue()
+    cache = triangulation.Cache(path)
+    assert rotterdam_subset.export2obj(processes=1, cache=cache).getvalue() == one
+    n = len(cache)
+    assert n > 0
+    cache.save()
+    cache = triangulation.Cache(path)
+    assert len(cache) == n
+    cache.begin()
+    assert rotterdam_subset.export2obj(processes=1, cache=cache).getvalue() == one
+    added, hits = cache.changes()
+    assert (len(added) == 0) and (len(set(hits)) == n)
+    #-- the least recently used are dropped
+    cache.put(b'0' * 16, np.zeros((1, 3), dtype=np.uint32))
+    cache.generation += 1
+    cache.put(b'1' * 16, np.zeros((1, 3), dtype=np.uint32))
+    cache.max_size = 12
+    cache.save()
+    assert list(triangulation.Cache(path).entries) == [b'1' * 16]
+
+
+def test_cache_processes(rotterdam_subset, monkeypatch):
+    one = rotterdam_subset.export2obj().getvalue()
+    cache = triangulation.Cache()
+    rotterdam_subset.export2obj(cache=cache)
+    n = len(cache)
+    monkeypatch.setattr(cityjson, "OBJ_CHUNK", 3)
+    #-- each chunk gets only its entries, the hits come back
+    cache.generation += 1
+    assert rotterdam_subset.export2obj(processes=2, cache=cache).getvalue() == one
+    assert len(cache) == n
+    assert all(e[1] == cache.generation for e in cache.entries.values())
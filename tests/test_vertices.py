@@ -0,0 +1,182 @@
+import copy
+
+import numpy as np
+import pytest
+
+from cjio import cityjson
+from cjio import boundaries
+
+
+def test_vertices_array(dummy, rotterdam_subset):
+    assert dummy.j["vertices"].dtype == np.float64
+    assert rotterdam_subset.j["vertices"].dtype == np.int64
+    assert rotterdam_subset.j["vertices"].shape[1] == 3
+    assert cityjson.CityJSON().j["vertices"].shape == (0, 3)
+    assert cityjson.vertices_array([[0, 1, 2]]).dtype == np.int64
+    assert cityjson.vertices_array([[0, 1, 2.5]]).dtype == np.float64
+
+
+def test_cityjson_j_not_modified():
+    j = {"type": "CityJSON", "version": "1.0", "CityObjects": {}, "vertices": [[0, 1, 2]]}
+    cm = cityjson.CityJSON(j=j)
+    assert j["vertices"] == [[0, 1, 2]]
+    #-- the integers are saved as integers
+    assert cm.j["vertices"].tolist() == [[0, 1, 2]]
+    assert isinstance(cm.j["vertices"].tolist()[0][0], int)
+
+
+def test_compress_decompress(dummy):
+    cm = copy.deepcopy(dummy)
+    #-- compress() removes the orphans
+    cm.remove_orphan_vertices()
+    bbox = cm.calculate_bbox()
+    cm.compress(3)
+    assert cm.j["vertices"].dtype == np.int64
+    assert np.allclose(cm.calculate_bbox(), bbox, atol=1e-3)
+    cm.decompress()
+    assert cm.j["vertices"].dtype == np.float64
+    assert np.allclose(cm.calculate_bbox(), bbox, atol=1e-3)
+
+
+def test_remove_duplicate_vertices():
+    cm = cityjson.CityJSON()
+    cm.j["vertices"] = cityjson.vertices_array([[1, 1, 1], [0, 0, 0], [1, 1, 1], [2, 2, 2], [0, 0, 0]])
+    cm.j["CityObjects"]["a"] = {"type": "Building", "geometry": [
+        {"type": "MultiSurface", "lod": 1, "boundaries": [[[0, 1, 2, 3, 4]]]}]}
+    assert cm.remove_duplicate_vertices() == 2
+    #-- the order of the first occurrences is kept
+    assert cm.j["vertices"].tolist() == [[1, 1, 1], [0, 0, 0], [2, 2, 2]]
+    assert cm.j["CityObjects"]["a"]["geometry"][0]["boundaries"] == [[[0, 1, 0, 2, 1]]]
+
+
+def test_translate_compressed(rotterdam_subset):
+    cm = copy.deepcopy(rotterdam_subset)
+    v = cm.j["vertices"].copy()
+    cm.translate(None, True)
+    assert np.array_equal(cm.j["vertices"], v)
+    assert np.allclose(cm.calculate_bbox()[:3], [0, 0, 0])
+
+
+@pytest.mark.parametrize("model", ["dummy", "rotterdam_subset"])
+def test_cityobjects_extents(request, model):
+    cm = request.getfixturevalue(model)
+    ids, bboxes, centroids = cm.get_cityobjects_extents()
+    assert bboxes.shape == (len(cm.j["CityObjects"]), 6)
+    for theid, bbox, centroid in zip(ids, bboxes, centroids):
+        c = cm.get_centroid(theid)
+        if c is None:
+            assert np.isnan(bbox).all()
+        else:
+            assert np.allclose(centroid, c)
+            assert (bbox[:3] <= centroid).all() and (centroid <= bbox[3:]).all()
+
+
+def test_weld_vertices():
+    v = np.array([[0, 0, 0], [0.05, 0, 0], [1, 1, 1], [0.099, 0, 0], [0.19, 0, 0], [5, 5, 5], [1, 1, 1.0]])
+    #-- not transitively: 0.19 is close to 0.099 but too far from 0
+    assert cityjson.weld_vertices(v, 0.1).tolist() == [0, 0, 2, 0, 4, 5, 2]
+    assert cityjson.weld_vertices(v, 0.001).tolist() == [0, 1, 2, 3, 4, 5, 2]
+    #-- a chain of close vertices
+    rng = np.random.default_rng(1)
+    v = np.cumsum(rng.uniform(0, 0.05, (1000, 3)), axis=0)
+    v = np.concatenate((v, rng.uniform(0, 1, (1000, 3))))
+    labels = cityjson.weld_vertices(v, 0.1)
+    assert (labels <= np.arange(len(v))).all()
+    assert (labels[labels] == labels).all()
+    assert (np.linalg.norm(v - v[labels], axis=1) <= 0.1).all()
+    assert len(np.unique(labels)) < len(v)
+
+
+def test_remove_duplicate_vertices_tolerance(rotterdam_subset):
+    cm = copy.deepcopy(rotterdam_subset)
+    exact = copy.deepcopy(rotterdam_subset)
+    exact.remove_duplicate_vertices()
+    assert cm.remove_duplicate_vertices(0.5) > 0
+    assert len(cm.j["vertices"]) < len(exact.j["vertices"])
+    assert np.allclose(cm.get_cityobjects_extents()[2], exact.get_cityobjects_extents()[2], atol=0.5)
+
+
+def test_compact_vertices(dummy):
+    cm = copy.deepcopy(dummy)
+    used = np.unique(boundaries.Geometries.of_cityobjects(cm.j).indices)
+    v = cm.j["vertices"][used]
+    assert cm.compact_vertices() == len(dummy.j["vertices"]) - len(used)
+    assert np.array_equal(cm.j["vertices"], v)
+    assert np.array_equal(np.unique(boundaries.Geometries.of_cityobjects(cm.j).indices), np.arange(len(v)))
+    assert cm.compact_vertices() == 0
+
+
+def test_compress_error(dummy_noappearance):
+    cm = copy.deepcopy(dummy_noappearance)
+    cm.decompress()
+    cm.j["vertices"][-1] += 0.0004
+    emax, rms = cm.compress(3)
+    assert 0 < emax <= 0.0005 + 1e-9
+    assert 0 < rms <= emax
+
+
+def test_compress_auto(dummy_noappearance):
+    cm = copy.deepcopy(dummy_noappearance)
+    cm.decompress()
+    cm.j["vertices"][-1] += 0.04
+    emax, rms = cm.compress(None, max_error=0.01)
+    assert cm.j["transform"]["scale"][0] == 0.01
+    assert emax <= 0.01
+    cm = copy.deepcopy(dummy_noappearance)
+    cm.decompress()
+    cm.j["vertices"][-1] += 1e-12
+    with pytest.raises(ValueError, match="No number of digits"):
+        cm.compress(None, max_error=1e-14)
+
+
+def test_compress_digits_max_error(dummy_noappearance):
+    cm = copy.deepcopy(dummy_noappearance)
+    cm.decompress()
+    cm.j["vertices"][-1] += 0.04
+    with pytest.raises(ValueError, match="With 1 digits the error is"):
+        cm.compress(1, max_error=0.01)
+    assert "transform" not in cm.j
+
+
+def test_reproject(rotterdam_subset, monkeypatch):
+    cm = copy.deepcopy(rotterdam_subset)
+    cm.update_bbox()
+    scale = cm.j["transform"]["scale"]
+    cm.reproject(7415)
+    assert cm.get_epsg() == 7415
+    assert cm.j["transform"]["scale"] == scale
+    assert cm.j["vertices"].dtype.kind == 'i'
+    assert cm.j["metadata"]["geographicalExtent"] == pytest.approx(cm.calculate_bbox(), abs=1e-3)
+    #-- in chunks, across processes
+    cm1 = copy.deepcopy(rotterdam_subset)
+    cm1.decompress()
+    cm2 = copy.deepcopy(cm1)
+    cm1.reproject(7415, processes=1)
+    monkeypatch.setattr(cityjson, "REPROJECT_CHUNK", 100)
+    cm2.reproject(7415, processes=2)
+    assert np.array_equal(cm1.j["vertices"], cm2.j["vertices"])
+
+
+def test_query_bbox(rotterdam_subset):
+    cm = copy.deepcopy(rotterdam_subset)
+    ids, bboxes, centroids = cm.get_cityobjects_extents()
+    rng = np.random.default_rng(1)
+    lo = bboxes[:, :2].min(axis=0)
+    hi = bboxes[:, 3:5].max(axis=0)
+    for k in range(20):
+        a, b = np.sort(rng.uniform(lo, hi, (2, 2)), axis=0)
+        w = (a[0], a[1], b[0], b[1])
+        c = [ids[i] for i in range(len(ids)) if (w[0] <= centroids[i, 0] < w[2]) and (w[1] <= centroids[i, 1] < w[3])]
+        assert cm.query_bbox(*w) == c
+        c = [ids[i] for i in range(len(ids)) if (bboxes[i, 0] <= w[2]) and (bboxes[i, 3] >= w[0]) and (bboxes[i, 1] <= w[3]) and (bboxes[i, 4] >= w[1])]
+        assert cm.query_bbox(*w, mode='intersects') == c
+        c = [ids[i] for i in range(len(ids)) if (bboxes[i, 0] >= w[0]) and (bboxes[i, 3] <= w[2]) and (bboxes[i, 1] >= w[1]) and (bboxes[i, 4] <= w[3])]
+        assert cm.query_bbox(*w, mode='within') == c
+    with pytest.raises(ValueError):
+        cm.query_bbox(*w, mode='nearest')
+    #-- rebuilt after an edit
+    tree = cm.spatial_index()[3]
+    assert cm.spatial_index()[3] is tree
+    cm.translate([1000.0, 0.0, 0.0], False)
+    assert cm.spatial_index()[3] is not tree
+    assert len(cm.query_bbox(lo[0], lo[1], hi[0], hi[1], mode='intersects')) < len(ids)